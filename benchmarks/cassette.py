@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+import threading
+
+from typing import Dict, Optional
+
+
+class Cassette:
+    """Recorded upstream responses, one JSON line per request key.
+
+    In "record" mode the stand-in servers forward requests they have no recording
+    for to the real provider and append the response; in "replay" mode they only
+    serve recordings. Keys are built from the parts of a request that determine
+    its response (never from request ids or API keys), see `Cassette.key`.
+
+    Args:
+        path (str): .jsonl file holding the recordings
+        mode (str): "record" or "replay"
+    """
+
+    def __init__(self, path: str, mode: str = "replay"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"mode must be 'record' or 'replay', not {mode!r}")
+        self.path = path
+        self.mode = mode
+        self._entries: Optional[Dict[str, Dict]] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def _load(self) -> Dict[str, Dict]:
+        if self._entries is None:
+            self._entries = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    for line in f:
+                        entry = json.loads(line)
+                        self._entries[entry["key"]] = entry
+        return self._entries
+
+    def get(self, key: str) -> Optional[Dict]:
+        return self._load().get(key)
+
+    def put(self, key: str, entry: Dict) -> None:
+        entry = {"key": key, **entry}
+        with self._lock:
+            self._load()[key] = entry
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def __len__(self) -> int:
+        return len(self._load())
@@ -0,0 +1,78 @@
+from typing import Dict, List
+
+import numpy as np
+
+# direction in which each reported metric gets better
+METRICS = {
+    "wall_s": "lower",
+    "requests": "lower",
+    "requests_per_s": "higher",
+    "p50_ms": "lower",
+    "p99_ms": "lower",
+    "bytes_in": "lower",
+    "bytes_out": "lower",
+    "peak_rss_mb": "lower",
+}
+
+
+def summarize(name: str, wall_s: float, rows: int, peak_rss_mb: float, stats: List[Dict]) -> Dict:
+    """One benchmark's numbers from its wall time, the rows the fetcher returned,
+    the peak RSS of the process that ran it and the stats of every stand-in server
+    (see `StandInServer.stats`)."""
+    latencies = np.array([latency for s in stats for latency in s["latencies"]]) * 1000
+    statuses = {}
+    for s in stats:
+        for status, count in s["statuses"].items():
+            statuses[status] = statuses.get(status, 0) + count
+    requests = int(sum(s["requests"] for s in stats))
+    return {
+        "name": name,
+        "rows": rows,
+        "wall_s": round(wall_s, 4),
+        "requests": requests,
+        "requests_per_s": round(requests / wall_s, 2) if wall_s > 0 else 0.0,
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3) if latencies.size else 0.0,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3) if latencies.size else 0.0,
+        "bytes_in": int(sum(s["bytes_in"] for s in stats)),
+        "bytes_out": int(sum(s["bytes_out"] for s in stats)),
+        "peak_rss_mb": round(peak_rss_mb, 1),
+        "statuses": statuses,
+    }
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float = 0.2) -> List[str]:
+    """Regressions of `results` against `baseline`: every metric that got worse by
+    more than `tolerance` (relative), plus benchmarks that now return fewer rows."""
+    previous = {result["name"]: result for result in baseline}
+    regressions = []
+    for result in results:
+        before = previous.get(result["name"])
+        if before is None or "error" in result or "error" in before:
+            continue
+        if result["rows"] < before["rows"]:
+            regressions.append(f"{result['name']}: rows {before['rows']} -> {result['rows']}")
+        for metric, better in METRICS.items():
+            old, new = before.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (better == "lower" and change > tolerance) or (
+                better == "higher" and change < -tolerance
+            ):
+                regressions.append(f"{result['name']}: {metric} {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def format_table(results: List[Dict]) -> str:
+    columns = ["name", "rows", "wall_s", "requests", "requests_per_s", "p50_ms", "p99_ms",
+               "bytes_out", "peak_rss_mb"]
+    lines = [columns]
+    for result in results:
+        if "error" in result:
+            lines.append([result["name"], result["error"]] + [""] * (len(columns) - 2))
+        else:
+            lines.append([str(result[column]) for column in columns])
+    widths = [max(len(str(line[i])) for line in lines) for i in range(len(columns))]
+    return "\n".join(
+        "  ".join(str(value).ljust(width) for value, width in zip(line, widths)) for line in lines
+    )
@@ -0,0 +1,268 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+import traceback
+
+from typing import Callable, Dict, List
+
+from benchmarks.cassette import Cassette
+from benchmarks.metrics import compare, format_table, summarize
+from benchmarks.servers import (
+    BLOCK_TIME,
+    GENESIS_TIMESTAMP,
+    EtherscanServer,
+    GraphQLServer,
+    RPCServer,
+)
+
+# measures the utils fetchers against local stand-in servers instead of real
+# providers. every benchmark runs in a fresh process (so peak memory is its own)
+# with the provider urls of the utils modules pointed at the stand-ins.
+#
+#   python -m benchmarks.run                         # all benchmarks, synthetic data
+#   python -m benchmarks.run curve_fees --latency 0.05 --error-rate 0.02
+#   python -m benchmarks.run --output new.json --baseline benchmarks/baseline.json
+#   python -m benchmarks.run --cassettes benchmarks/cassettes --record \
+#       --rpc-upstream https://eth-mainnet.alchemyapi.io/v2/$ALCHEMY_API_KEY \
+#       --graphql-upstream https://api.thegraph.com \
+#       --etherscan-upstream https://api.etherscan.io --etherscan-upstream-key $ETHERSCAN_TOKEN
+#   python -m benchmarks.run --cassettes benchmarks/cassettes   # replay recordings
+
+POOL = "0x6c3f90f043a72fa612cbac8115ee7e52bde6e490"
+ADDRESS = "0xd533a949740bb3306d119cc777fa900ba034cd52"
+BENCHMARKS: Dict[str, Callable] = {}
+
+
+def benchmark(fn: Callable) -> Callable:
+    BENCHMARKS[fn.__name__] = fn
+    return fn
+
+
+def _point_at_stand_ins(urls: Dict[str, str]) -> None:
+    """Redirects the provider urls the utils modules read to the stand-in servers."""
+    import utils.eth_blocks_utils
+    import utils.network_utils
+    import utils.subgraph_utils.common
+
+    utils.network_utils.ALCHEMY_MAINNET_RPC = urls["rpc"] + "/v2/{}"
+    utils.subgraph_utils.common.CRV_EMISSIONS = (
+        urls["graphql"] + "/subgraphs/name/convex-community/crv-emissions"
+    )
+    utils.eth_blocks_utils.ETH_BLOCKS_SUBGRAPH = (
+        urls["graphql"] + "/subgraphs/name/blocklytics/ethereum-blocks"
+    )
+    try:
+        import utils.etherscan_utils
+    except ImportError:
+        # py-etherscan-api is not installed, the etherscan benchmarks report the error
+        return
+    utils.etherscan_utils.ETHERSCAN_API = urls["etherscan"] + "/api"
+
+
+# ------- benchmarks --------- #
+
+
+@benchmark
+def asset_transfers(scale: float, scratch: str) -> int:
+    from utils.alchemy_tools import get_asset_transfers
+
+    start = 14_000_000
+    return len(get_asset_transfers(None, None, start, start + int(500_000 * scale)))
+
+
+@benchmark
+def asset_transfers_unsharded(scale: float, scratch: str) -> int:
+    from utils.alchemy_tools import iter_asset_transfers
+
+    start = 14_000_000
+    pages = iter_asset_transfers(
+        from_block=start, to_block=start + int(500_000 * scale), n_shards=1
+    )
+    return sum(len(page) for page in pages)
+
+
+@benchmark
+def etherscan_get_tx(scale: float, scratch: str) -> int:
+    from utils.etherscan_utils import TransactionScraper
+
+    scraper = TransactionScraper(address=ADDRESS, api_key="bench")
+    scraper.PREFIX = os.environ["BENCH_ETHERSCAN_URL"] + "/api?"
+    return len(scraper.get_tx(start_block=15_000_000 - int(2_500_000 * scale)))
+
+
+@benchmark
+def etherscan_fetcher(scale: float, scratch: str) -> int:
+    from utils.etherscan_utils import EtherscanTxFetcher
+
+    fetcher = EtherscanTxFetcher(api_key="bench", path=os.path.join(scratch, "etherscan"))
+    return len(fetcher.get_txes(ADDRESS, 15_000_000 - int(2_500_000 * scale)))
+
+
+@benchmark
+def ethtx_receipts(scale: float, scratch: str) -> int:
+    from utils.async_utils import get_ethtx_receipt
+
+    hashes = [f"0x{i:064x}" for i in range(int(2000 * scale))]
+    return len(get_ethtx_receipt(hashes))
+
+
+@benchmark
+def curve_fees(scale: float, scratch: str) -> int:
+    from utils.subgraph_utils.common import get_curve_fees
+
+    return len(get_curve_fees(POOL))
+
+
+@benchmark
+def block_lookups_subgraph(scale: float, scratch: str) -> int:
+    from utils.eth_blocks_utils import get_block_for_timestamp
+
+    timestamps = range(GENESIS_TIMESTAMP, GENESIS_TIMESTAMP + 86400 * 365, 86400)
+    return len([get_block_for_timestamp(t) for t in list(timestamps)[: int(200 * scale)]])
+
+
+@benchmark
+def block_lookups_index(scale: float, scratch: str) -> int:
+    import numpy as np
+
+    from utils.block_index import BlockTimestampIndex
+
+    last_block = int(20_000 * scale)
+    index = BlockTimestampIndex(path=os.path.join(scratch, "blocks"))
+    index.sync(to_block=last_block, rpc_url=os.environ["BENCH_RPC_URL"] + "/v2/bench")
+    timestamps = np.arange(GENESIS_TIMESTAMP, GENESIS_TIMESTAMP + last_block * BLOCK_TIME, 60)
+    return len(index.block_after(timestamps))
+
+
+# ------- runner --------- #
+
+
+def _child(name: str, urls: Dict[str, str], scale: float, results) -> None:
+    scratch = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    # credentials and caches of the benchmark process never touch the real ones
+    os.environ.update(
+        ALCHEMY_API_KEY="bench",
+        ETHERSCAN_TOKEN="bench",
+        ONCHAIN_CACHE_DIR=scratch,
+        BENCH_RPC_URL=urls["rpc"],
+        BENCH_ETHERSCAN_URL=urls["etherscan"],
+    )
+    try:
+        _point_at_stand_ins(urls)
+        start = time.perf_counter()
+        rows = BENCHMARKS[name](scale, scratch)
+        wall = time.perf_counter() - start
+    except ImportError as e:
+        # optional provider clients (py-etherscan-api) that are not installed
+        results.put({"name": name, "error": f"skipped ({e})"})
+        return
+    except Exception as e:
+        traceback.print_exc()
+        results.put({"name": name, "error": f"{type(e).__name__}: {e}"})
+        return
+    # ru_maxrss is in KiB on linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results.put({"name": name, "rows": rows, "wall_s": wall, "peak_rss_mb": peak})
+
+
+def run_benchmark(name: str, servers: Dict, scale: float = 1.0) -> Dict:
+    for server in servers.values():
+        server.reset()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    urls = {kind: server.url for kind, server in servers.items()}
+    process = context.Process(target=_child, args=(name, urls, scale, results))
+    process.start()
+    outcome = results.get()
+    process.join()
+    if "error" in outcome:
+        return outcome
+
+    stats = [server.stats() for server in servers.values()]
+    return summarize(name, outcome["wall_s"], outcome["rows"], outcome["peak_rss_mb"], stats)
+
+
+def make_servers(args) -> Dict:
+    def cassette(kind):
+        if not args.cassettes:
+            return None
+        mode = "record" if args.record else "replay"
+        return Cassette(os.path.join(args.cassettes, f"{kind}.jsonl"), mode)
+
+    options = {"latency": args.latency, "error_rate": args.error_rate, "seed": args.seed}
+    return {
+        "rpc": RPCServer(cassette=cassette("rpc"), upstream=args.rpc_upstream, **options),
+        "graphql": GraphQLServer(
+            cassette=cassette("graphql"), upstream=args.graphql_upstream, **options
+        ),
+        "etherscan": EtherscanServer(
+            cassette=cassette("etherscan"),
+            upstream=args.etherscan_upstream,
+            upstream_key=args.etherscan_upstream_key,
+            **options,
+        ),
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("benchmarks", nargs="*", help=f"any of {', '.join(BENCHMARKS)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="workload size factor")
+    parser.add_argument("--latency", type=float, default=0.01, help="seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 429s")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write results to this json file")
+    parser.add_argument("--baseline", help="results json to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--cassettes", help="directory of recorded responses")
+    parser.add_argument("--record", action="store_true", help="record into --cassettes")
+    parser.add_argument("--rpc-upstream")
+    parser.add_argument("--graphql-upstream")
+    parser.add_argument("--etherscan-upstream")
+    parser.add_argument(
+        "--etherscan-upstream-key",
+        default=os.environ.get("ETHERSCAN_TOKEN"),
+        help="api key sent upstream when recording, defaults to $ETHERSCAN_TOKEN",
+    )
+    args = parser.parse_args(argv)
+
+    names = args.benchmarks or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    servers = make_servers(args)
+    try:
+        for server in servers.values():
+            server.start()
+        results = []
+        for name in names:
+            results.append(run_benchmark(name, servers, args.scale))
+            print(format_table(results[-1:]).splitlines()[-1], flush=True)
+    finally:
+        for server in servers.values():
+            server.stop()
+
+    print()
+    print(format_table(results))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,599 @@
+import asyncio
+import json
+import multiprocessing
+import random
+import re
+import time
+import urllib.request
+from collections import Counter, deque
+
+from typing import Dict, List, Tuple
+
+from benchmarks.cassette import Cassette
+
+# the synthetic chain every stand-in server agrees on
+GENESIS_TIMESTAMP = 1438269973
+BLOCK_TIME = 13
+HEAD_BLOCK = 15_000_000
+RESULT_WINDOW = 10_000
+
+
+def block_timestamp(block: int) -> int:
+    return GENESIS_TIMESTAMP + BLOCK_TIME * block
+
+
+def _address(seed: int) -> str:
+    return "0x" + f"{seed & (2 ** 160 - 1):040x}"
+
+
+def _hash(*parts) -> str:
+    return "0x" + Cassette.key(*parts)
+
+
+class StandInServer:
+    """Local HTTP server standing in for a data provider, run in its own process so
+    it doesn't compete with the fetcher being measured for the GIL.
+
+    Every request can be delayed by `latency` seconds and answered with a 429 with
+    probability `error_rate` (or once more than `rate_limit` requests arrive within a
+    second). Responses come from the subclass' synthetic data, or from a cassette:
+    recorded from `upstream` in "record" mode, or replayed in "replay" mode. Only
+    responses the subclass deems `recordable` are written to the cassette, so
+    provider errors are passed through once instead of being replayed forever.
+
+    The server keeps per-request statistics (latency, bytes, statuses) that are
+    read and reset over GET /__stats__ and POST /__reset__.
+
+    Args:
+        latency (float): seconds added to every request
+        error_rate (float): probability of answering 429
+        rate_limit (float): requests per second before answering 429
+        cassette (Cassette): recorded responses
+        upstream (str): real provider to record from
+        seed (int): seed for the injected errors
+    """
+
+    name = "server"
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit: float = None,
+        cassette: Cassette = None,
+        upstream: str = None,
+        seed: int = 0,
+    ):
+        if cassette is not None and cassette.mode == "record" and upstream is None:
+            raise ValueError(f"{self.name}: recording needs an upstream url")
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.cassette = cassette
+        self.upstream = upstream
+        self.seed = seed
+        self.url = None
+        self._process = None
+
+    # ------- process control --------- #
+
+    def start(self) -> str:
+        context = multiprocessing.get_context("spawn")
+        ports = context.Queue()
+        self._process = context.Process(target=self._serve, args=(ports,), daemon=True)
+        self._process.start()
+        self.url = f"http://127.0.0.1:{ports.get(timeout=30)}"
+        return self.url
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self) -> Dict:
+        with urllib.request.urlopen(f"{self.url}/__stats__") as response:
+            return json.loads(response.read())
+
+    def reset(self) -> None:
+        request = urllib.request.Request(f"{self.url}/__reset__", method="POST")
+        urllib.request.urlopen(request).close()
+
+    def _serve(self, ports) -> None:
+        from aiohttp import web
+
+        self._random = random.Random(self.seed)
+        self._recent = deque()
+        self._reset_stats()
+
+        async def run():
+            app = web.Application(client_max_size=64 * 1024 ** 2)
+            app.router.add_get("/__stats__", self._stats_handler)
+            app.router.add_post("/__reset__", self._reset_handler)
+            app.router.add_route("*", "/{tail:.*}", self._handler)
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            ports.put(site._server.sockets[0].getsockname()[1])
+            while True:
+                await asyncio.sleep(3600)
+
+        asyncio.run(run())
+
+    # ------- request handling --------- #
+
+    def _reset_stats(self) -> None:
+        self._latencies: List[float] = []
+        self._statuses = Counter()
+        self._bytes_in = 0
+        self._bytes_out = 0
+
+    async def _stats_handler(self, request):
+        from aiohttp import web
+
+        return web.json_response(
+            {
+                "requests": len(self._latencies),
+                "latencies": self._latencies,
+                "statuses": dict(self._statuses),
+                "bytes_in": self._bytes_in,
+                "bytes_out": self._bytes_out,
+            }
+        )
+
+    async def _reset_handler(self, request):
+        from aiohttp import web
+
+        self._reset_stats()
+        return web.Response(text="ok")
+
+    def _throttled(self) -> bool:
+        now = time.monotonic()
+        if self.rate_limit is not None:
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - 1:
+                self._recent.popleft()
+            if len(self._recent) > self.rate_limit:
+                return True
+        return self._random.random() < self.error_rate
+
+    async def _handler(self, request):
+        from aiohttp import web
+
+        start = time.perf_counter()
+        body = await request.read()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if self._throttled():
+            status, payload, content_type = self.throttled_response()
+        else:
+            status, payload, content_type = await self.respond(request, body)
+
+        self._latencies.append(time.perf_counter() - start)
+        self._statuses[status] += 1
+        self._bytes_in += len(body) + len(request.raw_path)
+        self._bytes_out += len(payload)
+        return web.Response(status=status, body=payload, content_type=content_type)
+
+    def throttled_response(self) -> Tuple[int, bytes, str]:
+        return 429, b"Too Many Requests", "text/plain"
+
+    async def respond(self, request, body: bytes) -> Tuple[int, bytes, str]:
+        """Cassette lookup / recording around the synthetic handler, keyed by
+        `request_key`."""
+        if self.cassette is None:
+            return self.synthetic(request, body)
+
+        key = Cassette.key(self.name, *self.request_key(request, body))
+        entry = self.cassette.get(key)
+        if entry is None and self.cassette.mode == "record":
+            status, payload = await self._forward(request, body)
+            entry = {"status": status, "body": payload.decode()}
+            if self.recordable(status, payload):
+                self.cassette.put(key, entry)
+        if entry is None:
+            return 404, f"no recording for {request.path_qs}".encode(), "text/plain"
+        return entry["status"], entry["body"].encode(), "application/json"
+
+    async def _forward(self, request, body: bytes) -> Tuple[int, bytes]:
+        from aiohttp import ClientSession
+
+        async with ClientSession() as session:
+            async with session.request(
+                request.method, self.forward_url(request), data=body or None,
+                headers={"Content-Type": "application/json"},
+            ) as response:
+                return response.status, await response.read()
+
+    def forward_url(self, request) -> str:
+        """Upstream url a recorded request is sent to."""
+        return self.upstream + request.path_qs if request.path != "/" else self.upstream
+
+    def recordable(self, status: int, payload: bytes) -> bool:
+        """Whether an upstream response is a result worth keeping in the cassette."""
+        return status == 200
+
+    def request_key(self, request, body: bytes) -> tuple:
+        return request.method, request.path_qs, body.decode()
+
+    def synthetic(self, request, body: bytes) -> Tuple[int, bytes, str]:
+        raise NotImplementedError
+
+
+def _json(payload) -> Tuple[int, bytes, str]:
+    return 200, json.dumps(payload).encode(), "application/json"
+
+
+# ------- JSON-RPC --------- #
+
+
+class RPCServer(StandInServer):
+    """JSON-RPC endpoint (single and batch requests) serving a synthetic chain:
+    blocks with fixed block times, receipts for any hash and Alchemy asset transfers
+    every `transfer_every` blocks.
+
+    With a cassette, batches are split and every call is recorded / replayed on its
+    own, keyed by (method, params), so recordings survive changes in batching.
+
+    Args:
+        transfer_every (int): blocks between synthetic asset transfers
+        max_batch_size (int): larger batches are rejected, like most providers do
+    """
+
+    name = "rpc"
+
+    def __init__(self, transfer_every: int = 50, max_batch_size: int = 1000, **kwargs):
+        super().__init__(**kwargs)
+        self.transfer_every = transfer_every
+        self.max_batch_size = max_batch_size
+
+    async def respond(self, request, body: bytes) -> Tuple[int, bytes, str]:
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return _json({"jsonrpc": "2.0", "id": None, "error": {"code": -32700}})
+
+        calls = payload if isinstance(payload, list) else [payload]
+        if len(calls) > self.max_batch_size:
+            return _json({"jsonrpc": "2.0", "id": None, "error": {
+                "code": -32600, "message": f"batch larger than {self.max_batch_size}"
+            }})
+
+        if self.cassette is None:
+            responses = [self.call(call) for call in calls]
+        else:
+            responses = await self._cassette_calls(calls)
+        return _json(responses if isinstance(payload, list) else responses[0])
+
+    async def _cassette_calls(self, calls: List[Dict]) -> List[Dict]:
+        keys = [Cassette.key(self.name, c.get("method"), c.get("params")) for c in calls]
+        entries = [self.cassette.get(key) for key in keys]
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+
+        if missing and self.cassette.mode == "record":
+            from aiohttp import ClientSession
+
+            async with ClientSession() as session:
+                async with session.post(
+                    self.upstream, json=[calls[i] for i in missing]
+                ) as response:
+                    recorded = await response.json(content_type=None)
+            by_id = {item.get("id"): item for item in recorded}
+            for i in missing:
+                item = by_id.get(calls[i].get("id"), {})
+                entries[i] = {k: v for k, v in item.items() if k in ("result", "error")}
+                if "result" in entries[i]:
+                    self.cassette.put(keys[i], entries[i])
+
+        responses = []
+        for call, entry in zip(calls, entries):
+            if entry is None:
+                entry = {"error": {"code": -32000, "message": "no recording"}}
+            responses.append({"jsonrpc": "2.0", "id": call.get("id"), **entry})
+        return responses
+
+    def call(self, call: Dict) -> Dict:
+        method, params = call.get("method"), call.get("params") or []
+        handler = getattr(self, f"rpc_{method}", None)
+        if handler is None:
+            return {"jsonrpc": "2.0", "id": call.get("id"), "error": {
+                "code": -32601, "message": f"method {method} not found"
+            }}
+        return {"jsonrpc": "2.0", "id": call.get("id"), "result": handler(*params)}
+
+    # ------- methods --------- #
+
+    def rpc_eth_chainId(self):
+        return "0x1"
+
+    def rpc_eth_blockNumber(self):
+        return hex(HEAD_BLOCK)
+
+    def rpc_eth_getBlockByNumber(self, block, full=False):
+        number = HEAD_BLOCK if block == "latest" else int(block, 16)
+        if number > HEAD_BLOCK:
+            return None
+        return {
+            "number": hex(number),
+            "hash": _hash("block", number),
+            "timestamp": hex(block_timestamp(number)),
+            "transactions": [],
+        }
+
+    def rpc_eth_getTransactionReceipt(self, tx_hash):
+        block = int(tx_hash[-12:], 16) % HEAD_BLOCK
+        return {
+            "transactionHash": tx_hash,
+            "blockNumber": hex(block),
+            "blockHash": _hash("block", block),
+            "from": _address(int(tx_hash[2:42], 16)),
+            "to": _address(int(tx_hash[-40:], 16)),
+            "gasUsed": hex(21000 + block % 100_000),
+            "status": "0x1",
+            "logs": [],
+        }
+
+    def rpc_alchemy_getAssetTransfers(self, params):
+        lo = int(params.get("fromBlock", "0x0"), 16)
+        to_block = params.get("toBlock", "latest")
+        hi = HEAD_BLOCK if to_block == "latest" else int(to_block, 16)
+        max_count = int(params.get("maxCount", "0x3e8"), 16)
+
+        every = self.transfer_every
+        first = max(lo + (-lo) % every, int(params.get("pageKey", "0x0"), 16))
+        blocks = range(first, hi + 1, every)[:max_count]
+        transfers = [
+            {
+                "blockNum": hex(block),
+                "hash": _hash("tx", block),
+                "uniqueId": f"{_hash('tx', block)}:log:0",
+                "from": _address(block),
+                "to": _address(block * 7),
+                "value": block % 1000 + 0.5,
+                "asset": "CRV",
+                "category": "erc20",
+                "rawContract": {
+                    "address": "0xd533a949740bb3306d119cc777fa900ba034cd52",
+                    "value": hex(block * 10 ** 15),
+                    "decimal": "0x12",
+                },
+            }
+            for block in blocks
+        ]
+        result = {"transfers": transfers}
+        if len(transfers) == max_count and blocks[-1] + every <= hi:
+            result["pageKey"] = hex(blocks[-1] + every)
+        return result
+
+
+# ------- GraphQL --------- #
+
+ROOT_FIELD = re.compile(r"(?:(\w+)\s*:\s*)?(\w+)\s*\((.*?)\)\s*\{([^{}]*)\}", re.S)
+ARGUMENT = re.compile(r"(\w+)\s*:\s*(\{.*?\}|\"[^\"]*\"|[\w.-]+)", re.S)
+
+
+def _literal(value: str):
+    value = value.strip()
+    if value.startswith('"'):
+        return value[1:-1]
+    if value.startswith("{"):
+        return {k: _literal(v) for k, v in ARGUMENT.findall(value[1:-1])}
+    if value in ("true", "false"):
+        return value == "true"
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+def _matches(row: Dict, where: Dict) -> bool:
+    for condition, expected in where.items():
+        field, _, operator = condition.partition("_")
+        if field not in row:
+            field, operator = condition, ""
+        value = row.get(field)
+        if isinstance(value, str) and value.isdigit() and str(expected).isdigit():
+            value, expected = int(value), int(expected)
+        else:
+            value, expected = str(value), str(expected)
+        if operator == "" and value != expected:
+            return False
+        if operator == "gt" and not value > expected:
+            return False
+        if operator == "gte" and not value >= expected:
+            return False
+        if operator == "lt" and not value < expected:
+            return False
+        if operator == "lte" and not value <= expected:
+            return False
+    return True
+
+
+class GraphQLServer(StandInServer):
+    """GraphQL endpoint answering entity queries (aliases, `first`, `skip`, `orderBy`,
+    `where` with _gt/_gte/_lt/_lte filters and variables) from synthetic entities, or
+    serving recorded subgraph pages from a cassette.
+
+    Synthetic entities: `poolSnapshots` (`snapshots_per_pool` per pool, every 6500
+    blocks) and `blocks` (the synthetic chain).
+    """
+
+    name = "graphql"
+
+    def __init__(self, snapshots_per_pool: int = 2000, **kwargs):
+        super().__init__(**kwargs)
+        self.snapshots_per_pool = snapshots_per_pool
+
+    def request_key(self, request, body: bytes) -> tuple:
+        payload = json.loads(body or b"{}")
+        query = " ".join(payload.get("query", "").split())
+        return request.path, query, payload.get("variables") or {}
+
+    def recordable(self, status: int, payload: bytes) -> bool:
+        # indexing errors, timeouts and rate limits come back as a 200 with `errors`
+        if status != 200:
+            return False
+        try:
+            response = json.loads(payload)
+        except ValueError:
+            return False
+        return "data" in response and not response.get("errors")
+
+    def synthetic(self, request, body: bytes) -> Tuple[int, bytes, str]:
+        payload = json.loads(body or b"{}")
+        query = payload.get("query", "")
+        for name, value in (payload.get("variables") or {}).items():
+            query = query.replace(f"${name}", json.dumps(value))
+        # drop the operation's variable definitions, they are substituted above
+        query = re.sub(r"^\s*query\s*\([^)]*\)", "", query)
+
+        data = {}
+        for alias, entity, arguments, fields in ROOT_FIELD.findall(query):
+            args = {k: _literal(v) for k, v in ARGUMENT.findall(arguments)}
+            rows = self.entities(entity, args)
+            data[alias or entity] = [{f: row.get(f) for f in fields.split()} for row in rows]
+        return _json({"data": data})
+
+    def entities(self, entity: str, args: Dict) -> List[Dict]:
+        where = args.get("where") or {}
+        first = int(args.get("first", 100))
+        skip = int(args.get("skip", 0))
+        descending = args.get("orderDirection") == "desc"
+
+        if entity == "blocks":
+            return self._blocks(where, first, descending)
+        if entity != "poolSnapshots":
+            return []
+
+        pool = where.get("pool", "0x0")
+        rows = (
+            {
+                "id": f"{pool}-{i:08d}",
+                "pool": pool,
+                "block": str(10_000_000 + 6500 * i),
+                "timestamp": str(block_timestamp(10_000_000 + 6500 * i)),
+                "fees": str(1000 + i),
+            }
+            for i in range(self.snapshots_per_pool)
+        )
+        rows = [row for row in rows if _matches(row, where)]
+        order_by = args.get("orderBy", "id")
+        rows.sort(key=lambda row: int(row[order_by]) if row[order_by].isdigit() else row[order_by])
+        if descending:
+            rows.reverse()
+        return rows[skip : skip + first]
+
+    def _blocks(self, where: Dict, first: int, descending: bool) -> List[Dict]:
+        start = 0
+        if "number_gt" in where:
+            start = int(where["number_gt"]) + 1
+        if "timestamp_gt" in where:
+            start = max(start, (int(where["timestamp_gt"]) - GENESIS_TIMESTAMP) // BLOCK_TIME + 1)
+        numbers = range(start, min(start + first, HEAD_BLOCK + 1))
+        rows = [
+            {"id": _hash("block", n), "number": str(n), "timestamp": str(block_timestamp(n))}
+            for n in numbers
+        ]
+        return rows[::-1] if descending else rows
+
+
+# ------- Etherscan --------- #
+
+
+class EtherscanServer(StandInServer):
+    """Etherscan-style REST API: account txlist / txlistinternal / tokentx with
+    page/offset pagination and the 10,000 result window, and proxy eth_blockNumber.
+    Every address has a transaction every `tx_every` blocks. Like the real API, rate
+    limited requests are answered with status "0" and HTTP 200.
+
+    Recorded requests are forwarded with `upstream_key` in place of the fetcher's
+    api key, which only the stand-in accepts.
+    """
+
+    name = "etherscan"
+
+    def __init__(self, tx_every: int = 500, upstream_key: str = None, **kwargs):
+        kwargs.setdefault("rate_limit", 5)
+        super().__init__(**kwargs)
+        if self.cassette is not None and self.cassette.mode == "record" and not upstream_key:
+            raise ValueError(f"{self.name}: recording needs an upstream api key")
+        self.tx_every = tx_every
+        self.upstream_key = upstream_key
+
+    def throttled_response(self) -> Tuple[int, bytes, str]:
+        # etherscan signals rate limits in the body of a 200, not with a 429
+        return _json({"status": "0", "message": "NOTOK", "result": "Max rate limit reached"})
+
+    def request_key(self, request, body: bytes) -> tuple:
+        query = {k: v for k, v in request.query.items() if k != "apikey"}
+        return request.path, sorted(query.items())
+
+    def forward_url(self, request) -> str:
+        return self.upstream + str(request.rel_url.update_query(apikey=self.upstream_key))
+
+    def recordable(self, status: int, payload: bytes) -> bool:
+        # errors (rate limits, invalid keys, result window) come back as a 200 with
+        # status "0"; so do empty pages, which are results
+        if status != 200:
+            return False
+        try:
+            response = json.loads(payload)
+        except ValueError:
+            return False
+        if "status" not in response:
+            # proxy module, answered in JSON-RPC form
+            return "result" in response and "error" not in response
+        return response["status"] == "1" or response.get("message") == "No transactions found"
+
+    def synthetic(self, request, body: bytes) -> Tuple[int, bytes, str]:
+        query = request.query
+        if query.get("module") == "proxy" and query.get("action") == "eth_blockNumber":
+            return _json({"jsonrpc": "2.0", "id": 83, "result": hex(HEAD_BLOCK)})
+        if query.get("module") != "account":
+            return _json({"status": "0", "message": "NOTOK", "result": "Error! Invalid module"})
+
+        page = int(query.get("page", 1))
+        offset = int(query.get("offset", RESULT_WINDOW))
+        if page * offset > RESULT_WINDOW:
+            return _json({
+                "status": "0",
+                "message": "NOTOK",
+                "result": "Result window is too large, PageNo x Offset size must be less "
+                "than or equal to 10000",
+            })
+
+        address = query.get("address", "0x0").lower()
+        lo = int(query.get("startblock", 0))
+        end = query.get("endblock", "latest")
+        hi = HEAD_BLOCK if end in ("latest", "99999999") else min(int(end), HEAD_BLOCK)
+        phase = int(address[-4:], 16) % self.tx_every
+        first = lo + (phase - lo) % self.tx_every
+        blocks = range(first, hi + 1, self.tx_every)
+        if query.get("sort") == "desc":
+            blocks = blocks[::-1]
+        blocks = blocks[(page - 1) * offset : page * offset]
+        if not blocks:
+            return _json({"status": "0", "message": "No transactions found", "result": []})
+
+        txes = [
+            {
+                "blockNumber": str(block),
+                "timeStamp": str(block_timestamp(block)),
+                "hash": _hash("tx", address, block),
+                "from": address if block % 2 else _address(block),
+                "to": _address(block) if block % 2 else address,
+                "value": str(block * 10 ** 12),
+                "gas": "21000",
+                "gasPrice": str(10 ** 10),
+                "isError": "0",
+                "input": "0x",
+            }
+            for block in blocks
+        ]
+        return _json({"status": "1", "message": "OK", "result": txes})
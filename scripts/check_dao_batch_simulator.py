@@ -0,0 +1,48 @@
+from utils import init_contract
+from utils.curve_dao_utils import CURVE_DAO_OWNERSHIP, simulate_batch
+
+GAUGE_CONTROLLER = "0x2F50D538606Fa9EDD2B11E2446BEb18C9D5846bB"
+# an existing gauge (3pool): adding it again reverts inside the vote
+THREEPOOL_GAUGE = "0xbFcF63294aD7105dEa65aA58F8AE5BE2D9d0952A"
+
+# runs a small batch of ownership votes through the batch simulator on a local fork:
+# two type weight changes (which must both succeed and each start from the unchanged
+# snapshot), one vote whose action reverts, and checks the watched state is back at
+# its starting value afterwards.
+# run with `brownie run check_dao_batch_simulator --network mainnet-fork`
+
+
+def main():
+    controller = init_contract(GAUGE_CONTROLLER)
+    initial_weight = controller.get_type_weight(0)
+
+    watch = [(GAUGE_CONTROLLER, "get_type_weight", 0)]
+    proposals = [
+        ([(GAUGE_CONTROLLER, "change_type_weight", 0, initial_weight * 2)], "double"),
+        ([(GAUGE_CONTROLLER, "change_type_weight", 0, initial_weight // 2)], "halve"),
+        ([(GAUGE_CONTROLLER, "add_gauge", THREEPOOL_GAUGE, 0, 0)], "duplicate gauge"),
+    ]
+    results = simulate_batch(CURVE_DAO_OWNERSHIP, proposals, watch=watch)
+
+    failures = []
+    for result in results:
+        print(
+            f"{result.index} {result.description}: success={result.success} "
+            f"gas={result.gas_used} events={[e['name'] for e in result.events]} "
+            f"diffs={result.state_diffs} error={result.error}"
+        )
+
+    double, halve, duplicate = results
+    label = next(iter(double.state_diffs), None)
+    if not double.success or double.state_diffs.get(label) != (initial_weight, initial_weight * 2):
+        failures.append("double")
+    # isolation: the second proposal starts from the snapshot, not from the first
+    if not halve.success or halve.state_diffs.get(label) != (initial_weight, initial_weight // 2):
+        failures.append("halve")
+    if duplicate.success or duplicate.state_diffs:
+        failures.append("duplicate gauge")
+    if controller.get_type_weight(0) != initial_weight:
+        failures.append("revert to initial state")
+
+    assert not failures, f"batch simulator check failed for: {', '.join(failures)}"
+    print("ok")
@@ -0,0 +1,49 @@
+from brownie import chain
+
+from utils import init_contract
+from utils.gauge_weights import GAUGE_CONTROLLER, load_gauge_weight_history
+
+# tolerance for weights: vote slopes come from the replayed veCRV locks and relative
+# weights are floats, where the contract rounds to 1e18
+RTOL = 1e-9
+
+# compares the weights rebuilt from GaugeController/VotingEscrow logs against
+# points_weight and gauge_relative_weight of the largest gauges for the last few
+# epochs.
+# run with `brownie run check_gauge_weights --network mainnet`
+
+
+def compare(label, offline, onchain) -> bool:
+    ok = abs(offline - onchain) <= RTOL * max(abs(onchain), 1)
+    print(f"{label}: {onchain} {'ok' if ok else f'MISMATCH (offline {offline})'}")
+    return ok
+
+
+def main():
+    controller = init_contract(GAUGE_CONTROLLER)
+    head = chain.height
+    now = chain[head].timestamp
+    history = load_gauge_weight_history(to_block=head)
+
+    # epochs the contract has already checkpointed
+    epochs = history.epochs(last=now)[-4:]
+    weights = history.weights(epochs)
+    relative = history.relative_weights(epochs)
+    gauges = weights.iloc[-1].sort_values().index[-5:]
+
+    ok = True
+    kw = {"block_identifier": head}
+    for epoch in epochs:
+        for gauge in gauges:
+            ok &= compare(
+                f"points_weight({gauge}, {epoch})",
+                weights.loc[epoch, gauge],
+                controller.points_weight(gauge, epoch, **kw)[0],
+            )
+            ok &= compare(
+                f"gauge_relative_weight({gauge}, {epoch})",
+                relative.loc[epoch, gauge] * 1e18,
+                controller.gauge_relative_weight(gauge, epoch, **kw),
+            )
+
+    assert ok, "rebuilt gauge weights do not match the GaugeController"
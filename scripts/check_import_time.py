@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+
+# cold-imports utils (and a few light submodules used by worker processes) in fresh
+# interpreters without credentials, and fails if the median import time exceeds the
+# budget or a heavy dependency gets imported eagerly.
+# run with `python scripts/check_import_time.py [budget in seconds]`
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGETS = {
+    "utils": 0.05,
+    "utils.eth_blocks_utils": 0.5,
+    "utils.rpc_cache": 0.05,
+}
+HEAVY_MODULES = ["brownie", "web3", "pandas", "aiohttp"]
+RUNS = 5
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str) -> dict:
+    # no credentials: importing must not require them
+    env = {k: v for k, v in os.environ.items() if k not in ("ALCHEMY_API_KEY", "ETHERSCAN_TOKEN")}
+    env["PYTHONPATH"] = REPO_ROOT
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    runs = []
+    for _ in range(RUNS):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            env=env,
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        if out.returncode != 0:
+            return {"error": out.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(out.stdout))
+    elapsed = sorted(run["elapsed"] for run in runs)
+    return {"median": elapsed[len(elapsed) // 2], "loaded": runs[0]["loaded"]}
+
+
+def main(budget: float = None):
+    failures = []
+    for module, module_budget in IMPORT_BUDGETS.items():
+        if budget is not None and module == "utils":
+            module_budget = budget
+        result = measure(module)
+        if "error" in result:
+            print(f"import {module}: FAILED ({result['error']})")
+            failures.append(module)
+            continue
+        status = "ok"
+        if result["median"] > module_budget:
+            status = "OVER BUDGET"
+            failures.append(module)
+        if result["loaded"]:
+            status = f"eagerly imports {', '.join(result['loaded'])}"
+            failures.append(module)
+        print(
+            f"import {module}: {result['median'] * 1000:.1f} ms "
+            f"(budget {module_budget * 1000:.0f} ms) {status}"
+        )
+
+    assert not failures, f"import time check failed for: {', '.join(sorted(set(failures)))}"
+
+
+if __name__ == "__main__":
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else None)
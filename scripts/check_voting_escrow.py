@@ -0,0 +1,60 @@
+from brownie import chain
+
+from utils import init_contract
+from utils.voting_escrow import VOTING_ESCROW, load_voting_escrow_history
+
+# tolerance for the historical checks: totalSupplyAt/balanceOfAt interpolate the
+# timestamp of a block between global checkpoints
+RTOL = 1e-4
+
+# compares the event-sourced veCRV history against the VotingEscrow: exact equality
+# with totalSupply(t)/balanceOf(addr, t) at and after the head (where the contract
+# extrapolates from its latest checkpoints just like the replay does), and agreement
+# within RTOL with totalSupplyAt/balanceOfAt at past blocks.
+# run with `brownie run check_voting_escrow --network mainnet`
+
+
+def compare(label, offline, onchain, rtol=0.0) -> bool:
+    ok = abs(int(offline) - onchain) <= rtol * abs(onchain)
+    status = "ok" if ok else f"MISMATCH (offline {int(offline)})"
+    print(f"{label}: {onchain} {status}")
+    return ok
+
+
+def main():
+    vecrv = init_contract(VOTING_ESCROW)
+    head = chain.height
+    history = load_voting_escrow_history(to_block=head)
+    users = history.balances(chain[head].timestamp).sort_values().index[-3:]
+
+    ok = True
+    now = chain[head].timestamp
+    kw = {"block_identifier": head}
+    for t in [now, now + 86400 * 30, now + 86400 * 365]:
+        ok &= compare(
+            f"totalSupply({t})", history.total_supply(t, exact=True), vecrv.totalSupply(t, **kw)
+        )
+        for user in users:
+            ok &= compare(
+                f"balanceOf({user}, {t})",
+                history.balance_of(user, t, exact=True),
+                vecrv.balanceOf(user, t, **kw),
+            )
+
+    for block in [11_000_000, 12_000_000, 13_000_000, 14_000_000, head - 1000]:
+        t = chain[block].timestamp
+        ok &= compare(
+            f"totalSupplyAt({block})",
+            history.total_supply(t, exact=True),
+            vecrv.totalSupplyAt(block, **kw),
+            RTOL,
+        )
+        for user in users:
+            ok &= compare(
+                f"balanceOfAt({user}, {block})",
+                history.balance_of(user, t, exact=True),
+                vecrv.balanceOfAt(user, block, **kw),
+                RTOL,
+            )
+
+    assert ok, "event-sourced veCRV history does not match the contract"
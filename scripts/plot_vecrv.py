@@ -1,17 +1,22 @@
 import numpy as np
+import pandas as pd
 import pylab
-from brownie import Contract, web3
+from brownie import web3
 
-START_BLOCK = 10647813
+from utils.voting_escrow import load_voting_escrow_history
+
+DAY = 86400
 
 
 def main():
-    vecrv = Contract("0x5f3b5DfEb7B28CDbD7FAba78963EE202a494e2A2")
-    current_block = web3.eth.blockNumber
-    blocks = np.linspace(START_BLOCK, current_block, 100)
-    powers = [vecrv.totalSupplyAt(int(block)) / 1e18 for block in blocks]
+    # one scan of the Deposit/Withdraw logs replaces a totalSupplyAt call per sample
+    history = load_voting_escrow_history()
+    first = int(history.checkpoints.timestamp.iloc[0])
+    timestamps = np.arange(first // DAY * DAY + DAY, web3.eth.getBlock("latest").timestamp, DAY)
+    supply = history.total_supply(timestamps)
+    print(f"{len(timestamps)} days from {len(history.checkpoints)} lock events")
 
-    pylab.plot(blocks, powers)
-    pylab.xlabel("Block number")
+    pylab.plot(pd.to_datetime(timestamps, unit="s"), supply / 1e18)
+    pylab.xlabel("Date")
     pylab.ylabel("Total veCRV")
     pylab.show()
@@ -1,34 +1,29 @@
 from datetime import datetime
-from time import time
 
 import pylab  # Requires matplotlib
 from brownie import Contract
 
-WEEK = 86400 * 7
+from utils.fee_distributor import FEE_DISTRIBUTOR, weekly_fees_dataset
 
 
 def main():
-    distributor = Contract("0xA464e6DCda8AC41e03616F95f4BC98a13b8922Dc")
+    distributor = Contract(FEE_DISTRIBUTOR)
     tri_pool = Contract("0xbEbc44782C7dB0a1A60Cb6fe97d0b483032FF1C7")
-    t = int(time()) // WEEK * WEEK
     virtual_price = tri_pool.get_virtual_price() / 1e18
 
-    output = []
-    while True:
-        fees = distributor.tokens_per_week(t)
-        if fees == 0 and len(output) > 0:
-            break
-        d = datetime.fromtimestamp(t)
-        output.append((d, fees))
-        t -= WEEK
-    if output[0][1] == 0:
-        output = output[1:]
+    # only the weeks since the last run are fetched
+    weekly_fees = weekly_fees_dataset(distributor)
+    data = weekly_fees.refresh()
+    print(f"fetched {weekly_fees.rows_computed} of {len(data)} weeks")
+
+    # skip the weeks before the first distribution and the ones not distributed yet
+    data = data[data.fees > 0]
     dates = []
     fees = []
-    for d, fee in output[::-1]:
-        dates.append(d)
-        fees.append(fee * virtual_price / 1e18)
-        print("{0}|\t${1:.2f}".format(d, fees[-1]))
+    for t, fee in zip(data.timestamp, data.fees):
+        dates.append(datetime.fromtimestamp(t))
+        fees.append(fee * virtual_price)
+        print("{0}|\t${1:.2f}".format(dates[-1], fees[-1]))
 
     # pylab.bar(range(len(fees)), fees)
     # pylab.xticks(range(len(dates)), [d.strftime("%d-%m-%y") for d in dates])
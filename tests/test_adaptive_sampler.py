@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from utils.adaptive_sampler import adaptive_sample
+
+START, END = 10_000_000, 14_000_000
+# A parameter set at these blocks, e.g. by two commits of a ramp
+STEPS = {START: 100, 11_234_567: 200, 13_000_001: 500}
+MIN_STEP = 100
+
+
+def _step_function(blocks) -> np.ndarray:
+    edges = np.array(list(STEPS))
+    values = np.array(list(STEPS.values()))
+    return values[np.searchsorted(edges, blocks, side="right") - 1]
+
+
+def test_step_function_costs_less_than_a_fixed_grid():
+    sampled_blocks = []
+
+    def sample(blocks):
+        sampled_blocks.extend(blocks)
+        return pd.DataFrame({"A": _step_function(blocks)}, index=blocks)
+
+    result = adaptive_sample(sample, START, END, min_step=MIN_STEP, timestamps=False)
+
+    assert result.calls == len(sampled_blocks) == len(set(sampled_blocks))
+    assert (result.data.A.values == _step_function(result.data.index)).all()
+
+    # every step is located to within MIN_STEP blocks
+    blocks = result.data.index.to_numpy()
+    for step in list(STEPS)[1:]:
+        before = blocks[blocks < step].max()
+        after = blocks[blocks >= step].min()
+        assert after - before <= MIN_STEP
+
+    # a fixed grid needs 40,001 samples for that resolution
+    fixed_grid = (END - START) // MIN_STEP + 1
+    assert result.calls < result.baseline_calls
+    assert result.calls * 100 < fixed_grid
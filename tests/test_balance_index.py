@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.balance_index import BalanceIndex
+
+SOURCE = "0x" + "ff" * 20
+
+
+def _full_exits(n_addresses: int = 2000, seed: int = 0) -> pd.DataFrame:
+    """Every address receives 3 transfers and then sends out exactly their sum."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(n_addresses):
+        address = f"0x{i + 1:040x}"
+        amounts = [int(v) * 10 ** 9 + int(w) for v, w in rng.integers(1, 10 ** 12, (3, 2))]
+        for block, amount in enumerate(amounts, start=10):
+            rows.append((block, SOURCE, address, str(amount)))
+        rows.append((20, address, SOURCE, str(sum(amounts))))
+    return pd.DataFrame(rows, columns=["block_number", "sender", "receiver", "value"])
+
+
+@pytest.mark.parametrize("exact", [True, False])
+def test_full_exit_leaves_no_holder(exact):
+    index = BalanceIndex(exact=exact)
+    index.add_transfers(_full_exits())
+
+    assert len(index.balances_at(15)) == 2000
+    # the source got everything back, so it is 0 too
+    assert index.balances_at(20).empty
+    assert index.balance_of("0x" + "0" * 39 + "1", 20) == 0
+
+
+def test_exact_by_default():
+    transfers = _full_exits(10)
+    index = BalanceIndex()
+    index.add_transfers(transfers)
+
+    address = "0x" + "0" * 39 + "1"
+    history = index.history(address)
+    received = transfers[transfers.receiver == address].value.map(int)
+    assert history.tolist() == list(np.cumsum(received.tolist())) + [0]
+    assert all(isinstance(balance, int) for balance in history)
@@ -0,0 +1,214 @@
+import os
+import shutil
+
+import pytest
+
+pytest.importorskip("brownie")
+
+if not (shutil.which("ganache-cli") or shutil.which("ganache")):
+    pytest.skip("needs ganache to start a local dev chain", allow_module_level=True)
+
+from brownie import accounts, chain, compile_source, network, web3  # noqa: E402
+
+import utils.abi_store  # noqa: E402
+from utils.abi_store import ABIStore  # noqa: E402
+from utils.curve_dao_utils import _run_proposal, simulate_batch  # noqa: E402
+
+# a minimal Aragon-like DAO: Voting keeps the call script of each vote and, once the
+# vote time is over and two holders voted yes, runs it through the Agent, which calls
+# the target. Only the parts curve_dao_utils touches are implemented.
+VOTING = """
+# @version ^0.3.1
+
+event StartVote:
+    voteId: indexed(uint256)
+    creator: indexed(address)
+    metadata: String[1024]
+
+event ExecuteVote:
+    voteId: indexed(uint256)
+
+agent: public(address)
+voteTime: public(uint256)
+votesLength: public(uint256)
+scripts: HashMap[uint256, Bytes[2048]]
+startDate: HashMap[uint256, uint256]
+yea: HashMap[uint256, uint256]
+executed: HashMap[uint256, bool]
+
+@external
+def __init__(_vote_time: uint256):
+    self.voteTime = _vote_time
+
+@external
+def initialize(_agent: address):
+    assert self.agent == empty(address)
+    self.agent = _agent
+
+@external
+def newVote(
+    _script: Bytes[2048], _metadata: String[1024], _castVote: bool, _executesIfDecided: bool
+) -> uint256:
+    vote_id: uint256 = self.votesLength
+    self.votesLength = vote_id + 1
+    self.scripts[vote_id] = _script
+    self.startDate[vote_id] = block.timestamp
+    log StartVote(vote_id, msg.sender, _metadata)
+    return vote_id
+
+@external
+def vote(_voteId: uint256, _supports: bool, _executesIfDecided: bool):
+    assert _voteId < self.votesLength, "no such vote"
+    assert block.timestamp < self.startDate[_voteId] + self.voteTime, "vote closed"
+    if _supports:
+        self.yea[_voteId] += 1
+
+@external
+def executeVote(_voteId: uint256):
+    assert _voteId < self.votesLength, "no such vote"
+    assert block.timestamp >= self.startDate[_voteId] + self.voteTime, "vote open"
+    assert self.yea[_voteId] >= 2, "no quorum"
+    assert not self.executed[_voteId], "already executed"
+    self.executed[_voteId] = True
+
+    # call script: spec id 1, then (20 byte target, 4 byte length, calldata) entries
+    script: Bytes[2048] = self.scripts[_voteId]
+    assert extract32(script, 0, output_type=uint256) / 2 ** 224 == 1, "spec id"
+    agent_bytes: Bytes[20] = slice(convert(self.agent, bytes32), 12, 20)
+    pos: uint256 = 4
+    for i in range(8):
+        if pos >= len(script):
+            break
+        assert keccak256(slice(script, pos, 20)) == keccak256(agent_bytes), "not the agent"
+        length: uint256 = extract32(script, pos + 20, output_type=uint256) / 2 ** 224
+        raw_call(self.agent, slice(script, pos + 24, length))
+        pos += 24 + length
+    log ExecuteVote(_voteId)
+"""
+
+AGENT = """
+# @version ^0.3.1
+
+voting: public(address)
+
+@external
+def __init__(_voting: address):
+    self.voting = _voting
+
+@external
+def execute(_target: address, _ethValue: uint256, _data: Bytes[1024]):
+    assert msg.sender == self.voting, "only voting"
+    raw_call(_target, _data, value=_ethValue)
+"""
+
+CONTROLLER = """
+# @version ^0.3.1
+
+event WeightChanged:
+    weight: uint256
+
+owner: public(address)
+weight: public(uint256)
+
+@external
+def __init__(_owner: address):
+    self.owner = _owner
+    self.weight = 10
+
+@external
+def set_weight(_weight: uint256):
+    assert msg.sender == self.owner, "only owner"
+    assert _weight > 0, "zero weight"
+    self.weight = _weight
+    log WeightChanged(_weight)
+"""
+
+VOTE_TIME = 3600
+
+
+@pytest.fixture(scope="module")
+def dev_chain(tmp_path_factory):
+    """A local dev chain, with ABIs kept in a throwaway store (also used by the
+    worker processes, which read it through $ONCHAIN_CACHE_DIR)."""
+    cache_dir = str(tmp_path_factory.mktemp("cache"))
+    previous_env = os.environ.get("ONCHAIN_CACHE_DIR")
+    os.environ["ONCHAIN_CACHE_DIR"] = cache_dir
+    previous_store = utils.abi_store._abi_store
+    utils.abi_store._abi_store = ABIStore(os.path.join(cache_dir, "abis"))
+
+    network.connect("development")
+    try:
+        yield utils.abi_store._abi_store
+    finally:
+        network.disconnect()
+        utils.abi_store._abi_store = previous_store
+        if previous_env is None:
+            os.environ.pop("ONCHAIN_CACHE_DIR")
+        else:
+            os.environ["ONCHAIN_CACHE_DIR"] = previous_env
+
+
+def deploy(store: ABIStore):
+    """Deploys the DAO and its target from a fresh chain, so every deployment ends up
+    at the same addresses. Returns (target dict, controller, holders)."""
+    chain.reset()
+    voting = compile_source(VOTING).Vyper.deploy(VOTE_TIME, {"from": accounts[0]})
+    agent = compile_source(AGENT).Vyper.deploy(voting, {"from": accounts[0]})
+    voting.initialize(agent, {"from": accounts[0]})
+    controller = compile_source(CONTROLLER).Vyper.deploy(agent, {"from": accounts[0]})
+    for name, contract in (("Voting", voting), ("Agent", agent), ("Controller", controller)):
+        store.set(chain.id, contract.address, contract.abi, name=name)
+
+    target = {"agent": agent.address, "voting": voting.address, "quorum": 2}
+    return target, controller, [accounts[1].address, accounts[2].address]
+
+
+def _proposals(controller):
+    return [
+        ([(controller.address, "set_weight", 20)], "double"),
+        ([(controller.address, "set_weight", 5)], "halve"),
+        ([(controller.address, "set_weight", 0)], "reverts"),
+        ([(controller.address, "set_weight", 7), (controller.address, "set_weight", 9)], "two"),
+    ]
+
+
+def _comparable(results):
+    # revert messages are worded by the node; whether there is one is what matters
+    return [result._replace(error=result.error is not None) for result in results]
+
+
+def test_batch_matches_sequential(dev_chain):
+    # sequential: every proposal on its own freshly deployed chain
+    sequential = []
+    for index in range(4):
+        target, controller, holders = deploy(dev_chain)
+        watch = [(controller.address, "weight")]
+        actions, description = _proposals(controller)[index]
+        sequential.append(_run_proposal(index, target, actions, description, holders, watch))
+
+    double, halve, reverts, two = sequential
+    label = f"{controller.address}.weight()"
+    assert double.success and double.state_diffs == {label: (10, 20)}
+    assert halve.success and halve.state_diffs == {label: (10, 5)}
+    assert not reverts.success and reverts.error and not reverts.state_diffs
+    assert two.success and two.state_diffs == {label: (10, 9)}
+    assert [e["name"] for e in two.events] == ["WeightChanged", "WeightChanged", "ExecuteVote"]
+
+    # snapshot / revert reuse on one chain
+    target, controller, holders = deploy(dev_chain)
+    watch = [(controller.address, "weight")]
+    batch = simulate_batch(target, _proposals(controller), watch=watch, holders=holders)
+    assert _comparable(batch) == _comparable(sequential)
+    assert controller.weight() == 10
+
+    # worker pool: two processes, each on its own fork of this chain
+    pooled = simulate_batch(
+        target,
+        _proposals(controller),
+        watch=watch,
+        holders=holders,
+        n_workers=2,
+        network_name="development",
+        cmd_settings={"fork": web3.provider.endpoint_uri, "chain_id": chain.id},
+    )
+    assert _comparable(pooled) == _comparable(sequential)
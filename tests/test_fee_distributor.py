@@ -0,0 +1,38 @@
+from utils.fee_distributor import WEEK, weekly_fees_dataset
+
+START = 100 * WEEK
+
+
+class Distributor:
+    """FeeDistributor stand-in: one token per second, spread over the weeks up to the
+    last checkpoint as `checkpoint_token` does."""
+
+    def __init__(self):
+        self.last_checkpoint = START
+
+    def start_time(self):
+        return START
+
+    def last_token_time(self):
+        return self.last_checkpoint
+
+    def tokens_per_week(self, week):
+        distributed = min(week + WEEK, self.last_checkpoint) - week
+        return max(distributed, 0) * 10**18
+
+
+def test_partial_week_is_not_stored(tmp_path):
+    distributor = Distributor()
+    dataset = weekly_fees_dataset(distributor, path=str(tmp_path))
+
+    # checkpointed halfway through the third week
+    distributor.last_checkpoint = START + 2 * WEEK + WEEK // 2
+    data = dataset.refresh()
+    assert list(data.fees) == [WEEK, WEEK, WEEK // 2]
+    assert list(dataset.load().timestamp) == [START, START + WEEK]
+
+    # the rest of the week is distributed at the next checkpoint
+    distributor.last_checkpoint = START + 3 * WEEK
+    data = dataset.refresh()
+    assert list(data.fees) == [WEEK, WEEK, WEEK, 0]
+    assert list(dataset.load().fees) == [WEEK, WEEK, WEEK]
@@ -1,6 +1,27 @@
-from .contract_utils import init_contract
-from .network_utils import configure_network
+# the package's public helpers are resolved on first access (PEP 562), so that
+# `import utils` - and importing light submodules such as utils.eth_blocks_utils in
+# worker processes - does not pull in brownie, web3 or the DAO tooling.
+import importlib
 
+_LAZY_ATTRIBUTES = {
+    "init_contract": ("contract_utils", "init_contract"),
+    "configure_network": ("network_utils", "configure_network"),
+    "CURVE_DAO_OWNERSHIP": ("curve_dao_utils", "CURVE_DAO_OWNERSHIP"),
+    "CURVE_DAO_PARAM": ("curve_dao_utils", "CURVE_DAO_PARAM"),
+    "simulate_curve_dao_vote": ("curve_dao_utils", "simulate"),
+}
 
-from .curve_dao_utils import CURVE_DAO_OWNERSHIP, CURVE_DAO_PARAM
-from .curve_dao_utils import simulate as simulate_curve_dao_vote
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module, attribute = _LAZY_ATTRIBUTES[name]
+    value = getattr(importlib.import_module(f".{module}", __name__), attribute)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
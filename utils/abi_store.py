@@ -0,0 +1,92 @@
+import json
+import os
+
+from typing import Dict, List, Optional
+
+from utils.rpc_cache import CACHE_DIR
+
+# ABIs fetched from explorers, and the ones shipped with the repo
+ABI_STORE_DIR = os.path.join(CACHE_DIR, "abis")
+REPO_ABI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "abis")
+
+# mainnet addresses of the ABIs shipped in utils/abis, used to seed the ABI store
+REPO_ABIS = {
+    "0xbEbc44782C7dB0a1A60Cb6fe97d0b483032FF1C7": "3pool.json",
+    "0x6c3F90f043a72FA612cbac8115EE7e52BDe6E490": "3crv.json",
+    "0xD51a44d3FaE010294C616388b506AcdA1bfAAE46": "tricrypto2.json",
+    "0x5a6A4D54456819380173272A5E8E9B9904BdF41B": "mim-3pool.json",
+    "0x99D8a9C45b2ecA8864373A26D1459e3Dff1e17F3": "mim.json",
+    "0xdAC17F958D2ee523a2206206994597C13D831ec7": "usdt.json",
+    "0x57Ab1ec28D129707052df4dF418D58a2D46d5f51": "susd.json",
+    "0x0f9cb53Ebe405d49A0bbdBD291A65Ff571bC83e1": "usdn.json",
+    "0x9838eCcC42659FA8AA7daF2aD134b53984c2AbBa": "eurt_3crv.json",
+    "0x3b6831c0077a1e44ED0a21841C3bC4dC11bCE833": "crvEURT3CRV.json",
+}
+
+
+class ABIStore:
+    """On-disk ABIs keyed by chain id and address ({path}/{chain_id}/{address}.json),
+    so contracts can be initialised without an explorer round trip.
+
+    Each entry stores the contract name, its ABI and, for proxies, the implementation
+    the ABI was taken from.
+    """
+
+    def __init__(self, path: str = ABI_STORE_DIR):
+        self.path = path
+
+    def _filename(self, chain_id: int, address: str) -> str:
+        return os.path.join(self.path, str(chain_id), f"{address.lower()}.json")
+
+    def get(self, chain_id: int, address: str) -> Optional[Dict]:
+        filename = self._filename(chain_id, address)
+        if not os.path.exists(filename):
+            return None
+        with open(filename) as f:
+            return json.load(f)
+
+    def set(
+        self,
+        chain_id: int,
+        address: str,
+        abi: List[Dict],
+        name: str = None,
+        implementation: str = None,
+    ) -> None:
+        filename = self._filename(chain_id, address)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        entry = {"name": name or address, "abi": abi, "implementation": implementation}
+        with open(filename + ".tmp", "w") as f:
+            json.dump(entry, f)
+        os.replace(filename + ".tmp", filename)
+
+    def delete(self, chain_id: int, address: str) -> None:
+        filename = self._filename(chain_id, address)
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    def seed(self, abis: Dict[str, str] = None, chain_id: int = 1, overwrite: bool = False) -> int:
+        """Adds ABI json files from the repo ({address: filename in utils/abis} or
+        absolute paths) to the store. Returns the number of entries written."""
+        written = 0
+        for address, filename in (abis or REPO_ABIS).items():
+            if not overwrite and self.get(chain_id, address) is not None:
+                continue
+            with open(os.path.join(REPO_ABI_DIR, filename)) as f:
+                abi = json.load(f)
+            name = os.path.splitext(os.path.basename(filename))[0]
+            self.set(chain_id, address, abi, name=name)
+            written += 1
+        return written
+
+
+_abi_store = None
+
+
+def get_abi_store() -> ABIStore:
+    """Process-wide ABI store, seeded with the repo's ABIs on first use."""
+    global _abi_store
+    if _abi_store is None:
+        _abi_store = ABIStore()
+        _abi_store.seed()
+    return _abi_store
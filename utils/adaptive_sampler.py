@@ -0,0 +1,168 @@
+from typing import Callable, Iterable, List, NamedTuple, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from utils.rpc_cache import RPCCache
+
+# blocks -> DataFrame indexed by block with one column per sampled quantity
+SampleFn = Callable[[List[int]], pd.DataFrame]
+
+INITIAL_POINTS = 17
+
+
+class AdaptiveSample(NamedTuple):
+    """Result of `adaptive_sample`.
+
+    data holds one column per sampled quantity (plus `timestamp` if requested),
+    indexed by block. calls counts the view calls made (blocks sampled times
+    quantities); baseline_calls is what a fixed grid at the finest spacing the
+    sampler had to use would have cost.
+    """
+
+    data: pd.DataFrame
+    calls: int
+    baseline_calls: int
+    rounds: int
+
+    @property
+    def savings(self) -> float:
+        return self.baseline_calls / max(self.calls, 1)
+
+
+def _multicall_sample_fn(calls: List[Tuple], rpc_url: str, cache: RPCCache) -> SampleFn:
+    from utils.multicall_utils import multicall_sweep
+
+    def sample(blocks: List[int]) -> pd.DataFrame:
+        return multicall_sweep(calls, blocks, rpc_url=rpc_url, cache=cache)
+
+    return sample
+
+
+def _as_float(df: pd.DataFrame) -> np.ndarray:
+    """Numeric view of the samples (NaN where a call reverted or isn't a number)."""
+    return df.apply(pd.to_numeric, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _interval_errors(values: np.ndarray, tolerance: np.ndarray) -> np.ndarray:
+    """How far each pair of consecutive samples differs, in units of the tolerance
+    (max over quantities). A change between None and a value counts as infinite."""
+    with np.errstate(invalid="ignore"):
+        diff = np.abs(np.diff(values, axis=0)) / tolerance
+    nan = np.isnan(values)
+    appeared = nan[1:] != nan[:-1]
+    diff = np.where(appeared, np.inf, np.nan_to_num(diff, nan=0.0))
+    return diff.max(axis=1)
+
+
+def adaptive_sample(
+    calls: Union[Tuple, List[Tuple], SampleFn],
+    start_block: int,
+    end_block: int,
+    rtol: float = 0.01,
+    atol: float = 0.0,
+    initial_points: int = INITIAL_POINTS,
+    min_step: int = 1,
+    max_calls: int = None,
+    activity_blocks: Iterable[int] = None,
+    events_per_interval: int = 1,
+    timestamps: bool = True,
+    rpc_url: str = None,
+    cache: RPCCache = None,
+) -> AdaptiveSample:
+    """Samples view functions over [start_block, end_block], spending calls only
+    where the values move.
+
+    Starts from `initial_points` evenly spaced blocks and, each round, samples the
+    midpoint of every interval whose end values differ by more than
+    `atol + rtol * (range of the series so far)`, until no interval needs refining,
+    intervals reach `min_step` blocks, or `max_calls` is spent (largest differences
+    are refined first). If `activity_blocks` (e.g. the block numbers of the
+    contract's events from a LogIndexer) are given, intervals holding more than
+    `events_per_interval` of them are also split, at their median event, so moves
+    that return to the starting value are not skipped.
+
+    Each round is one multicall sweep, i.e. a handful of batched RPC requests.
+
+    Args:
+        calls: (contract, "fn_name", args) or a list of them (see `multicall_sweep`),
+            or a function mapping a list of blocks to a block-indexed DataFrame
+        start_block (int): first block
+        end_block (int): last block
+        rtol (float): tolerance relative to the range of each series
+        atol (float): absolute tolerance
+        initial_points (int): size of the starting grid
+        min_step (int): smallest interval that is still split
+        max_calls (int): budget of view calls
+        activity_blocks (list(int)): blocks where the sampled state may change
+        events_per_interval (int): activity blocks tolerated inside an interval
+        timestamps (bool): add a `timestamp` column from the block index
+        rpc_url (str): JSON-RPC endpoint, defaults to brownie's active network
+        cache (RPCCache): optional cache for finalised blocks
+
+    Returns:
+        AdaptiveSample
+    """
+    if callable(calls):
+        def sample_fn(blocks):
+            return pd.DataFrame(calls(blocks))
+    else:
+        if isinstance(calls, tuple):
+            calls = [calls]
+        sample_fn = _multicall_sample_fn(list(calls), rpc_url, cache)
+
+    activity = np.unique(np.asarray(list(activity_blocks or []), dtype=np.int64))
+    activity = activity[(activity > start_block) & (activity < end_block)]
+
+    blocks = np.unique(np.linspace(start_block, end_block, initial_points).astype(np.int64))
+    data = sample_fn([int(block) for block in blocks])
+    n_quantities = data.shape[1]
+    samples = len(blocks)
+    rounds = 1
+
+    while True:
+        data = data.sort_index()
+        blocks = data.index.to_numpy(dtype=np.int64)
+        values = _as_float(data)
+
+        with np.errstate(invalid="ignore"):
+            value_range = np.nanmax(values, axis=0) - np.nanmin(values, axis=0)
+        tolerance = atol + rtol * np.nan_to_num(value_range)
+        tolerance = np.where(tolerance > 0, tolerance, np.finfo(np.float64).tiny)
+
+        lo, hi = blocks[:-1], blocks[1:]
+        splittable = hi - lo > min_step
+        errors = np.where(splittable, _interval_errors(values, tolerance), 0)
+        new_blocks = (lo + hi) // 2
+
+        if activity.size:
+            # events strictly inside each interval
+            first = np.searchsorted(activity, lo, side="right")
+            last = np.searchsorted(activity, hi, side="left")
+            busy = splittable & (last - first > events_per_interval)
+            median = activity[np.minimum((first + last - 1) // 2, activity.size - 1)]
+            new_blocks = np.where(busy & (errors <= 1), median, new_blocks)
+            errors = np.where(busy & (errors <= 1), 1 + (last - first) / activity.size, errors)
+
+        refine = np.flatnonzero(errors > 1)
+        if max_calls is not None:
+            budget = (max_calls - samples * n_quantities) // max(n_quantities, 1)
+            refine = refine[np.argsort(-errors[refine], kind="stable")][: max(budget, 0)]
+        new_blocks = np.setdiff1d(new_blocks[refine], blocks)
+        if not new_blocks.size:
+            break
+
+        data = pd.concat([data, sample_fn([int(block) for block in new_blocks])])
+        samples += len(new_blocks)
+        rounds += 1
+
+    data = data.sort_index()
+    data.index.name = "block"
+    if timestamps:
+        from utils.eth_blocks_utils import get_timestamps_for_blocks
+
+        data["timestamp"] = pd.to_datetime(get_timestamps_for_blocks(data.index), unit="s")
+
+    finest = int(np.diff(data.index.to_numpy()).min()) if len(data) > 1 else 1
+    baseline = ((end_block - start_block) // max(finest, 1) + 1) * n_quantities
+    return AdaptiveSample(data, samples * n_quantities, baseline, rounds)
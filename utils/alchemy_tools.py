@@ -1,6 +1,32 @@
+import asyncio
 import os
+import queue
+import random
+import threading
 import requests
-from typing import Union, List
+import numpy as np
+import pandas as pd
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Union
+
+ASSET_TRANSFERS = "alchemy_getAssetTransfers"
+DEFAULT_CATEGORIES = ["external", "internal", "erc20", "erc721", "erc1155"]
+# alchemy returns at most 1000 transfers per page
+MAX_COUNT = 1000
+# columns of `transfers_to_frame`, so every chunk written to a sink has one schema
+TRANSFER_COLUMNS = {
+    "block_number": "int64",
+    "hash": "string",
+    "unique_id": "string",
+    "from": "string",
+    "to": "string",
+    "value": "float64",
+    "asset": "string",
+    "category": "string",
+    "contract_address": "string",
+    "raw_value": "string",
+    "decimals": "string",
+    "token_id": "string",
+}
 
 
 def alchemy_asset_transfers(
@@ -43,27 +69,255 @@ def alchemy_asset_transfers(
     return response_json
 
 
+def _transfer_params(
+        from_address: Optional[str],
+        to_address: Optional[str],
+        category: Optional[List[str]],
+        max_count: Optional[int],
+        contract_addresses: Optional[List[str]],
+) -> Dict:
+
+    parameters = {"category": category or DEFAULT_CATEGORIES}
+    if from_address:
+        parameters["fromAddress"] = from_address
+    if to_address:
+        parameters["toAddress"] = to_address
+    if max_count:
+        parameters["maxCount"] = hex(min(max_count, MAX_COUNT))
+    if contract_addresses:
+        parameters["contractAddresses"] = list(contract_addresses)
+    return parameters
+
+
+def _shards(from_block: int, to_block: int, n_shards: int) -> List[tuple]:
+    edges = np.unique(np.linspace(from_block, to_block + 1, n_shards + 1).astype(np.int64))
+    return [(int(lo), int(hi) - 1) for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+async def _walk_shard(client, parameters: Dict, lo: int, hi: int, max_retries: int):
+    """Follows the pageKey chain of one block shard, retrying a failed page on its
+    own instead of restarting the shard."""
+    from utils.async_utils import RPCError
+
+    page_key = None
+    while True:
+        page = {**parameters, "fromBlock": hex(lo), "toBlock": hex(hi)}
+        if page_key:
+            page["pageKey"] = page_key
+
+        for attempt in range(max_retries):
+            response = await client.request(ASSET_TRANSFERS, [page])
+            if "error" not in response:
+                break
+            # rate limits and timeouts can come back as JSON-RPC errors with HTTP 200
+            await asyncio.sleep(min(2 ** attempt, 30) * (0.5 + random.random()))
+        else:
+            raise RPCError(f"{ASSET_TRANSFERS} {lo}-{hi} failed: {response['error']}")
+
+        yield response["result"]["transfers"]
+        page_key = response["result"].get("pageKey")
+        if not page_key:
+            return
+
+
+async def aiter_asset_transfers(
+        from_address: str = None,
+        to_address: str = None,
+        from_block: int = 0,
+        to_block: Union[int, str] = 'latest',
+        category: List[str] = None,
+        max_count: int = None,
+        contract_addresses: List[str] = None,
+        n_shards: int = 16,
+        rpc_url: str = None,
+        max_retries: int = 5,
+) -> AsyncIterator[List[Dict]]:
+    """Async version of `iter_asset_transfers`, yielding one page of transfers at a
+    time as pages arrive from any shard."""
+    from utils.async_utils import ALCHEMY_RPC, AsyncRPCClient
+
+    parameters = _transfer_params(
+        from_address, to_address, category, max_count, contract_addresses
+    )
+    async with AsyncRPCClient(rpc_url or ALCHEMY_RPC, max_concurrency=n_shards) as client:
+        if to_block == 'latest':
+            to_block = int((await client.request("eth_blockNumber", []))["result"], 16)
+
+        pages = asyncio.Queue(maxsize=n_shards * 2)
+        done = object()
+
+        async def produce(lo, hi):
+            try:
+                async for page in _walk_shard(client, parameters, lo, hi, max_retries):
+                    await pages.put(page)
+            except Exception as e:
+                await pages.put(e)
+            finally:
+                await pages.put(done)
+
+        shards = _shards(int(from_block), int(to_block), n_shards)
+        tasks = [asyncio.ensure_future(produce(lo, hi)) for lo, hi in shards]
+        try:
+            finished = 0
+            while finished < len(tasks):
+                item = await pages.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def iter_asset_transfers(*args, **kwargs) -> Iterator[List[Dict]]:
+    """Streams alchemy_getAssetTransfers results for a block range.
+
+    The block range is split into `n_shards` shards whose pageKey chains are walked
+    concurrently over one pooled async session; pages are yielded as they arrive, so
+    they are ordered by block within a shard but interleaved across shards. If the
+    consumer stops early, fetching stops after the pages in flight.
+
+    Args:
+        from_address (str): sender filter
+        to_address (str): recipient filter
+        from_block (int): first block
+        to_block (int | str): last block or 'latest'
+        category (list(str)): transfer categories, defaults to DEFAULT_CATEGORIES
+        max_count (int): transfers per page (at most 1000)
+        contract_addresses (list(str)): only transfers of these tokens
+        n_shards (int): concurrent block shards
+        rpc_url (str): Alchemy endpoint, defaults to mainnet with $ALCHEMY_API_KEY
+
+    Yields:
+        list(dict): one page of raw transfers.
+    """
+    from utils.async_utils import run_coroutine
+
+    pages = queue.Queue(maxsize=64)
+    done = object()
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        # a full queue nobody reads any more must not block the producer forever
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def produce():
+        try:
+            async for page in aiter_asset_transfers(*args, **kwargs):
+                if not put(page):
+                    # leaving the loop closes the generator, which cancels the shards
+                    break
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    # the event loop runs on its own thread so the caller can consume synchronously
+    thread = threading.Thread(target=run_coroutine, args=(produce(),), daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = pages.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+    thread.join()
+
+
+def transfers_to_frame(transfers: List[Dict]) -> pd.DataFrame:
+    """Flattens raw transfers into the fixed columnar layout of TRANSFER_COLUMNS."""
+    df = pd.DataFrame(
+        {
+            "block_number": [int(t["blockNum"], 16) for t in transfers],
+            "hash": [t.get("hash") for t in transfers],
+            "unique_id": [t.get("uniqueId") for t in transfers],
+            "from": [t.get("from") for t in transfers],
+            "to": [t.get("to") for t in transfers],
+            "value": [t.get("value") for t in transfers],
+            "asset": [t.get("asset") for t in transfers],
+            "category": [t.get("category") for t in transfers],
+            "contract_address": [(t.get("rawContract") or {}).get("address") for t in transfers],
+            "raw_value": [(t.get("rawContract") or {}).get("value") for t in transfers],
+            "decimals": [(t.get("rawContract") or {}).get("decimal") for t in transfers],
+            "token_id": [t.get("tokenId") or t.get("erc721TokenId") for t in transfers],
+        }
+    )
+    return df.astype(TRANSFER_COLUMNS)
+
+
+def download_asset_transfers(path: str, *args, chunk_size: int = 50_000, **kwargs) -> int:
+    """Streams transfers (see `iter_asset_transfers` for the arguments) straight into
+    a parquet file in row groups of `chunk_size`, without holding the full history in
+    memory.
+
+    Returns:
+        int: number of transfers written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    buffer = []
+    written = 0
+
+    def flush():
+        nonlocal writer, written
+        table = pa.Table.from_pandas(transfers_to_frame(buffer), preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+        written += len(buffer)
+        buffer.clear()
+
+    try:
+        for page in iter_asset_transfers(*args, **kwargs):
+            buffer.extend(page)
+            if len(buffer) >= chunk_size:
+                flush()
+        if buffer or writer is None:
+            flush()
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return written
+
+
 def get_asset_transfers(
         from_address: str,
         to_address: str,
         from_block: Union[int, str],
-        to_block: Union[int, str]
+        to_block: Union[int, str],
+        category: List[str] = None,
+        max_count: int = None,
+        contract_addresses: List[str] = None,
 ) -> List:
 
-    page_key = None
     all_txes = []
-    while True:
-        response = alchemy_asset_transfers(
-            from_address=from_address,
-            to_address=to_address,
-            from_block=from_block,
-            to_block=to_block,
-            page_key=page_key
-        )
-        transactions = response["result"]["transfers"]
-        all_txes.extend(transactions)
-        if not 'pageKey' in response['result'].keys():
-            break
-        page_key = response['result']['pageKey']
-
-    return all_txes
\ No newline at end of file
+    for page in iter_asset_transfers(
+        from_address=from_address,
+        to_address=to_address,
+        from_block=int(from_block),
+        to_block=to_block,
+        category=category,
+        max_count=max_count,
+        contract_addresses=contract_addresses,
+    ):
+        all_txes.extend(page)
+
+    # shards arrive interleaved; restore the block order of the sequential walk
+    all_txes.sort(key=lambda t: int(t["blockNum"], 16))
+    return all_txes
@@ -1,49 +1,339 @@
-import os
+import json
+import time
+import random
 import asyncio
-from aiohttp import ClientSession
+import concurrent.futures
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
 
-from web3.providers.base import JSONBaseProvider
+from typing import AsyncIterator, Iterable, List, Optional, Tuple
 
-from typing import List
+from utils.network_utils import get_alchemy_api_key, get_alchemy_rpc
+from utils.rpc_cache import RPCCache
 
-ALCHEMY_API_KEY = os.environ['ALCHEMY_API_KEY']
-ALCHEMY_RPC = f"https://eth-mainnet.alchemyapi.io/v2/{ALCHEMY_API_KEY}"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# JSON-RPC error codes of items that were throttled rather than failed: providers
+# answer an over-budget batch with HTTP 200 and these inside the individual responses
+RETRY_ERROR_CODES = {429, -32005}
+
+
+def __getattr__(name):
+    # credentials are only read from the environment when first used
+    if name == "ALCHEMY_API_KEY":
+        return get_alchemy_api_key()
+    if name == "ALCHEMY_RPC":
+        return get_alchemy_rpc()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def run_coroutine(coro):
+    """Runs `coro` to completion, also from inside an already running event loop
+    (e.g. Jupyter), in which case it is executed on a separate thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
 
 
 def get_ethtx_receipt(transactions: List):
 
-    loop = asyncio.get_event_loop()
-    future = asyncio.ensure_future(
-        async_getTransactionReceipt(ALCHEMY_RPC, transactions)
-    )
-    result = loop.run_until_complete(future)
+    return run_coroutine(async_getTransactionReceipt(get_alchemy_rpc(), transactions))
 
-    return result
 
+async def _post_rpc(session, url, method, params):
+    from web3.providers.base import JSONBaseProvider
 
-async def async_make_request(session, url, method, params):
-    """Asynchronous JSON RPC API request"""
     base_provider = JSONBaseProvider()
     request_data = base_provider.encode_rpc_request(method, params)
     async with session.post(
         url, data=request_data, headers={"Content-Type": "application/json"}
     ) as response:
         content = await response.read()
-    response = base_provider.decode_rpc_response(content)
+    return base_provider.decode_rpc_response(content)
+
+
+async def async_make_request(session, url, method, params, cache: RPCCache = None):
+    """Asynchronous JSON RPC API request.
+
+    If `cache` is given, eth_calls against finalised blocks are served from it
+    and successful results are written back.
+    """
+    if cache is None or method != "eth_call":
+        return await _post_rpc(session, url, method, params)
+
+    if cache.get_chain_id(url) is None:
+        response = await _post_rpc(session, url, "eth_chainId", [])
+        cache.set_chain_id(url, response["result"])
+    if cache.get_head(url) is None:
+        response = await _post_rpc(session, url, "eth_blockNumber", [])
+        cache.set_head(url, response["result"])
+
+    key, result = cache.lookup(url, params)
+    if result is not None:
+        return {"jsonrpc": "2.0", "id": 0, "result": result}
+
+    response = await _post_rpc(session, url, method, params)
+    cache.store(key, response)
     return response
 
 
-async def async_getTransactionReceipt(node_address, transactions):
-    """Fetch all responses within one Client session, keep connection alive for all requests."""
-    tasks = []
-    async with ClientSession() as session:
-        for tran in transactions:
-            task = asyncio.ensure_future(
-                async_make_request(
-                    session, node_address, "eth_getTransactionReceipt", [tran]
+class TokenBucket:
+    """Async token bucket: allows `rate` acquisitions per second on average, with
+    bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens: float = 1) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
                 )
-            )
-            tasks.append(task)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+class RPCError(Exception):
+    pass
+
+
+def _is_rate_limited(response: dict) -> bool:
+    error = response.get("error")
+    if not isinstance(error, dict):
+        return False
+    message = str(error.get("message", "")).lower()
+    return error.get("code") in RETRY_ERROR_CODES or "rate limit" in message
+
+
+class AsyncRPCClient:
+    """Async JSON-RPC client for one endpoint.
+
+    Reuses a single pooled ClientSession, bounds the number of in-flight requests,
+    rate limits with a token bucket and retries 429s, 5xx responses and connection
+    errors with exponential backoff, also for single items of a batch the provider
+    throttled. Use as an async context manager:
+
+        async with AsyncRPCClient(ALCHEMY_RPC) as client:
+            async for idx, params, response in client.iter_requests(
+                "eth_getTransactionReceipt", ([tx] for tx in tx_hashes), batch_size=50
+            ):
+                ...
+
+    Args:
+        url (str): JSON-RPC endpoint
+        max_concurrency (int): max simultaneous HTTP requests
+        requests_per_second (float): sustained HTTP request rate
+        max_retries (int): attempts per request before giving up
+        timeout (float): per-request timeout in seconds
+        cache (RPCCache): optional cache for historical eth_calls
+    """
+
+    def __init__(
+        self,
+        url: str,
+        max_concurrency: int = 20,
+        requests_per_second: float = 25,
+        max_retries: int = 6,
+        timeout: float = 60,
+        cache: RPCCache = None,
+    ):
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.cache = cache
+        self.requests_sent = 0
+        self.retries = 0
+
+        self._rate_limiter = TokenBucket(requests_per_second)
+        self._semaphore = None
+        self._session = None
+        self._head_lock = None
+        self._next_id = 0
+
+    async def __aenter__(self):
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._head_lock = asyncio.Lock()
+        self._session = ClientSession(
+            connector=TCPConnector(limit=self.max_concurrency),
+            timeout=ClientTimeout(total=self.timeout),
+        )
+        if self.cache is not None:
+            chain_id, head = await self.batch([("eth_chainId", []), ("eth_blockNumber", [])])
+            self.cache.set_chain_id(self.url, chain_id["result"])
+            self.cache.set_head(self.url, head["result"])
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self._session.close()
+
+    def _payload(self, method: str, params: list) -> dict:
+        self._next_id += 1
+        return {"jsonrpc": "2.0", "id": self._next_id, "method": method, "params": params}
+
+    async def _backoff(self, attempt: int, retry_after: str = None) -> None:
+        self.retries += 1
+        if retry_after and retry_after.isdigit():
+            delay = int(retry_after)
+        else:
+            delay = min(2 ** attempt, 30) * (0.5 + random.random())
+        await asyncio.sleep(delay)
+
+    async def _post(self, payload):
+        for attempt in range(self.max_retries):
+            await self._rate_limiter.acquire()
+            async with self._semaphore:
+                try:
+                    self.requests_sent += 1
+                    async with self._session.post(self.url, json=payload) as response:
+                        content = await response.read()
+                        status = response.status
+                        retry_after = response.headers.get("Retry-After")
+                except (ClientError, asyncio.TimeoutError):
+                    status, retry_after = None, None
+
+            if status is not None and status not in RETRY_STATUSES:
+                if status >= 400:
+                    raise RPCError(f"HTTP {status}: {content[:200]}")
+                return json.loads(content)
+
+            await self._backoff(attempt, retry_after)
+
+        raise RPCError(f"Giving up on {self.url} after {self.max_retries} attempts")
+
+    async def _lookup(self, method: str, params: list) -> Tuple[Optional[tuple], Optional[dict]]:
+        """(cache key, cached response) for one call, see RPCCache.lookup. The cached
+        chain head expires after HEAD_TTL, so it is re-read here whenever it has."""
+        if self.cache is None or method != "eth_call":
+            return None, None
+        if self.cache.get_head(self.url) is None:
+            async with self._head_lock:
+                # another task may have refreshed it while this one waited
+                if self.cache.get_head(self.url) is None:
+                    response = await self._post(self._payload("eth_blockNumber", []))
+                    self.cache.set_head(self.url, response["result"])
+        key, result = self.cache.lookup(self.url, params)
+        if result is None:
+            return key, None
+        return key, {"jsonrpc": "2.0", "id": 0, "result": result}
+
+    def _store(self, key: Optional[tuple], response: dict) -> None:
+        if self.cache is not None:
+            self.cache.store(key, response)
+
+    async def request(self, method: str, params: list) -> dict:
+        """Single JSON-RPC request, returns the decoded response dict."""
+        key, cached = await self._lookup(method, params)
+        if cached is not None:
+            return cached
+
+        for attempt in range(self.max_retries):
+            response = await self._post(self._payload(method, params))
+            if not _is_rate_limited(response):
+                break
+            await self._backoff(attempt)
+        self._store(key, response)
+        return response
+
+    async def batch(self, calls: List[Tuple[str, list]]) -> List[dict]:
+        """Sends [(method, params), ...] as one JSON-RPC batch array, returns the
+        responses in the same order as `calls`.
+
+        Cached eth_calls are answered from the cache and left out of the batch. Items
+        the provider throttled, or left out of its answer, are sent again in a smaller
+        batch with backoff; after `max_retries` rounds their last response is returned.
+        """
+        keys, responses = [], []
+        for method, params in calls:
+            key, cached = await self._lookup(method, params)
+            keys.append(key)
+            responses.append(cached)
+
+        missing = [n for n, response in enumerate(responses) if response is None]
+        for attempt in range(self.max_retries):
+            if not missing:
+                break
+            if attempt:
+                await self._backoff(attempt - 1)
+            payload = [self._payload(*calls[n]) for n in missing]
+            answers = await self._post(payload)
+            if isinstance(answers, dict):
+                # some providers answer a rejected batch with a single error object
+                raise RPCError(answers.get("error", answers))
+            by_id = {answer.get("id"): answer for answer in answers}
+
+            throttled = []
+            for n, item in zip(missing, payload):
+                response = by_id.get(item["id"])
+                if response is None or _is_rate_limited(response):
+                    responses[n] = response or {"error": "missing response"}
+                    throttled.append(n)
+                    continue
+                responses[n] = response
+                self._store(keys[n], response)
+            missing = throttled
+        return responses
+
+    async def iter_requests(
+        self, method: str, params_iter: Iterable[list], batch_size: int = 1
+    ) -> AsyncIterator[Tuple[int, list, dict]]:
+        """Runs `method` for every params list in `params_iter` and yields
+        (index, params, response) in completion order.
+
+        Only `max_concurrency` requests (of `batch_size` calls each) are scheduled at
+        a time and `params_iter` is consumed lazily, so memory stays flat no matter
+        how many requests are made.
+        """
+        params_iter = enumerate(params_iter)
+
+        async def run(chunk):
+            if batch_size == 1:
+                idx, params = chunk[0]
+                return [(idx, params, await self.request(method, params))]
+            responses = await self.batch([(method, params) for _, params in chunk])
+            return [(idx, params, resp) for (idx, params), resp in zip(chunk, responses)]
+
+        def schedule(pending):
+            while len(pending) < self.max_concurrency:
+                chunk = [item for _, item in zip(range(batch_size), params_iter)]
+                if not chunk:
+                    return
+                pending.add(asyncio.ensure_future(run(chunk)))
+
+        pending = set()
+        schedule(pending)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                schedule(pending)
+                for task in done:
+                    for item in task.result():
+                        yield item
+        finally:
+            for task in pending:
+                task.cancel()
+
 
-        responses = await asyncio.gather(*tasks)
+async def async_getTransactionReceipt(node_address, transactions, batch_size: int = 50):
+    """Fetch all receipts within one Client session, keep connection alive for all requests."""
+    transactions = list(transactions)
+    responses = [None] * len(transactions)
+    async with AsyncRPCClient(node_address) as client:
+        async for idx, _, response in client.iter_requests(
+            "eth_getTransactionReceipt", ([tx] for tx in transactions), batch_size=batch_size
+        ):
+            responses[idx] = response
     return responses
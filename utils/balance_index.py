@@ -0,0 +1,239 @@
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List, Optional, Sequence, Union
+
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+
+# ERC-20 Transfer(address indexed from, address indexed to, uint256 value); the
+# topic only depends on the types, the names are what LogIndexer's columns are called
+TRANSFER_EVENT = {
+    "name": "Transfer",
+    "type": "event",
+    "anonymous": False,
+    "inputs": [
+        {"name": "sender", "type": "address", "indexed": True},
+        {"name": "receiver", "type": "address", "indexed": True},
+        {"name": "value", "type": "uint256", "indexed": False},
+    ],
+}
+
+# keys pack (address id, block) into one sortable int64
+BLOCK_BITS = 32
+
+# float64 balances within this fraction of an address' total flows are rounding
+# residuals of an exit, not holdings
+FLOAT_RESIDUAL = 1e-12
+
+
+class Interner:
+    """Dense integer ids for strings (lower-cased), e.g. addresses, so indexes can
+    hold int arrays instead of hex strings."""
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def get(self, value: str) -> Optional[int]:
+        return self._ids.get(value.lower())
+
+    def ids(self, values: Sequence[str]) -> np.ndarray:
+        """Ids of `values`, assigning new ids to unseen ones."""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object).str.lower())
+        ids = np.empty(len(uniques), dtype=np.int64)
+        for i, value in enumerate(uniques):
+            value_id = self._ids.get(value)
+            if value_id is None:
+                value_id = self._ids[value] = len(self.values)
+                self.values.append(value)
+            ids[i] = value_id
+        return ids[codes]
+
+
+class BalanceIndex:
+    """Point-in-time balances of every address from signed balance changes.
+
+    Changes are stored as one int64 key per change, `address id << 32 | block`, with
+    addresses interned to integer ids, plus the amount and the running balance per
+    address. Keys are kept sorted, so the balances of all holders at a block are one
+    vectorised searchsorted, and an address' history is a contiguous slice.
+
+    Changes can be added in any order (e.g. mints and burns of one event, then
+    transfers of another); sorting happens once before the next query.
+
+    Args:
+        exact (bool): keep amounts as python ints (wei). With float64 amounts an
+            address that sends out exactly what it received can keep a rounding
+            residual; those are snapped to 0, but balances are only approximate
+    """
+
+    def __init__(self, exact: bool = True):
+        self.exact = exact
+        self._addresses = Interner()
+        self._pending: List[tuple] = []
+        self._keys = np.zeros(0, dtype=np.int64)
+        self._amounts = np.zeros(0, dtype=object if exact else np.float64)
+        self._running = self._amounts.copy()
+        self._starts = np.zeros(1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        self._consolidate()
+        return len(self._keys)
+
+    @property
+    def addresses(self) -> List[str]:
+        return self._addresses.values
+
+    # ------- ingestion --------- #
+
+    def _amount_array(self, amounts) -> np.ndarray:
+        amounts = pd.Series(amounts)
+        if self.exact:
+            return np.array([int(amount) for amount in amounts], dtype=object)
+        if amounts.dtype == object:
+            # LogIndexer stores integers wider than 64 bits as decimal strings
+            return amounts.map(float).values.astype(np.float64)
+        return amounts.values.astype(np.float64)
+
+    def add(self, blocks: Sequence[int], addresses: Sequence[str], amounts) -> None:
+        """Adds balance changes: `amounts[i]` (signed) to `addresses[i]` at `blocks[i]`."""
+        if not len(blocks):
+            return
+        keys = (self._addresses.ids(addresses) << BLOCK_BITS) | np.asarray(blocks, dtype=np.int64)
+        self._pending.append((keys, self._amount_array(amounts)))
+
+    def add_transfers(
+        self,
+        transfers: pd.DataFrame,
+        sender: str = "sender",
+        receiver: str = "receiver",
+        value: str = "value",
+    ) -> None:
+        """Adds decoded Transfer logs (block_number plus sender, receiver and value
+        columns) as a debit of the sender and a credit of the receiver."""
+        amounts = self._amount_array(transfers[value].values)
+        blocks = transfers.block_number.values
+        self.add(blocks, transfers[sender].values, -amounts)
+        self.add(blocks, transfers[receiver].values, amounts)
+
+    def _consolidate(self) -> None:
+        if not self._pending:
+            return
+        keys = np.concatenate([self._keys] + [keys for keys, _ in self._pending])
+        amounts = np.concatenate([self._amounts] + [amounts for _, amounts in self._pending])
+        self._pending = []
+
+        order = np.argsort(keys, kind="stable")
+        self._keys, self._amounts = keys[order], amounts[order]
+        ids = self._keys >> BLOCK_BITS
+        self._starts = np.searchsorted(ids, np.arange(len(self.addresses) + 1))
+
+        if self.exact:
+            # python ints: one global cumsum minus the total before each address
+            running = np.cumsum(self._amounts)
+            starts = self._starts[:-1]
+            offset = np.zeros(len(starts), dtype=object)
+            offset[starts > 0] = running[starts[starts > 0] - 1]
+            self._running = running - np.repeat(offset, np.diff(self._starts))
+        else:
+            # per address, so float rounding of other holders' flows does not leak in
+            running = pd.Series(self._amounts).groupby(ids).cumsum().to_numpy(copy=True)
+            # what is left of a full exit is rounding error of the flows so far
+            flows = pd.Series(np.abs(self._amounts)).groupby(ids).cumsum().values
+            running[np.abs(running) <= flows * FLOAT_RESIDUAL] = 0.0
+            self._running = running
+
+    # ------- queries --------- #
+
+    def balances_at(self, block: int, include_zero: bool = False) -> pd.Series:
+        """Balance of every address at the end of `block`, indexed by address.
+
+        Addresses with a zero or negative balance (the zero address after mints) are
+        left out unless `include_zero`.
+        """
+        self._consolidate()
+        ids = np.arange(len(self.addresses), dtype=np.int64)
+        last = np.searchsorted(self._keys, (ids << BLOCK_BITS) | int(block), side="right") - 1
+        held = last >= self._starts[:-1]
+        balances = np.zeros(len(ids), dtype=self._running.dtype)
+        balances[held] = self._running[last[held]]
+        series = pd.Series(balances, index=self.addresses)
+        if include_zero:
+            return series
+        return series[series > 0]
+
+    def balance_of(self, address: str, blocks: Union[int, Sequence[int]]):
+        """Balance of `address` at the end of each of `blocks`."""
+        self._consolidate()
+        single = np.ndim(blocks) == 0
+        blocks = np.atleast_1d(np.asarray(blocks, dtype=np.int64))
+        balances = np.zeros(len(blocks), dtype=self._running.dtype)
+        address_id = self._addresses.get(address)
+        if address_id is not None:
+            start, stop = self._starts[address_id], self._starts[address_id + 1]
+            segment = self._keys[start:stop] & ((1 << BLOCK_BITS) - 1)
+            last = np.searchsorted(segment, blocks, side="right") - 1
+            balances[last >= 0] = self._running[start:stop][last[last >= 0]]
+        return balances[0] if single else balances
+
+    def history(self, address: str) -> pd.Series:
+        """Balance of `address` after every block it changed in, indexed by block."""
+        self._consolidate()
+        address_id = self._addresses.get(address)
+        if address_id is None:
+            return pd.Series([], dtype=self._running.dtype)
+        start, stop = self._starts[address_id], self._starts[address_id + 1]
+        blocks = self._keys[start:stop] & ((1 << BLOCK_BITS) - 1)
+        history = pd.Series(self._running[start:stop], index=blocks)
+        return history[~history.index.duplicated(keep="last")]
+
+
+class TokenBalanceIndex(BalanceIndex):
+    """`BalanceIndex` of an ERC-20 fed by its Transfer logs through a `LogIndexer`.
+
+    `update()` indexes the blocks since the last run and adds only the transfers not
+    seen yet, so a long running session (or a new one, reading the stored log
+    partitions) stays current without rescanning the chain.
+
+    Args:
+        token (str): token address
+        start_block (int): first block to index, e.g. the token's deployment
+        name (str): LogIndexer dataset name, defaults to `transfers_{token}`
+        rpc_url (str): JSON-RPC endpoint, defaults to Alchemy
+        exact (bool): see `BalanceIndex`
+    """
+
+    def __init__(
+        self,
+        token: str,
+        start_block: int = 0,
+        name: str = None,
+        rpc_url: str = None,
+        exact: bool = True,
+    ):
+        from utils.log_indexer import LogIndexer
+
+        super().__init__(exact=exact)
+        self.token = token
+        self.start_block = start_block
+        self.indexer = LogIndexer(
+            name or f"transfers_{token.lower()}", token, [TRANSFER_EVENT], rpc_url=rpc_url
+        )
+        self.last_block = start_block - 1
+
+    def update(self, to_block: int = None) -> int:
+        """Indexes and adds the transfers up to `to_block` (default: the last finalised
+        block).
+
+        Returns:
+            int: the last block included.
+        """
+        last = self.indexer.update(from_block=self.start_block, to_block=to_block)
+        transfers = self.indexer.load(self.last_block + 1, last)
+        if len(transfers):
+            self.add_transfers(transfers)
+        self.last_block = last
+        return last
@@ -0,0 +1,312 @@
+import json
+import os
+import time
+
+import numpy as np
+import requests
+
+from typing import Optional, Union
+
+from utils.rpc_cache import CACHE_DIR
+
+ETH_BLOCKS_SUBGRAPH = "https://api.thegraph.com/subgraphs/name/blocklytics/ethereum-blocks"
+
+# blocks are fetched and flushed to disk in segments, so an interrupted sync
+# loses at most one segment of work
+SYNC_SEGMENT = 100_000
+RPC_BATCH_SIZE = 100
+SUBGRAPH_PAGE_SIZE = 1000
+
+ArrayLike = Union[int, list, np.ndarray]
+
+
+class BlockTimestampIndex:
+    """Memory-mapped block number -> timestamp index.
+
+    Timestamps are stored as a flat uint32 array indexed by block number, so a block's
+    timestamp is an array lookup and the block at a timestamp is a binary search over
+    the (monotonic) timestamps. The index is synced incrementally: `sync` only fetches
+    blocks past the last synced one, either over JSON-RPC (`eth_getBlockByNumber`
+    batches) or from the blocklytics blocks subgraph.
+
+    Blocks past the synced range can also be filled in one by one (`fetch`,
+    `find_blocks_after`), for sparse lookups that should not pay for a sync from
+    genesis. They are kept in the same file (0 = not fetched) and reused later.
+
+    Args:
+        chain (str): name used for the on-disk file
+        path (str): directory holding the index files
+    """
+
+    def __init__(self, chain: str = "mainnet", path: str = CACHE_DIR):
+        os.makedirs(path, exist_ok=True)
+        self.chain = chain
+        self.data_path = os.path.join(path, f"block_timestamps_{chain}.u4")
+        self.meta_path = os.path.join(path, f"block_timestamps_{chain}.json")
+
+        self.synced_to = -1
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                self.synced_to = json.load(f)["synced_to"]
+        if not os.path.exists(self.data_path):
+            open(self.data_path, "wb").close()
+
+        self._timestamps = None
+        self._map()
+
+    def _map(self) -> None:
+        n_blocks = os.path.getsize(self.data_path) // 4
+        if n_blocks == 0:
+            self._timestamps = np.zeros(0, dtype=np.uint32)
+        else:
+            self._timestamps = np.memmap(self.data_path, dtype=np.uint32, mode="r+")
+
+    def _reserve(self, block: int) -> None:
+        """Grows the backing file so that `block` fits."""
+        capacity = len(self._timestamps)
+        if block < capacity:
+            return
+        new_capacity = max(block + 1, int(capacity * 1.25))
+        if isinstance(self._timestamps, np.memmap):
+            self._timestamps.flush()
+        self._timestamps = None
+        with open(self.data_path, "r+b") as f:
+            f.truncate(new_capacity * 4)
+        self._map()
+
+    def _commit(self, synced_to: int) -> None:
+        if isinstance(self._timestamps, np.memmap):
+            self._timestamps.flush()
+        self.synced_to = synced_to
+        with open(self.meta_path, "w") as f:
+            json.dump({"synced_to": synced_to, "updated": int(time.time())}, f)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """Timestamps of blocks 0..synced_to."""
+        return self._timestamps[: self.synced_to + 1]
+
+    # ------- syncing --------- #
+
+    def sync(self, to_block: int = None, source: str = "rpc", rpc_url: str = None) -> int:
+        """Fetches timestamps for all blocks after the last synced one.
+
+        Args:
+            to_block (int): last block to sync, defaults to the chain head
+            source (str): "rpc" or "subgraph"
+            rpc_url (str): JSON-RPC endpoint for the rpc source, defaults to Alchemy
+
+        Returns:
+            int: the last synced block.
+        """
+        if source == "rpc":
+            from utils.async_utils import run_coroutine
+            from utils.network_utils import get_alchemy_rpc
+
+            run_coroutine(self._sync_rpc(rpc_url or get_alchemy_rpc(), to_block))
+        elif source == "subgraph":
+            self._sync_subgraph(to_block)
+        else:
+            raise ValueError(f"Unknown block source: {source}")
+        return self.synced_to
+
+    async def _sync_rpc(self, rpc_url: str, to_block: Optional[int]) -> None:
+        from utils.async_utils import AsyncRPCClient
+
+        async with AsyncRPCClient(rpc_url) as client:
+            if to_block is None:
+                to_block = int((await client.request("eth_blockNumber", []))["result"], 16)
+            self._reserve(to_block)
+
+            while self.synced_to < to_block:
+                start = self.synced_to + 1
+                end = min(start + SYNC_SEGMENT - 1, to_block)
+                params = ([hex(block), False] for block in range(start, end + 1))
+                async for idx, _, response in client.iter_requests(
+                    "eth_getBlockByNumber", params, batch_size=RPC_BATCH_SIZE
+                ):
+                    block = response.get("result")
+                    if block is None:
+                        raise RuntimeError(f"Could not fetch block {start + idx}: {response}")
+                    self._timestamps[start + idx] = int(block["timestamp"], 16)
+                self._commit(end)
+
+    def _sync_subgraph(self, to_block: Optional[int]) -> None:
+        query = """
+        query ($last: BigInt!, $first: Int!) {
+          blocks(first: $first, orderBy: number, orderDirection: asc, where: {number_gt: $last}) {
+            number
+            timestamp
+          }
+        }
+        """
+        session = requests.Session()
+        while to_block is None or self.synced_to < to_block:
+            for attempt in range(5):
+                try:
+                    r = session.post(
+                        ETH_BLOCKS_SUBGRAPH,
+                        json={
+                            "query": query,
+                            "variables": {
+                                "last": str(self.synced_to),
+                                "first": SUBGRAPH_PAGE_SIZE,
+                            },
+                        },
+                    )
+                    rows = r.json()["data"]["blocks"]
+                    break
+                except (requests.RequestException, KeyError, ValueError):
+                    time.sleep(2 ** attempt)
+            else:
+                raise RuntimeError("Block subgraph keeps failing")
+
+            if not rows:
+                break
+            numbers = np.array([int(row["number"]) for row in rows])
+            stamps = np.array([int(row["timestamp"]) for row in rows], dtype=np.uint32)
+            if to_block is not None:
+                stamps, numbers = stamps[numbers <= to_block], numbers[numbers <= to_block]
+                if not len(numbers):
+                    break
+            # the subgraph has gaps; only advance over the contiguous part
+            contiguous = numbers - (self.synced_to + 1) == np.arange(len(numbers))
+            if not contiguous.all():
+                first_gap = int(np.argmin(contiguous))
+                numbers, stamps = numbers[:first_gap], stamps[:first_gap]
+                if not len(numbers):
+                    raise RuntimeError(f"Block subgraph is missing block {self.synced_to + 1}")
+            self._reserve(int(numbers[-1]))
+            self._timestamps[numbers] = stamps
+            self._commit(int(numbers[-1]))
+
+    # ------- sparse fetching --------- #
+
+    def _known(self, blocks: np.ndarray) -> np.ndarray:
+        """Whether the timestamp of each block is in the index (synced or fetched)."""
+        stored = np.zeros(blocks.shape, dtype=np.int64)
+        inside = (blocks >= 0) & (blocks < len(self._timestamps))
+        stored[inside] = self._timestamps[blocks[inside]]
+        return (blocks >= 0) & ((blocks <= self.synced_to) | (stored > 0))
+
+    def fetch(self, blocks: ArrayLike, rpc_url: str = None) -> None:
+        """Fetches the timestamps of those of `blocks` that are not in the index yet,
+        without syncing the blocks in between (one batched eth_getBlockByNumber per
+        `RPC_BATCH_SIZE` blocks)."""
+        from utils.async_utils import run_coroutine
+        from utils.network_utils import get_alchemy_rpc
+
+        blocks = np.unique(np.asarray(blocks, dtype=np.int64).ravel())
+        missing = blocks[~self._known(blocks)]
+        if len(missing):
+            run_coroutine(self._fetch_rpc(rpc_url or get_alchemy_rpc(), missing))
+
+    async def _fetch_rpc(self, rpc_url: str, blocks: np.ndarray) -> None:
+        from utils.async_utils import AsyncRPCClient
+
+        async with AsyncRPCClient(rpc_url) as client:
+            await self._fetch_blocks(client, blocks)
+
+    async def _fetch_blocks(self, client, blocks: np.ndarray) -> None:
+        self._reserve(int(blocks.max()))
+        params = ([hex(int(block)), False] for block in blocks)
+        async for idx, _, response in client.iter_requests(
+            "eth_getBlockByNumber", params, batch_size=RPC_BATCH_SIZE
+        ):
+            block = response.get("result")
+            if block is None:
+                raise RuntimeError(f"Could not fetch block {blocks[idx]}: {response}")
+            self._timestamps[blocks[idx]] = int(block["timestamp"], 16)
+        if isinstance(self._timestamps, np.memmap):
+            self._timestamps.flush()
+
+    def find_blocks_after(self, timestamps: ArrayLike, rpc_url: str = None):
+        """`block_after` for timestamps past the synced range: bisects over
+        eth_getBlockByNumber between the synced range and the chain head, all
+        timestamps at once. That is about log2(head) blocks per timestamp, fewer for
+        nearby timestamps, and fetched blocks are kept for the next lookups.
+        -1 where no block qualifies yet.
+        """
+        from utils.async_utils import run_coroutine
+        from utils.network_utils import get_alchemy_rpc
+
+        ts_arr = np.asarray(timestamps, dtype=np.int64)
+        blocks = run_coroutine(self._bisect(rpc_url or get_alchemy_rpc(), ts_arr.ravel()))
+        return int(blocks[0]) if ts_arr.ndim == 0 else blocks.reshape(ts_arr.shape)
+
+    async def _bisect(self, rpc_url: str, timestamps: np.ndarray) -> np.ndarray:
+        from utils.async_utils import AsyncRPCClient
+
+        async with AsyncRPCClient(rpc_url) as client:
+            head = int((await client.request("eth_blockNumber", []))["result"], 16)
+
+            # invariant: timestamp of lo <= t < timestamp of hi, with virtual blocks
+            # -1 and head + 1 at the ends
+            lo = np.full(len(timestamps), -1, dtype=np.int64)
+            hi = np.full(len(timestamps), head + 1, dtype=np.int64)
+            if self.synced_to >= 0:
+                after = np.searchsorted(self.timestamps, timestamps, side="right")
+                synced = after <= self.synced_to
+                hi[synced], lo[synced] = after[synced], after[synced] - 1
+                lo[~synced] = self.synced_to
+
+            active = np.nonzero(hi - lo > 1)[0]
+            while len(active):
+                mid = (lo[active] + hi[active]) // 2
+                unique = np.unique(mid)
+                missing = unique[~self._known(unique)]
+                if len(missing):
+                    await self._fetch_blocks(client, missing)
+                before = self._timestamps[mid].astype(np.int64) <= timestamps[active]
+                lo[active[before]] = mid[before]
+                hi[active[~before]] = mid[~before]
+                active = active[hi[active] - lo[active] > 1]
+
+        return np.where(hi > head, -1, hi)
+
+    # ------- lookups --------- #
+
+    def _check_known(self, blocks: np.ndarray) -> None:
+        if not blocks.size:
+            return
+        unknown = ~self._known(blocks.ravel())
+        if unknown.any():
+            raise IndexError(
+                f"Block {int(blocks.ravel()[unknown][0])} is outside the synced range "
+                f"0..{self.synced_to} and was not fetched"
+            )
+
+    def timestamp_of(self, blocks: ArrayLike) -> Union[int, np.ndarray]:
+        """Timestamp(s) of the given block number(s), synced or fetched."""
+        block_arr = np.asarray(blocks, dtype=np.int64)
+        self._check_known(block_arr)
+        result = self._timestamps[block_arr].astype(np.int64)
+        return int(result) if block_arr.ndim == 0 else result
+
+    def block_after(self, timestamps: ArrayLike) -> Union[int, np.ndarray]:
+        """First block with a timestamp strictly greater than each timestamp (the same
+        semantics as `get_block_for_timestamp`). -1 where no synced block qualifies."""
+        ts_arr = np.asarray(timestamps, dtype=np.int64)
+        blocks = np.searchsorted(self.timestamps, ts_arr, side="right").astype(np.int64)
+        blocks = np.where(blocks > self.synced_to, -1, blocks)
+        return int(blocks) if ts_arr.ndim == 0 else blocks
+
+    def block_at(self, timestamps: ArrayLike) -> Union[int, np.ndarray]:
+        """Last block with a timestamp at or before each timestamp, i.e. the chain head
+        at that moment. -1 for timestamps before genesis, and for timestamps after the
+        last synced block's, whose head may be a block that is not synced yet."""
+        ts_arr = np.asarray(timestamps, dtype=np.int64)
+        synced = self.timestamps
+        blocks = np.searchsorted(synced, ts_arr, side="right").astype(np.int64) - 1
+        if len(synced):
+            blocks = np.where(ts_arr > synced[-1], -1, blocks)
+        return int(blocks) if ts_arr.ndim == 0 else blocks
+
+
+_indexes = {}
+
+
+def get_block_index(chain: str = "mainnet") -> BlockTimestampIndex:
+    if chain not in _indexes:
+        _indexes[chain] = BlockTimestampIndex(chain)
+    return _indexes[chain]
@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List, NamedTuple, Sequence, Union
+
+from utils.subgraph_utils.client import SubgraphClient
+
+# one snapshot: a 1d array of holder balances. many snapshots: a 2d (snapshot x holder)
+# array where NaN marks holders absent from a snapshot, or a list of 1d arrays of
+# different lengths
+Balances = Union[np.ndarray, Sequence[np.ndarray]]
+
+
+class _Ranked(NamedTuple):
+    """Holders of every snapshot flattened into one array, sorted ascending by balance
+    within each snapshot (row)."""
+
+    values: np.ndarray
+    weights: np.ndarray
+    rows: np.ndarray
+    starts: np.ndarray
+    counts: np.ndarray
+    cumsum: np.ndarray  # inclusive cumulative weighted balance within the row
+    total: np.ndarray
+    weight_total: np.ndarray
+    single: bool
+
+
+def _flatten(data: Balances) -> (np.ndarray, np.ndarray, int, bool):
+    if isinstance(data, np.ndarray) and data.dtype != object and data.ndim <= 2:
+        single = data.ndim == 1
+        matrix = np.atleast_2d(data).astype(np.float64)
+        values = matrix.ravel()
+        rows = np.repeat(np.arange(matrix.shape[0]), matrix.shape[1])
+        return values, rows, matrix.shape[0], single
+    arrays = [np.asarray(a, dtype=np.float64).ravel() for a in data]
+    values = np.concatenate(arrays) if arrays else np.empty(0)
+    rows = np.repeat(np.arange(len(arrays)), [len(a) for a in arrays])
+    return values, rows, len(arrays), False
+
+
+def _rank(balances: Balances, weights: Balances = None) -> _Ranked:
+    values, rows, n_rows, single = _flatten(balances)
+    if weights is None:
+        w = np.ones_like(values)
+    else:
+        w, _, _, _ = _flatten(weights)
+        if w.shape != values.shape:
+            raise ValueError("weights must have the same shape as balances")
+
+    present = ~np.isnan(values)
+    values, rows, w = values[present], rows[present], w[present]
+
+    counts = np.bincount(rows, minlength=n_rows)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    # rows are contiguous, so sorting each row's slice in place is much cheaper than
+    # a global lexsort on (row, value)
+    for start, count in zip(starts, counts):
+        segment = slice(start, start + count)
+        if weights is None:
+            values[segment].sort()
+        else:
+            order = np.argsort(values[segment])
+            values[segment] = values[segment][order]
+            w[segment] = w[segment][order]
+    weighted = w * values
+    running = np.cumsum(weighted)
+    base = np.concatenate([[0.0], running])[starts]
+    cumsum = running - base[rows]
+
+    return _Ranked(
+        values=values,
+        weights=w,
+        rows=rows,
+        starts=starts,
+        counts=counts,
+        cumsum=cumsum,
+        total=np.bincount(rows, weights=weighted, minlength=n_rows),
+        weight_total=np.bincount(rows, weights=w, minlength=n_rows),
+        single=single,
+    )
+
+
+def _result(ranked: _Ranked, values: np.ndarray):
+    return values[0] if ranked.single else values
+
+
+def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(b > 0, a / b, np.nan)
+
+
+# ------- metrics --------- #
+
+
+def gini(balances: Balances, weights: Balances = None, ranked: _Ranked = None):
+    """Gini coefficient per snapshot in O(n log n), from the Lorenz curve of the
+    sorted balances instead of all n**2 pairwise differences.
+
+    Args:
+        balances: holder balances, see `Balances`
+        weights: optional frequency weights per holder (same shape as balances),
+            e.g. the number of addresses holding that balance
+
+    Returns:
+        float for a 1d input, otherwise an array with one value per snapshot.
+    """
+    r = ranked or _rank(balances, weights)
+    weighted = r.weights * r.values
+    # sum_i w_i * (S_{i-1} + S_i), with S the cumulative weighted balance
+    area = np.bincount(
+        r.rows, weights=r.weights * (2 * r.cumsum - weighted), minlength=len(r.total)
+    )
+    return _result(r, 1 - _divide(area, r.weight_total * r.total))
+
+
+def hhi(balances: Balances, weights: Balances = None, ranked: _Ranked = None):
+    """Herfindahl-Hirschman index: the sum of squared holder shares (0 to 1)."""
+    r = ranked or _rank(balances, weights)
+    squares = np.bincount(r.rows, weights=r.weights * r.values ** 2, minlength=len(r.total))
+    return _result(r, _divide(squares, r.total ** 2))
+
+
+def nakamoto_coefficient(balances: Balances, threshold: float = 0.5, ranked: _Ranked = None):
+    """Smallest number of holders that together hold more than `threshold` of the
+    supply. Counts holders, so frequency weights are not used here."""
+    r = ranked or _rank(balances)
+    # going down from the largest holder, everyone is needed until the holders below
+    # the current one hold less than (1 - threshold) of the supply
+    below = r.cumsum - r.values
+    needed_below = below >= (1 - threshold) * r.total[r.rows]
+    needed = np.bincount(r.rows, weights=needed_below, minlength=len(r.total)) + 1
+    return _result(r, np.where(r.total > 0, needed, 0).astype(np.int64))
+
+
+def top_k_share(balances: Balances, k: int = 10, ranked: _Ranked = None):
+    """Share of the supply held by the `k` largest holders."""
+    r = ranked or _rank(balances)
+    # cumulative balance of everyone outside the top k, i.e. the first count - k holders
+    outside = np.zeros(len(r.total))
+    has_outside = r.counts > k
+    last_outside = r.starts[has_outside] + r.counts[has_outside] - k - 1
+    outside[has_outside] = r.cumsum[last_outside]
+    return _result(r, _divide(r.total - outside, r.total))
+
+
+def concentration_metrics(
+    balances: Balances,
+    weights: Balances = None,
+    top_k: Sequence[int] = (10, 100),
+    threshold: float = 0.5,
+    index: Sequence = None,
+) -> pd.DataFrame:
+    """All concentration metrics for every snapshot, sorting the holders only once.
+
+    Args:
+        balances: holder balances, see `Balances`
+        weights: optional frequency weights (used by gini and hhi)
+        top_k (list(int)): sizes of the top-holder groups to report shares for
+        threshold (float): supply share for the Nakamoto coefficient
+        index: labels for the snapshots, e.g. block numbers
+
+    Returns:
+        pd.DataFrame: n_holders, gini, hhi, nakamoto and top_{k}_share per snapshot.
+    """
+    ranked = _rank(balances, weights)
+    unweighted = ranked if weights is None else _rank(balances)
+    df = pd.DataFrame(
+        {
+            "n_holders": ranked.counts,
+            "gini": np.atleast_1d(gini(None, ranked=ranked)),
+            "hhi": np.atleast_1d(hhi(None, ranked=ranked)),
+            "nakamoto": np.atleast_1d(
+                nakamoto_coefficient(None, threshold=threshold, ranked=unweighted)
+            ),
+        },
+        index=index,
+    )
+    for k in top_k:
+        df[f"top_{k}_share"] = np.atleast_1d(top_k_share(None, k=k, ranked=unweighted))
+    return df
+
+
+# ------- inputs --------- #
+
+
+def fetch_snapshots(
+    client: SubgraphClient,
+    entity: str,
+    field: str,
+    blocks: Sequence[int],
+    where: Dict = None,
+    decimals: int = 18,
+    max_workers: int = 8,
+) -> List[np.ndarray]:
+    """Fetches one numeric field of every `entity` at each block concurrently.
+
+    Returns:
+        list(np.ndarray): one array of balances (in token units) per block, in the
+            order of `blocks`.
+    """
+
+    def fetch(block):
+        df = client.fetch_all(entity, [field], where=where, block=int(block))
+        return df[field].astype(float).values / 10 ** decimals
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(fetch, blocks))
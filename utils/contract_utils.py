@@ -1,11 +1,92 @@
-from brownie import Contract
+import threading
+from collections import OrderedDict
 
+from brownie import Contract, chain, web3
+from web3 import Web3
+
+from typing import Optional
+
+from utils.abi_store import ABIStore, get_abi_store
+
+# storage slots holding the implementation address of upgradeable proxies
+PROXY_IMPLEMENTATION_SLOTS = [
+    # EIP-1967: bytes32(uint256(keccak256('eip1967.proxy.implementation')) - 1)
+    "0x360894a13ba1a3210667c828492db98dca3e2076cc3735a920a3ca505d382bbc",
+    # OpenZeppelin / zeppelinos: keccak256('org.zeppelinos.proxy.implementation')
+    "0x7050c9e0f4ca769c69bd3a8ef740bc37934f8e2c036e5a723fd8ee048ed3f8c3",
+]
+
+CONTRACT_CACHE_SIZE = 512
+
+_contracts = OrderedDict()
+_contracts_lock = threading.Lock()
+
+
+def _chain_id() -> int:
+    try:
+        return chain.id
+    except Exception:
+        # not connected: assume mainnet, which is where the stored ABIs come from
+        return 1
+
+
+def get_implementation(address: str) -> Optional[str]:
+    """Implementation address of an EIP-1967 / zeppelinos proxy, or None."""
+    for slot in PROXY_IMPLEMENTATION_SLOTS:
+        value = web3.eth.get_storage_at(address, slot)
+        implementation = int.from_bytes(bytes(value), "big")
+        if implementation:
+            return Web3.toChecksumAddress(f"0x{implementation:040x}")
+    return None
+
+
+def _load_contract(address: str, chain_id: int, store: ABIStore):
+    entry = store.get(chain_id, address)
+    if entry is not None:
+        return Contract.from_abi(entry["name"], address, entry["abi"])
 
-def init_contract(contract_addr: str):
     try:
-        return Contract(contract_addr)
-    except:
-        return Contract.from_explorer(contract_addr)
+        contract = Contract(address)
+    except Exception:
+        implementation = get_implementation(address)
+        contract = Contract.from_explorer(address, as_proxy_for=implementation)
+    else:
+        implementation = None
+
+    store.set(chain_id, address, contract.abi, name=contract._name, implementation=implementation)
+    return contract
+
+
+def init_contract(contract_addr: str, refresh: bool = False):
+    """Contract object for `contract_addr`.
+
+    Lookups go through an in-process LRU of contract objects, then the on-disk ABI
+    store (keyed by chain and address), and only then brownie's deployment db or the
+    block explorer, whose ABI (of the implementation, for proxies) is written back to
+    the store. Pass `refresh=True` after a proxy upgrade to refetch the ABI.
+    """
+    address = Web3.toChecksumAddress(contract_addr)
+    chain_id = _chain_id()
+    key = (chain_id, address)
+    store = get_abi_store()
+
+    with _contracts_lock:
+        if refresh:
+            _contracts.pop(key, None)
+            store.delete(chain_id, address)
+        elif key in _contracts:
+            _contracts.move_to_end(key)
+            return _contracts[key]
+
+    contract = _load_contract(address, chain_id, store)
+
+    with _contracts_lock:
+        _contracts[key] = contract
+        _contracts.move_to_end(key)
+        while len(_contracts) > CONTRACT_CACHE_SIZE:
+            _contracts.popitem(last=False)
+
+    return contract
 
 
 def main():
@@ -0,0 +1,756 @@
+# offline re-implementation of Curve CryptoSwap (v2) integer math: tricrypto2 style
+# 3-coin pools and 2-coin pools (e.g. the T/ETH threshold pool). The Newton solvers
+# work on python ints so results match the contracts exactly.
+#
+# the main use is replaying a pool's TokenExchange / AddLiquidity / RemoveLiquidity /
+# RemoveLiquidityOne / ClaimAdminFee logs through `tweak_price` to get price_scale,
+# last_prices and the price_oracle EMA at every block without calling the pool:
+#
+#   pool = CryptoSwapPool.from_contract(TRICRYPTO2, 3, block=start_block)
+#   states = replay(pool, events)        # events e.g. from LogIndexer.load()
+#   prices = price_series(states, blocks, timestamps, pool.ma_half_time)
+
+import inspect
+
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List, Sequence
+
+from utils.stableswap_math import as_int_array
+
+PRECISION = 10 ** 18
+A_MULTIPLIER = 10000
+EXP_PRECISION = 10 ** 10
+NOISE_FEE = 10 ** 5
+FEE_DENOMINATOR = 10 ** 10
+MAX_ITERATIONS = 255
+
+
+class ConvergenceError(Exception):
+    pass
+
+
+def _block_at_timestamp(web3, timestamp: int, block: int) -> int:
+    """Last block at or before `timestamp`, at or below `block`. Every block is at
+    least a second after its parent, so it is at most `block timestamp - timestamp`
+    blocks below `block`: a bisection over that range takes a few calls for recent
+    timestamps, instead of syncing a block index."""
+    lo = max(block - (web3.eth.get_block(block).timestamp - timestamp), 0)
+    hi = block
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if web3.eth.get_block(mid).timestamp <= timestamp:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+# ------- math --------- #
+
+
+def geometric_mean(unsorted_x: Sequence[int], sort: bool = True) -> int:
+    x = sorted(unsorted_x, reverse=True) if sort else list(unsorted_x)
+    n_coins = len(x)
+    D = x[0]
+    for _ in range(MAX_ITERATIONS):
+        D_prev = D
+        tmp = PRECISION
+        for _x in x:
+            tmp = tmp * _x // D
+        D = D * ((n_coins - 1) * PRECISION + tmp) // (n_coins * PRECISION)
+        diff = abs(D - D_prev)
+        if diff <= 1 or diff * PRECISION < D:
+            return D
+    raise ConvergenceError("geometric_mean did not converge")
+
+
+def reduction_coefficient(x: Sequence[int], fee_gamma: int) -> int:
+    """fee_gamma / (fee_gamma + (1 - K)), K = prod(x) / (sum(x) / N)**N"""
+    n_coins = len(x)
+    S = sum(x)
+    if n_coins == 2:
+        K = (PRECISION * n_coins ** n_coins) * x[0] // S * x[1] // S
+    else:
+        K = PRECISION
+        for x_i in x:
+            K = K * n_coins * x_i // S
+    if fee_gamma > 0:
+        K = fee_gamma * PRECISION // (fee_gamma + PRECISION - K)
+    return K
+
+
+def _g1k0(gamma: int, K0: int) -> int:
+    g1k0 = gamma + PRECISION
+    if g1k0 > K0:
+        return g1k0 - K0 + 1
+    return K0 - g1k0 + 1
+
+
+def newton_D(ANN: int, gamma: int, x_unsorted: Sequence[int]) -> int:
+    """CryptoSwap invariant D for balances in internal (price scaled) units."""
+    x = sorted(x_unsorted, reverse=True)
+    n_coins = len(x)
+    D = n_coins * geometric_mean(x, False)
+    S = sum(x)
+
+    for _ in range(MAX_ITERATIONS):
+        D_prev = D
+        if n_coins == 2:
+            K0 = (PRECISION * n_coins ** 2) * x[0] // D * x[1] // D
+        else:
+            K0 = PRECISION
+            for _x in x:
+                K0 = K0 * _x * n_coins // D
+        g1k0 = _g1k0(gamma, K0)
+
+        # D / (A * N**N) * g1k0**2 / gamma**2
+        mul1 = PRECISION * D // gamma * g1k0 // gamma * g1k0 * A_MULTIPLIER // ANN
+        # 2*N*K0 / g1k0
+        mul2 = (2 * PRECISION) * n_coins * K0 // g1k0
+
+        neg_fprime = (S + S * mul2 // PRECISION) + mul1 * n_coins // K0 - mul2 * D // PRECISION
+
+        D_plus = D * (neg_fprime + S) // neg_fprime
+        D_minus = D * D // neg_fprime
+        if PRECISION > K0:
+            D_minus += D * (mul1 // neg_fprime) // PRECISION * (PRECISION - K0) // K0
+        else:
+            D_minus -= D * (mul1 // neg_fprime) // PRECISION * (K0 - PRECISION) // K0
+
+        if D_plus > D_minus:
+            D = D_plus - D_minus
+        else:
+            D = (D_minus - D_plus) // 2
+
+        if abs(D - D_prev) * 10 ** 14 < max(10 ** 16, D):
+            return D
+
+    raise ConvergenceError("newton_D did not converge")
+
+
+def newton_y(ANN: int, gamma: int, x: Sequence[int], D: int, i: int) -> int:
+    """Balance of coin i (internal units) that keeps the pool on invariant D."""
+    n_coins = len(x)
+
+    if n_coins == 2:
+        x_j = x[1 - i]
+        y = D ** 2 // (x_j * n_coins ** 2)
+        K0_i = (PRECISION * n_coins) * x_j // D
+        S_i = x_j
+        convergence_limit = max(max(x_j // 10 ** 14, D // 10 ** 14), 100)
+    else:
+        y = D // n_coins
+        K0_i = PRECISION
+        S_i = 0
+        x_sorted = list(x)
+        x_sorted[i] = 0
+        x_sorted = sorted(x_sorted, reverse=True)
+        convergence_limit = max(max(x_sorted[0] // 10 ** 14, D // 10 ** 14), 100)
+        for j in range(2, n_coins + 1):
+            _x = x_sorted[n_coins - j]
+            y = y * D // (_x * n_coins)  # small _x first
+            S_i += _x
+        for j in range(n_coins - 1):
+            K0_i = K0_i * x_sorted[j] * n_coins // D  # large _x first
+
+    for _ in range(MAX_ITERATIONS):
+        y_prev = y
+        K0 = K0_i * y * n_coins // D
+        S = S_i + y
+        g1k0 = _g1k0(gamma, K0)
+
+        mul1 = PRECISION * D // gamma * g1k0 // gamma * g1k0 * A_MULTIPLIER // ANN
+        mul2 = PRECISION + (2 * PRECISION) * K0 // g1k0
+
+        yfprime = PRECISION * y + S * mul2 + mul1
+        dyfprime = D * mul2
+        if yfprime < dyfprime:
+            y = y_prev // 2
+            continue
+        yfprime -= dyfprime
+        fprime = yfprime // y
+
+        y_minus = mul1 // fprime
+        y_plus = (yfprime + PRECISION * D) // fprime + y_minus * PRECISION // K0
+        y_minus += PRECISION * S // fprime
+
+        if y_plus < y_minus:
+            y = y_prev // 2
+        else:
+            y = y_plus - y_minus
+
+        if abs(y - y_prev) < max(convergence_limit, y // 10 ** 14):
+            return y
+
+    raise ConvergenceError("newton_y did not converge")
+
+
+def halfpow(power) -> np.ndarray:
+    """1e18 * 0.5 ** (power / 1e18), vectorised over object arrays of python ints."""
+    shape = np.shape(power)
+    power = as_int_array(power).ravel()
+    intpow = power // PRECISION
+    otherpow = power - intpow * PRECISION
+
+    result = np.array(
+        [0 if p > 59 else PRECISION // 2 ** p for p in intpow], dtype=object
+    )
+    S = np.full(len(power), PRECISION, dtype=object)
+    term = np.full(len(power), PRECISION, dtype=object)
+    neg = np.zeros(len(power), dtype=bool)
+    x = 5 * 10 ** 17
+
+    active = np.nonzero(((otherpow != 0) & (intpow <= 59)).astype(bool))[0]
+    series = active
+    for i in range(1, 256):
+        if not len(active):
+            break
+        K = i * PRECISION
+        c = K - PRECISION
+        other = otherpow[active]
+        above = (other > c).astype(bool)
+        c = np.where(above, other - c, c - other)
+        neg[active] ^= above
+        term[active] = term[active] * (c * x // PRECISION) // K
+        S[active] = np.where(neg[active], S[active] - term[active], S[active] + term[active])
+        active = active[~(term[active] < EXP_PRECISION).astype(bool)]
+    if len(active):
+        raise ConvergenceError("halfpow did not converge")
+
+    result[series] = result[series] * S[series] // PRECISION
+    return result.reshape(shape)
+
+
+def sqrt_int(x: int) -> int:
+    """sqrt(x) in 1e18 fixed point, for x in 1e18 units."""
+    if x == 0:
+        return 0
+    z = (x + PRECISION) // 2
+    y = x
+    for _ in range(256):
+        if z == y:
+            return y
+        y = z
+        z = (x * PRECISION // z + z) // 2
+    raise ConvergenceError("sqrt_int did not converge")
+
+
+# ------- pool --------- #
+
+
+class CryptoSwapPool:
+    """State of a CryptoSwap (v2) pool with the contract's repegging logic.
+
+    Prices (price_scale, price_oracle, last_prices) are lists of N-1 values: the price
+    of coins 1..N-1 in units of coin 0. A/gamma ramps are not modelled; the values
+    read at seeding time are used throughout.
+    """
+
+    def __init__(
+        self,
+        balances: Sequence[int],
+        precisions: Sequence[int],
+        A: int,
+        gamma: int,
+        mid_fee: int,
+        out_fee: int,
+        fee_gamma: int,
+        allowed_extra_profit: int,
+        adjustment_step: int,
+        ma_half_time: int,
+        admin_fee: int,
+        price_scale: Sequence[int],
+        price_oracle: Sequence[int],
+        last_prices: Sequence[int],
+        last_prices_timestamp: int,
+        total_supply: int,
+        D: int = None,
+        virtual_price: int = None,
+        xcp_profit: int = None,
+        xcp_profit_a: int = None,
+        not_adjusted: bool = False,
+    ):
+        self.n_coins = len(balances)
+        self.balances = [int(b) for b in balances]
+        self.precisions = [int(p) for p in precisions]
+        self.A = int(A)
+        self.gamma = int(gamma)
+        self.mid_fee = int(mid_fee)
+        self.out_fee = int(out_fee)
+        self.fee_gamma = int(fee_gamma)
+        self.allowed_extra_profit = int(allowed_extra_profit)
+        self.adjustment_step = int(adjustment_step)
+        self.ma_half_time = int(ma_half_time)
+        self.admin_fee = int(admin_fee)
+        self.price_scale = [int(p) for p in price_scale]
+        self.price_oracle = [int(p) for p in price_oracle]
+        self.last_prices = [int(p) for p in last_prices]
+        self.last_prices_timestamp = int(last_prices_timestamp)
+        self.total_supply = int(total_supply)
+        self.not_adjusted = not_adjusted
+
+        self.D = int(D) if D is not None else newton_D(self.A, self.gamma, self.xp())
+        self.virtual_price = (
+            int(virtual_price)
+            if virtual_price is not None
+            else PRECISION * self.get_xcp(self.D) // self.total_supply
+        )
+        self.xcp_profit = int(xcp_profit) if xcp_profit is not None else PRECISION
+        self.xcp_profit_a = int(xcp_profit_a) if xcp_profit_a is not None else PRECISION
+
+    @staticmethod
+    def read_state(contract, n_coins: int, block: int = None) -> Dict:
+        """The pool's on-chain state at `block` (default latest), as a json-serialisable
+        dict that `from_state` turns into a pool.
+
+        price_oracle, last_prices and last_prices_timestamp are the stored values the
+        next tweak_price starts from. Whether the price_oracle view returns the stored
+        EMA or extrapolates it to the block timestamp differs between pool versions, so
+        it is read at the block of `last_prices_timestamp` (from the local block index
+        if it is synced that far, else by bisection): no time has passed there since
+        the last update, and both kinds of view return the stored value.
+        scripts/check_cryptoswap_math.py reports which kind a pool has.
+        """
+        from brownie import web3
+
+        from utils import init_contract
+        from utils.block_index import get_block_index
+
+        if isinstance(contract, str):
+            contract = init_contract(contract)
+        block = web3.eth.get_block(block if block is not None else "latest")
+        kw = {"block_identifier": block.number}
+
+        def prices(fn, **kwargs):
+            if n_coins == 2:
+                return [int(fn(**kwargs))]
+            return [int(fn(k, **kwargs)) for k in range(n_coins - 1)]
+
+        last_prices_timestamp = contract.last_prices_timestamp(**kw)
+        index = get_block_index()
+        if index.synced_to >= block.number:
+            oracle_block = int(index.block_at(last_prices_timestamp))
+        else:
+            oracle_block = _block_at_timestamp(web3, last_prices_timestamp, block.number)
+
+        token = init_contract(contract.token(**kw))
+        try:
+            not_adjusted = contract.not_adjusted(**kw)
+        except AttributeError:
+            not_adjusted = False
+
+        return {
+            "block": block.number,
+            "timestamp": block.timestamp,
+            "balances": [int(contract.balances(i, **kw)) for i in range(n_coins)],
+            "decimals": [
+                int(init_contract(contract.coins(i, **kw)).decimals()) for i in range(n_coins)
+            ],
+            "A": int(contract.A(**kw)),
+            "gamma": int(contract.gamma(**kw)),
+            "mid_fee": int(contract.mid_fee(**kw)),
+            "out_fee": int(contract.out_fee(**kw)),
+            "fee_gamma": int(contract.fee_gamma(**kw)),
+            "allowed_extra_profit": int(contract.allowed_extra_profit(**kw)),
+            "adjustment_step": int(contract.adjustment_step(**kw)),
+            "ma_half_time": int(contract.ma_half_time(**kw)),
+            "admin_fee": int(contract.admin_fee(**kw)),
+            "price_scale": prices(contract.price_scale, **kw),
+            "price_oracle": prices(contract.price_oracle, block_identifier=oracle_block),
+            "last_prices": prices(contract.last_prices, **kw),
+            "last_prices_timestamp": int(last_prices_timestamp),
+            "total_supply": int(token.totalSupply(**kw)),
+            "D": int(contract.D(**kw)),
+            "virtual_price": int(contract.virtual_price(**kw)),
+            "xcp_profit": int(contract.xcp_profit(**kw)),
+            "xcp_profit_a": int(contract.xcp_profit_a(**kw)),
+            "not_adjusted": bool(not_adjusted),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict):
+        """Pool from a `read_state` dict (e.g. recorded in a fixture)."""
+        arguments = inspect.signature(cls).parameters
+        params = {k: v for k, v in state.items() if k in arguments}
+        precisions = [10 ** (18 - decimals) for decimals in state["decimals"]]
+        return cls(precisions=precisions, **params)
+
+    @classmethod
+    def from_contract(cls, contract, n_coins: int, block: int = None):
+        """Seeds the pool from on-chain state at `block` (default latest), see
+        `read_state`."""
+        return cls.from_state(cls.read_state(contract, n_coins, block))
+
+    # ------- views --------- #
+
+    def xp(self, balances: Sequence[int] = None) -> List[int]:
+        balances = self.balances if balances is None else balances
+        xp = [balances[0] * self.precisions[0]]
+        for k in range(1, self.n_coins):
+            xp.append(balances[k] * self.price_scale[k - 1] * self.precisions[k] // PRECISION)
+        return xp
+
+    def fee(self, xp: Sequence[int]) -> int:
+        f = reduction_coefficient(xp, self.fee_gamma)
+        return (self.mid_fee * f + self.out_fee * (PRECISION - f)) // PRECISION
+
+    def get_xcp(self, D: int) -> int:
+        x = [D // self.n_coins] + [
+            D * PRECISION // (p * self.n_coins) for p in self.price_scale
+        ]
+        return geometric_mean(x, True)
+
+    def get_dy(self, i: int, j: int, dx) -> np.ndarray:
+        """Output of coin j for dx of coin i, like the pool's get_dy. `dx` may be an
+        array; each element is solved independently."""
+
+        def scalar(amount):
+            balances = list(self.balances)
+            balances[i] += int(amount)
+            xp = self.xp(balances)
+            y = newton_y(self.A, self.gamma, xp, self.D, j)
+            dy = xp[j] - y - 1
+            xp[j] = y
+            if j > 0:
+                dy = dy * PRECISION // self.price_scale[j - 1]
+            dy //= self.precisions[j]
+            return dy - self.fee(xp) * dy // FEE_DENOMINATOR
+
+        amounts = as_int_array(dx)
+        return np.array([scalar(a) for a in amounts.ravel()], dtype=object).reshape(
+            amounts.shape
+        )
+
+    def price_oracle_at(self, timestamps) -> np.ndarray:
+        """The EMA oracle extrapolated to each timestamp (>= last_prices_timestamp),
+        i.e. what the next tweak_price folds in, vectorised: returns an array of shape
+        (len(timestamps), N-1)."""
+        t = as_int_array(timestamps).ravel()
+        elapsed = np.maximum(t - self.last_prices_timestamp, 0)
+        alpha = halfpow(elapsed * PRECISION // self.ma_half_time)
+        out = np.empty((len(t), self.n_coins - 1), dtype=object)
+        for k in range(self.n_coins - 1):
+            ema = (
+                self.last_prices[k] * (PRECISION - alpha) + self.price_oracle[k] * alpha
+            ) // PRECISION
+            out[:, k] = np.where(elapsed > 0, ema, self.price_oracle[k])
+        return out
+
+    # ------- state changes --------- #
+
+    def tweak_price(self, timestamp: int, xp: Sequence[int], i: int, p_i: int, new_D: int) -> None:
+        """The contract's tweak_price: updates the EMA oracle, last prices, profit
+        counters and, if profitable, moves price_scale towards the oracle."""
+        n_coins = self.n_coins
+        A, gamma = self.A, self.gamma
+
+        if self.last_prices_timestamp < timestamp:
+            alpha = int(
+                halfpow((timestamp - self.last_prices_timestamp) * PRECISION // self.ma_half_time)
+            )
+            self.price_oracle = [
+                (last * (PRECISION - alpha) + oracle * alpha) // PRECISION
+                for last, oracle in zip(self.last_prices, self.price_oracle)
+            ]
+            self.last_prices_timestamp = timestamp
+
+        D_unadjusted = new_D if new_D else newton_D(A, gamma, xp)
+
+        if p_i > 0:
+            if i > 0:
+                self.last_prices[i - 1] = p_i
+            else:
+                # if the 0th price changed, all prices change instead
+                self.last_prices = [p * PRECISION // p_i for p in self.last_prices]
+        else:
+            # calculate real prices
+            xp_shifted = list(xp)
+            dx_price = xp_shifted[0] // 10 ** 6
+            xp_shifted[0] += dx_price
+            self.last_prices = [
+                self.price_scale[k]
+                * dx_price
+                // (xp[k + 1] - newton_y(A, gamma, xp_shifted, D_unadjusted, k + 1))
+                for k in range(n_coins - 1)
+            ]
+
+        old_xcp_profit = self.xcp_profit
+        old_virtual_price = self.virtual_price
+
+        # update profit numbers without price adjustment first
+        xcp_profit = PRECISION
+        virtual_price = PRECISION
+        if old_virtual_price > 0:
+            xcp = self.get_xcp(D_unadjusted)
+            virtual_price = PRECISION * xcp // self.total_supply
+            xcp_profit = old_xcp_profit * virtual_price // old_virtual_price
+        self.xcp_profit = xcp_profit
+
+        if n_coins == 2:
+            norm = self.price_oracle[0] * PRECISION // self.price_scale[0]
+            norm = norm - PRECISION if norm > PRECISION else PRECISION - norm
+            adjustment_step = max(self.adjustment_step, norm // 5)
+            can_adjust = norm > adjustment_step and old_virtual_price > 0
+            if (
+                not self.not_adjusted
+                and virtual_price * 2 - PRECISION > xcp_profit + 2 * self.allowed_extra_profit
+                and can_adjust
+            ):
+                self.not_adjusted = True
+        else:
+            adjustment_step = self.adjustment_step
+            if (
+                not self.not_adjusted
+                and virtual_price * 2 - PRECISION > xcp_profit + 2 * self.allowed_extra_profit
+            ):
+                self.not_adjusted = True
+            norm = 0
+            for oracle, scale in zip(self.price_oracle, self.price_scale):
+                ratio = oracle * PRECISION // scale
+                ratio = ratio - PRECISION if ratio > PRECISION else PRECISION - ratio
+                norm += ratio ** 2
+            can_adjust = norm > adjustment_step ** 2 and old_virtual_price > 0
+            if can_adjust:
+                norm = sqrt_int(norm // PRECISION)
+
+        if self.not_adjusted and can_adjust:
+            p_new = [
+                (scale * (norm - adjustment_step) + adjustment_step * oracle) // norm
+                for scale, oracle in zip(self.price_scale, self.price_oracle)
+            ]
+            xp_new = [xp[0]] + [
+                xp[k + 1] * p_new[k] // self.price_scale[k] for k in range(n_coins - 1)
+            ]
+            D = newton_D(A, gamma, xp_new)
+            x = [D // n_coins] + [D * PRECISION // (n_coins * p) for p in p_new]
+            new_virtual_price = PRECISION * geometric_mean(x, True) // self.total_supply
+
+            # proceed if we've got enough profit
+            if new_virtual_price > PRECISION and 2 * new_virtual_price - PRECISION > xcp_profit:
+                self.price_scale = p_new
+                self.D = D
+                self.virtual_price = new_virtual_price
+                return
+            self.not_adjusted = False
+
+        # the price_scale adjustment did not happen
+        self.D = D_unadjusted
+        self.virtual_price = virtual_price
+
+    def apply_exchange(self, timestamp: int, i: int, dx: int, j: int, dy: int) -> None:
+        """Replays a TokenExchange (dy is the amount received, after fees)."""
+        self.balances[i] += dx
+        self.balances[j] -= dy
+        xp = self.xp()
+
+        p = 0
+        ix = j
+        if dx > 10 ** 5 and dy > 10 ** 5:
+            _dx = dx * self.precisions[i]
+            _dy = dy * self.precisions[j]
+            if i != 0 and j != 0:
+                p = self.last_prices[i - 1] * _dx // _dy
+            elif i == 0:
+                p = _dx * PRECISION // _dy
+            else:
+                p = _dy * PRECISION // _dx
+                ix = i
+        self.tweak_price(timestamp, xp, ix, p, 0)
+
+    def apply_add_liquidity(self, timestamp: int, amounts: Sequence[int], token_supply: int) -> None:
+        """Replays an AddLiquidity (token_supply is the supply after minting)."""
+        d_token = token_supply - self.total_supply
+        self.balances = [b + a for b, a in zip(self.balances, amounts)]
+        self.total_supply = token_supply
+        xp = self.xp()
+        D = newton_D(self.A, self.gamma, xp)
+
+        added = [k for k, amount in enumerate(amounts) if amount > 0]
+        ix = added[0] if len(added) == 1 else self.n_coins
+        p = 0
+        if d_token > 10 ** 5 and ix < self.n_coins:
+            xx = self.balances
+            S = 0
+            for k in range(self.n_coins):
+                if k == ix:
+                    continue
+                if k == 0:
+                    S += xx[0] * self.precisions[0]
+                else:
+                    S += xx[k] * self.last_prices[k - 1] * self.precisions[k] // PRECISION
+            S = S * d_token // token_supply
+            p = S * PRECISION // (
+                amounts[ix] * self.precisions[ix]
+                - d_token * xx[ix] * self.precisions[ix] // token_supply
+            )
+        self.tweak_price(timestamp, xp, ix, p, D)
+
+    def apply_remove_liquidity(self, amounts: Sequence[int], token_supply: int) -> None:
+        """Replays a balanced RemoveLiquidity (no price change)."""
+        amount = self.total_supply - token_supply - 1
+        self.D = self.D - self.D * amount // self.total_supply
+        self.balances = [b - a for b, a in zip(self.balances, amounts)]
+        self.total_supply = token_supply
+
+    def apply_remove_liquidity_one(
+        self, timestamp: int, token_amount: int, i: int, coin_amount: int
+    ) -> None:
+        """Replays a RemoveLiquidityOne."""
+        xx = list(self.balances)
+        xp = self.xp()
+        D0 = self.D
+        fee = self.fee(xp)
+        dD = token_amount * D0 // self.total_supply
+        D = D0 - (dD - (fee * dD // (2 * FEE_DENOMINATOR) + 1))
+        y = newton_y(self.A, self.gamma, xp, D, i)
+        xp[i] = y
+
+        p = 0
+        if coin_amount > 10 ** 5 and token_amount > 10 ** 5:
+            S = 0
+            for k in range(self.n_coins):
+                if k == i:
+                    continue
+                if k == 0:
+                    S += xx[0] * self.precisions[0]
+                else:
+                    S += xx[k] * self.last_prices[k - 1] * self.precisions[k] // PRECISION
+            S = S * dD // D0
+            p = S * PRECISION // (
+                coin_amount * self.precisions[i] - dD * xx[i] * self.precisions[i] // D0
+            )
+
+        self.balances[i] -= coin_amount
+        self.total_supply -= token_amount
+        self.tweak_price(timestamp, xp, i, p, D)
+
+    def apply_claim_admin_fee(self, tokens: int) -> None:
+        """Replays a ClaimAdminFee: admin LP tokens are minted out of xcp_profit."""
+        fees = (self.xcp_profit - self.xcp_profit_a) * self.admin_fee // (2 * FEE_DENOMINATOR)
+        if fees > 0:
+            self.xcp_profit -= fees * 2
+        self.total_supply += tokens
+        self.D = newton_D(self.A, self.gamma, self.xp())
+        self.virtual_price = PRECISION * self.get_xcp(self.D) // self.total_supply
+        if self.xcp_profit > self.xcp_profit_a:
+            self.xcp_profit_a = self.xcp_profit
+
+    def snapshot(self) -> Dict:
+        state = {
+            "D": self.D,
+            "virtual_price": self.virtual_price,
+            "xcp_profit": self.xcp_profit,
+            "total_supply": self.total_supply,
+            "last_prices_timestamp": self.last_prices_timestamp,
+        }
+        for k in range(self.n_coins):
+            state[f"balance_{k}"] = self.balances[k]
+        for k in range(self.n_coins - 1):
+            state[f"price_scale_{k}"] = self.price_scale[k]
+            state[f"price_oracle_{k}"] = self.price_oracle[k]
+            state[f"last_prices_{k}"] = self.last_prices[k]
+        return state
+
+
+# ------- replay --------- #
+
+
+def replay(pool: CryptoSwapPool, events: pd.DataFrame) -> pd.DataFrame:
+    """Applies decoded pool events in (block, log index) order and records the pool
+    state after each one.
+
+    Args:
+        pool (CryptoSwapPool): pool seeded at (or before) the first event's block
+        events (pd.DataFrame): decoded logs with block_number, log_index, event and
+            the event args; a `timestamp` column is looked up in the block index if
+            missing
+
+    Returns:
+        pd.DataFrame: pool state after every event, indexed like `events`.
+    """
+    events = events.sort_values(["block_number", "log_index"]).reset_index(drop=True)
+    if "timestamp" not in events:
+        from utils.eth_blocks_utils import get_timestamps_for_blocks
+
+        events["timestamp"] = get_timestamps_for_blocks(events.block_number.values)
+
+    def amounts(row):
+        return [int(row[f"token_amounts_{k}"]) for k in range(pool.n_coins)]
+
+    states = []
+    for row in events.to_dict("records"):
+        timestamp = int(row["timestamp"])
+        event = row["event"]
+        if event == "TokenExchange":
+            pool.apply_exchange(
+                timestamp,
+                int(row["sold_id"]),
+                int(row["tokens_sold"]),
+                int(row["bought_id"]),
+                int(row["tokens_bought"]),
+            )
+        elif event == "AddLiquidity":
+            pool.apply_add_liquidity(timestamp, amounts(row), int(row["token_supply"]))
+        elif event == "RemoveLiquidity":
+            pool.apply_remove_liquidity(amounts(row), int(row["token_supply"]))
+        elif event == "RemoveLiquidityOne":
+            pool.apply_remove_liquidity_one(
+                timestamp, int(row["token_amount"]), int(row["coin_index"]), int(row["coin_amount"])
+            )
+        elif event == "ClaimAdminFee":
+            pool.apply_claim_admin_fee(int(row["tokens"]))
+        else:
+            continue
+        states.append(
+            {"block_number": row["block_number"], "log_index": row["log_index"], **pool.snapshot()}
+        )
+
+    return pd.DataFrame(states)
+
+
+def price_series(
+    states: pd.DataFrame,
+    blocks: Sequence[int],
+    timestamps: Sequence[int],
+    ma_half_time: int,
+) -> pd.DataFrame:
+    """Pool prices at the end of every block in `blocks`, from replayed `states`.
+
+    price_scale and last_prices are step functions of the events; price_oracle also
+    decays towards last_prices between events, which is evaluated for all blocks at
+    once with the vectorised halfpow.
+
+    Args:
+        states (pd.DataFrame): output of `replay`
+        blocks (list(int)): blocks to sample, sorted
+        timestamps (list(int)): timestamp of each block
+        ma_half_time (int): the pool's ma_half_time
+
+    Returns:
+        pd.DataFrame: indexed by block, with price_scale_k, last_prices_k and
+            price_oracle_k columns (floats, in coin 0 units).
+    """
+    blocks = np.asarray(blocks, dtype=np.int64)
+    timestamps = as_int_array(timestamps)
+    # the last state at or before each block (end of block)
+    idx = np.searchsorted(states.block_number.values, blocks, side="right") - 1
+    if (idx < 0).any():
+        raise ValueError("blocks before the first replayed event have no state")
+    state = states.iloc[idx].reset_index(drop=True)
+
+    n_prices = len([c for c in states.columns if c.startswith("price_scale_")])
+    out = {"block": blocks, "timestamp": timestamps.astype(np.int64)}
+    last_update = as_int_array(state.last_prices_timestamp.values)
+    elapsed = np.maximum(timestamps - last_update, 0)
+    alpha = halfpow(elapsed * PRECISION // ma_half_time)
+    for k in range(n_prices):
+        last = as_int_array(state[f"last_prices_{k}"].values)
+        oracle = as_int_array(state[f"price_oracle_{k}"].values)
+        ema = (last * (PRECISION - alpha) + oracle * alpha) // PRECISION
+        out[f"price_oracle_{k}"] = ema.astype(np.float64) / 1e18
+        out[f"price_scale_{k}"] = state[f"price_scale_{k}"].values.astype(np.float64) / 1e18
+        out[f"last_prices_{k}"] = last.astype(np.float64) / 1e18
+
+    return pd.DataFrame(out).set_index("block")
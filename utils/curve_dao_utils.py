@@ -22,15 +22,17 @@
 
 import json
 import warnings
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
 
 import requests
 
-from typing import Dict, List, Tuple
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
-from brownie import chain, network
+from brownie import accounts, chain, network
 from brownie.convert import to_address
 
-from utils import init_contract
+from utils import evm_script, init_contract
 
 warnings.filterwarnings("ignore")
 
@@ -74,18 +76,38 @@ def prepare_evm_script(target: Dict, actions: Dict) -> str:
     Returns:
         str: Generated EVM script.
     """
-    agent = init_contract(target["agent"])
-    evm_script = "0x00000001"
-
+    # encoded offline; only actions whose ABI isn't stored locally need the explorer
+    abis = {}
     for address, fn_name, *args in actions:
-        contract = init_contract(address)
-        fn = getattr(contract, fn_name)
-        calldata = fn.encode_input(*args)
-        agent_calldata = agent.execute.encode_input(address, 0, calldata)[2:]
-        length = hex(len(agent_calldata) // 2)[2:].zfill(8)
-        evm_script = f"{evm_script}{agent.address[2:]}{length}{agent_calldata}"
+        try:
+            evm_script.resolve_signature(address, fn_name, len(args))
+        except evm_script.EVMScriptError:
+            abis[address] = init_contract(address).abi
+
+    return evm_script.prepare_evm_script(target, actions, abis)
 
-    return evm_script
+
+def _new_vote(
+    sender: str, target: Dict, actions: List[Tuple], description: str, metadata: str
+):
+    """Sends the newVote transaction (through the forwarder for the emergency DAO) and
+    returns it."""
+    if network.show_active() == "mainnet":
+        kw = {"from": sender, "priority_fee": "2 gwei"}
+    else:
+        kw = {"from": sender}
+
+    aragon = init_contract(target["voting"])
+    script = prepare_evm_script(target, actions)
+    if target.get("forwarder"):
+        # the emergency DAO only allows new votes via a forwarder contract
+        # so we have to wrap the call in another layer of evm script
+        script = evm_script.encode_forwarded_vote(aragon.address, script, description)
+        print(f"Target: {target['forwarder']}\nEVM script: {script}")
+        return init_contract(target["forwarder"]).forward(script, kw)
+
+    print(f"Target: {aragon.address}\nEVM script: {script}")
+    return aragon.newVote(script, metadata, False, False, kw)
 
 
 def make_vote(sender: str, target: Dict, actions: List[Tuple], description: str) -> str:
@@ -102,10 +124,6 @@ def make_vote(sender: str, target: Dict, actions: List[Tuple], description: str)
     Returns:
         str: vote ID of the created vote.
     """
-    if network.show_active() == "mainnet":
-        kw = {"from": sender, "priority_fee": "2 gwei"}
-    else:
-        kw = {"from": sender}
     text = json.dumps({"text": description})
     response = requests.post(
         "https://ipfs.infura.io:5001/api/v0/add", files={"file": text}
@@ -113,37 +131,16 @@ def make_vote(sender: str, target: Dict, actions: List[Tuple], description: str)
     ipfs_hash = response.json()["Hash"]
     print(f"ipfs hash: {ipfs_hash}")
 
-    aragon = init_contract(target["voting"])
-    evm_script = prepare_evm_script(target, actions)
-    if target.get("forwarder"):
-        # the emergency DAO only allows new votes via a forwarder contract
-        # so we have to wrap the call in another layer of evm script
-        vote_calldata = aragon.newVote.encode_input(
-            evm_script, description, False, False
-        )[2:]
-        length = hex(len(vote_calldata) // 2)[2:].zfill(8)
-        evm_script = f"0x00000001{aragon.address[2:]}{length}{vote_calldata}"
-        print(f"Target: {target['forwarder']}\nEVM script: {evm_script}")
-        tx = init_contract(target["forwarder"]).forward(evm_script, kw)
-    else:
-        print(f"Target: {aragon.address}\nEVM script: {evm_script}")
-        tx = aragon.newVote(evm_script, f"ipfs:{ipfs_hash}", False, False, kw)
-
+    tx = _new_vote(sender, target, actions, description, f"ipfs:{ipfs_hash}")
     vote_id = tx.events["StartVote"]["voteId"]
 
     print(f"\nSuccess! Vote ID: {vote_id}")
     return vote_id
 
 
-def simulate(target: Dict, actions: List[Tuple], description: str):
-    """Create AragonDAO vote and simulate passing vote on mainnet-fork.
-
-    Args:
-        target (dict): one of either CURVE_DAO_OWNERSHIP, CURVE_DAO_PARAMS or EMERGENCY_DAO
-        actions (list(tuple)): ("target addr", "fn_name", *args)
-        description (str): Description of the on-chain governance proposal
-    """
-    # fetch the top holders so we can pass the vote
+def quorum_holders(target: Dict, margin: float = 5) -> List[str]:
+    """Top holders of the voting token that together exceed the quorum (in % of
+    supply) by `margin`, largest first."""
     data = requests.get(
         f"https://api.ethplorer.io/getTopTokenHolders/{target['token']}",
         params={"apiKey": "freekey", "limit": 100},
@@ -151,25 +148,209 @@ def simulate(target: Dict, actions: List[Tuple], description: str):
 
     assert len(data) > 0
 
-    # create a list of top holders that will be sufficient to make quorum
     holders = []
     weight = 0
-    while weight < target["quorum"] + 5:
+    while weight < target["quorum"] + margin:
         row = data.pop()
         holders.append(to_address(row["address"]))
         weight += row["share"]
 
-    # make the new vote
-    top_holder = holders[0]
-    vote_id = make_vote(top_holder, target, actions, description)
+    return holders
+
 
-    # vote
+def _pass_vote(target: Dict, vote_id: int, holders: List[str]):
+    """Votes yes with every holder, waits out the vote time and executes the vote.
+    Returns the executeVote transaction."""
     aragon = init_contract(target["voting"])
     for acct in holders:
         aragon.vote(vote_id, True, False, {"from": acct})
 
-    # sleep for a week so it has time to pass
-    chain.sleep(86400 * 7)
+    # sleep until the vote has passed
+    chain.sleep(aragon.voteTime() + 1)
+    chain.mine()
 
     # moment of truth - execute the vote!
-    aragon.executeVote(vote_id, {"from": top_holder})
+    return aragon.executeVote(vote_id, {"from": holders[0]})
+
+
+def simulate(target: Dict, actions: List[Tuple], description: str):
+    """Create AragonDAO vote and simulate passing vote on mainnet-fork.
+
+    Args:
+        target (dict): one of either CURVE_DAO_OWNERSHIP, CURVE_DAO_PARAMS or EMERGENCY_DAO
+        actions (list(tuple)): ("target addr", "fn_name", *args)
+        description (str): Description of the on-chain governance proposal
+    """
+    # fetch the top holders so we can pass the vote
+    holders = quorum_holders(target)
+
+    # make the new vote
+    vote_id = make_vote(holders[0], target, actions, description)
+    _pass_vote(target, vote_id, holders)
+
+
+# ------- BATCH SIMULATION --------- #
+
+
+class ProposalResult(NamedTuple):
+    """Outcome of one simulated proposal.
+
+    events are {"name", "address", "args"} dicts of every log emitted while executing
+    the vote; state_diffs maps each watched view call to its (before, after) values
+    for the calls whose value changed.
+    """
+
+    index: int
+    description: str
+    success: bool
+    error: Optional[str]
+    vote_id: Optional[int]
+    gas_used: Optional[int]
+    events: List[Dict]
+    state_diffs: Dict[str, Tuple]
+
+
+def _plain(value):
+    # brownie return types (Wei, EthAddress, ReturnValue, ...) as picklable builtins
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return int(value)
+    if isinstance(value, str):
+        return str(value)
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _plain(v) for k, v in value.items()}
+    return str(value)
+
+
+def _read_watched(watch: List[Tuple]) -> Dict[str, object]:
+    values = {}
+    for address, fn_name, *args in watch:
+        label = f"{address}.{fn_name}({', '.join(map(str, args))})"
+        try:
+            values[label] = _plain(getattr(init_contract(address), fn_name)(*args))
+        except Exception as e:
+            values[label] = f"reverted: {e}"
+    return values
+
+
+def _run_proposal(
+    index: int,
+    target: Dict,
+    actions: List[Tuple],
+    description: str,
+    holders: List[str],
+    watch: List[Tuple],
+) -> ProposalResult:
+    before = _read_watched(watch)
+    vote_id = gas_used = None
+    events = []
+    try:
+        tx = _new_vote(holders[0], target, actions, description, description)
+        vote_id = int(tx.events["StartVote"]["voteId"])
+        tx = _pass_vote(target, vote_id, holders)
+        gas_used = tx.gas_used
+        events = [
+            {"name": event.name, "address": str(event.address), "args": _plain(dict(event))}
+            for event in tx.events
+        ]
+        success, error = tx.status == 1, None
+    except Exception as e:
+        success, error = False, f"{type(e).__name__}: {e}"
+
+    after = _read_watched(watch)
+    diffs = {
+        label: (before[label], after[label])
+        for label in before
+        if before[label] != after[label]
+    }
+    return ProposalResult(index, description, success, error, vote_id, gas_used, events, diffs)
+
+
+def _simulate_in_fork(args) -> List[ProposalResult]:
+    """Worker process entry: connects to its own fork (on its own port) and runs its
+    share of the proposals."""
+    network_name, port, cmd_settings, target, proposals, holders, watch = args
+    from brownie._config import CONFIG
+
+    settings = CONFIG.networks[network_name].setdefault("cmd_settings", {})
+    settings.update(cmd_settings or {})
+    settings["port"] = port
+    network.connect(network_name)
+    try:
+        return simulate_batch(target, proposals, watch=watch, holders=holders)
+    finally:
+        network.disconnect()
+
+
+def simulate_batch(
+    target: Dict,
+    proposals: List[Tuple[List[Tuple], str]],
+    watch: List[Tuple] = None,
+    holders: List[str] = None,
+    n_workers: int = 1,
+    network_name: str = "mainnet-fork",
+    base_port: int = 8545,
+    cmd_settings: Dict = None,
+) -> List[ProposalResult]:
+    """Simulates many candidate votes against the same starting state.
+
+    The quorum holders are fetched once and funded with gas money, then the chain is
+    snapshotted; every proposal is created, voted through and executed from that
+    snapshot and reverted afterwards, so proposals do not see each other's effects.
+    With `n_workers` > 1 the proposals are spread over that many separate fork
+    processes (`network_name` on ports base_port + 1, base_port + 2, ...).
+
+    Args:
+        target (dict): one of either CURVE_DAO_OWNERSHIP, CURVE_DAO_PARAMS or EMERGENCY_DAO
+        proposals (list): (actions, description) per proposal, actions as in `simulate`
+        watch (list(tuple)): view calls ("addr", "fn_name", *args) to diff around each
+            proposal
+        holders (list(str)): voters, defaults to `quorum_holders(target)`
+        n_workers (int): number of fork processes; 1 runs on the active network
+        cmd_settings (dict): extra brownie `cmd_settings` for the worker networks, e.g.
+            {"fork": url} to fork a local chain instead of mainnet
+
+    Returns:
+        list(ProposalResult): one result per proposal, in input order.
+    """
+    watch = watch or []
+    holders = holders or quorum_holders(target)
+
+    if n_workers > 1:
+        chunks = [
+            (
+                network_name,
+                base_port + 1 + worker,
+                cmd_settings,
+                target,
+                proposals[worker::n_workers],
+                holders,
+                watch,
+            )
+            for worker in range(n_workers)
+        ]
+        # brownie is not fork-safe, so every worker starts from a fresh interpreter
+        with ProcessPoolExecutor(n_workers, mp_context=get_context("spawn")) as pool:
+            results = [result for chunk in pool.map(_simulate_in_fork, chunks) for result in chunk]
+        # re-index from the worker-local positions back to the input order
+        order = [i for worker in range(n_workers) for i in range(len(proposals))[worker::n_workers]]
+        results = [result._replace(index=i) for i, result in zip(order, results)]
+        return sorted(results, key=lambda result: result.index)
+
+    # setup shared by every proposal: make sure the voters can pay for gas
+    for holder in holders:
+        if accounts.at(holder, force=True).balance() < 10 ** 18:
+            accounts[0].transfer(holder, 10 ** 18)
+    chain.snapshot()
+
+    results = []
+    for index, (actions, description) in enumerate(proposals):
+        try:
+            results.append(_run_proposal(index, target, actions, description, holders, watch))
+        finally:
+            chain.revert()
+
+    return results
@@ -0,0 +1,231 @@
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List, Sequence, Tuple
+
+from utils.balance_index import BLOCK_BITS, Interner
+
+DELEGATE_REGISTRY = "0x469788fE6E9E9681C6ebF3bF78e7Fd26Fc015446"
+DELEGATE_REGISTRY_START_BLOCK = 11215988
+
+# end block of delegations that are still in place
+OPEN = np.iinfo(np.int64).max
+
+
+def _delegate_event(name: str) -> Dict:
+    return {
+        "name": name,
+        "type": "event",
+        "anonymous": False,
+        "inputs": [
+            {"name": "delegator", "type": "address", "indexed": True},
+            {"name": "id", "type": "bytes32", "indexed": True},
+            {"name": "delegate", "type": "address", "indexed": True},
+        ],
+    }
+
+
+SET_DELEGATE_EVENT = _delegate_event("SetDelegate")
+CLEAR_DELEGATE_EVENT = _delegate_event("ClearDelegate")
+
+
+def space_id(space: str) -> str:
+    """The registry's bytes32 id of a Snapshot space, e.g. "cvx.eth". The empty
+    string is the id of delegations that apply to every space."""
+    return "0x" + space.encode().ljust(32, b"\0").hex()
+
+
+class DelegationIndex:
+    """Delegations of Gnosis' DelegateRegistry (used by Snapshot) over time.
+
+    SetDelegate and ClearDelegate logs are applied in (block, log index) order to
+    the current delegate of each (delegator, space). Every delegation becomes an
+    interval [set block, replaced or cleared block) of integer ids, so the state at
+    any block is kept without storing snapshots. For per-delegate queries the
+    interval starts and ends are sorted by `delegate id << 32 | block` keys: the
+    number of delegations to a delegate at a block is two searchsorted lookups.
+
+    A delegation counts at block B when it is in place at the end of B.
+
+    Args:
+        name (str): LogIndexer dataset the registry's logs are stored in
+        registry (str): DelegateRegistry address
+        start_block (int): the registry's deployment block
+        rpc_url (str): JSON-RPC endpoint, defaults to Alchemy
+    """
+
+    def __init__(
+        self,
+        name: str = "delegate_registry",
+        registry: str = DELEGATE_REGISTRY,
+        start_block: int = DELEGATE_REGISTRY_START_BLOCK,
+        rpc_url: str = None,
+    ):
+        from utils.log_indexer import LogIndexer
+
+        self.indexer = LogIndexer(
+            name, registry, [SET_DELEGATE_EVENT, CLEAR_DELEGATE_EVENT], rpc_url=rpc_url
+        )
+        self.start_block = start_block
+        self.last_block = start_block - 1
+
+        self._addresses = Interner()
+        self._spaces = Interner()
+        # one row per delegation: delegator, space, delegate, start, end
+        self._rows: List[List[int]] = []
+        self._current: Dict[Tuple[int, int], int] = {}
+        self._views: Dict[str, tuple] = {}
+
+    # ------- ingestion --------- #
+
+    def update(self, to_block: int = None) -> int:
+        """Indexes the registry's logs up to `to_block` (default: the last finalised block) and
+        applies the ones after the last processed block.
+
+        Returns:
+            int: the last block applied.
+        """
+        last = self.indexer.update(from_block=self.start_block, to_block=to_block)
+        self.apply(self.indexer.load(self.last_block + 1, last))
+        self.last_block = last
+        return last
+
+    def apply(self, events: pd.DataFrame) -> None:
+        """Applies decoded SetDelegate/ClearDelegate logs (block_number, log_index,
+        event, delegator, id and delegate columns) that follow the ones applied so
+        far."""
+        if not len(events):
+            return
+        events = events.sort_values(["block_number", "log_index"])
+        delegators = self._addresses.ids(events.delegator.values)
+        delegates = self._addresses.ids(events.delegate.values)
+        spaces = self._spaces.ids(events["id"].values)
+        is_set = (events.event == "SetDelegate").values
+
+        for delegator, space, delegate, block, set_ in zip(
+            delegators, spaces, delegates, events.block_number.values, is_set
+        ):
+            key = (int(delegator), int(space))
+            previous = self._current.pop(key, None)
+            if previous is not None:
+                self._rows[previous][4] = int(block)
+            if set_:
+                self._current[key] = len(self._rows)
+                self._rows.append([key[0], key[1], int(delegate), int(block), OPEN])
+        self._views = {}
+
+    # ------- queries --------- #
+
+    def delegations(self, space: str = None) -> pd.DataFrame:
+        """Every delegation with the block it was set and replaced or cleared in
+        (`OPEN` while still in place), optionally of one space (a name or an id)."""
+        rows = np.array(self._rows, dtype=np.int64).reshape(-1, 5)
+        if space is not None:
+            rows = rows[rows[:, 1] == self._space(space)]
+        addresses = np.array(self._addresses.values, dtype=object)
+        spaces = np.array(self._spaces.values, dtype=object)
+        return pd.DataFrame(
+            {
+                "delegator": addresses[rows[:, 0]],
+                "space": spaces[rows[:, 1]],
+                "delegate": addresses[rows[:, 2]],
+                "start_block": rows[:, 3],
+                "end_block": rows[:, 4],
+            }
+        )
+
+    def current(self, space: str = None) -> pd.DataFrame:
+        """The delegations in place after the last applied block."""
+        delegations = self.delegations(space)
+        return delegations[delegations.end_block == OPEN].reset_index(drop=True)
+
+    def _space(self, space: str) -> int:
+        if not space.startswith("0x"):
+            space = space_id(space)
+        space_index = self._spaces.get(space)
+        # spaces nobody delegated in get an id no delegation has
+        return len(self._spaces) if space_index is None else space_index
+
+    def _view(self, space: str = None) -> tuple:
+        """Sorted start and end keys (delegate id << 32 | block) of the delegations of
+        `space`, built once per space until the next update.
+
+        Returns:
+            tuple: (start keys, end keys of the closed delegations, rows, rows in start
+                key order, end keys with open delegations last, rows in that order).
+        """
+        if space not in self._views:
+            rows = np.array(self._rows, dtype=np.int64).reshape(-1, 5)
+            if space is not None:
+                rows = rows[rows[:, 1] == self._space(space)]
+            delegate = rows[:, 2] << BLOCK_BITS
+            by_start = np.argsort(delegate | rows[:, 3], kind="stable")
+            starts = (delegate | rows[:, 3])[by_start]
+            closed = rows[:, 4] != OPEN
+            ends = np.sort(delegate[closed] | rows[closed, 4])
+            end_keys = delegate | np.minimum(rows[:, 4], (1 << BLOCK_BITS) - 1)
+            by_end = np.argsort(end_keys, kind="stable")
+            self._views[space] = (starts, ends, rows, by_start, end_keys[by_end], by_end)
+        return self._views[space]
+
+    def count_at(self, delegates: Sequence[str], blocks: Sequence[int], space: str = None):
+        """Number of delegations to each of `delegates` at each of `blocks`.
+
+        Returns:
+            np.ndarray: (delegates x blocks) counts.
+        """
+        starts, ends = self._view(space)[:2]
+        known = [self._addresses.get(delegate) for delegate in delegates]
+        ids = np.array([-1 if i is None else i for i in known], dtype=np.int64)
+        blocks = np.asarray(blocks, dtype=np.int64)
+
+        # delegations set (ended) up to each block = keys between the delegate's first
+        # possible key and (delegate, block)
+        lower = np.maximum(ids, 0)[:, None] << BLOCK_BITS
+        keys = lower | blocks[None, :]
+        started = np.searchsorted(starts, keys, side="right") - np.searchsorted(starts, lower)
+        ended = np.searchsorted(ends, keys, side="right") - np.searchsorted(ends, lower)
+        return np.where(ids[:, None] >= 0, started - ended, 0)
+
+    def delegations_to(self, delegate: str, block: int, space: str = None) -> pd.DataFrame:
+        """Delegators (and the spaces they delegate in) delegating to `delegate` at the
+        end of `block`, in the order they delegated.
+
+        The delegations set by `block` and the ones still in place after it are each a
+        run of a sorted view; the answer is filtered from the shorter run, so a query
+        costs O(log n) plus the smaller of the two (not the delegate's whole history).
+        """
+        starts, _, rows, by_start, end_keys, by_end = self._view(space)
+        delegate_id = self._addresses.get(delegate)
+        if delegate_id is None:
+            return pd.DataFrame(columns=["delegator", "space", "start_block"])
+        lower, upper = delegate_id << BLOCK_BITS, (delegate_id + 1) << BLOCK_BITS
+        key = lower | int(block)
+        started = by_start[
+            np.searchsorted(starts, lower) : np.searchsorted(starts, key, side="right")
+        ]
+        in_place = by_end[
+            np.searchsorted(end_keys, key, side="right") : np.searchsorted(end_keys, upper)
+        ]
+        if len(started) <= len(in_place):
+            index = started[rows[started, 4] > block]
+        else:
+            index = in_place[rows[in_place, 3] <= block]
+        # rows are appended in the order the delegations were set
+        active = rows[np.sort(index)]
+        addresses, spaces = self._addresses.values, self._spaces.values
+        return pd.DataFrame(
+            {
+                "delegator": [addresses[i] for i in active[:, 0]],
+                "space": [spaces[i] for i in active[:, 1]],
+                "start_block": active[:, 3],
+            }
+        )
+
+    def delegation_counts(self, blocks: Sequence[int], space: str = None) -> pd.DataFrame:
+        """Number of delegations to every delegate at each of `blocks` (blocks x
+        delegates), leaving out delegates that never had any at those blocks."""
+        delegates = sorted(set(self.delegations(space).delegate))
+        counts = self.count_at(delegates, blocks, space)
+        df = pd.DataFrame(counts.T, index=np.asarray(blocks), columns=delegates)
+        return df.loc[:, (df > 0).any(axis=0)]
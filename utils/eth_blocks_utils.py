@@ -1,5 +1,8 @@
+import numpy as np
 import requests
 
+from utils.block_index import get_block_index
+
 
 ETH_BLOCKS_SUBGRAPH = "https://api.thegraph.com/subgraphs/name/blocklytics/ethereum-blocks"
 
@@ -67,6 +70,46 @@ def get_timestamp_for_block(block: int):
         return None
 
 
+def get_blocks_for_timestamps(timestamps, source: str = "rpc", sync: bool = False) -> np.ndarray:
+    """Vectorised `get_block_for_timestamp`: first block after each timestamp.
+
+    Timestamps within the synced part of the local block index are looked up in it.
+    Later ones are found by bisecting over `eth_getBlockByNumber` (a few dozen
+    requests per timestamp, the fetched blocks are kept in the index) unless `sync`,
+    which first syncs the whole index to head from `source` - from genesis on a
+    fresh cache, i.e. millions of requests.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    index = get_block_index()
+    if sync:
+        index.sync(source=source)
+    if timestamps.size and (
+        index.synced_to < 0 or timestamps.max() >= index.timestamp_of(index.synced_to)
+    ):
+        return index.find_blocks_after(timestamps)
+    return index.block_after(timestamps)
+
+
+def get_timestamps_for_blocks(blocks, source: str = "rpc", sync: bool = False) -> np.ndarray:
+    """Timestamps of each block, served from the local block index.
+
+    Blocks the index does not have yet are fetched on their own (batched
+    `eth_getBlockByNumber`) and added to it, unless `sync`, which syncs every block
+    up to the last one from `source` first (see `get_blocks_for_timestamps`).
+
+    Note that unlike `get_timestamp_for_block` (which returns the timestamp of the
+    block after `block`), this returns the timestamp of the block itself.
+    """
+    blocks = np.asarray(blocks, dtype=np.int64)
+    if not blocks.size:
+        return blocks
+    index = get_block_index()
+    if sync and blocks.max() > index.synced_to:
+        index.sync(to_block=int(blocks.max()), source=source)
+    index.fetch(blocks)
+    return index.timestamp_of(blocks)
+
+
 if __name__ == "__main__":
     block_for_timestamp = get_block_for_timestamp(timestamp=1577836800)
     print(block_for_timestamp)
@@ -1,12 +1,30 @@
+import glob
+import json
 import os
 import re
-from typing import List
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import requests
 from etherscan.accounts import Account
 from etherscan.client import Client
 from etherscan.client import EmptyResponse
 from web3 import Web3
 
+from utils.rpc_cache import CACHE_DIR, DEFAULT_FINALITY_DEPTH
+
+ETHERSCAN_API = "https://api.etherscan.io/api"
+ETHERSCAN_CACHE_DIR = os.path.join(CACHE_DIR, "etherscan")
+# etherscan only serves the first 10,000 results of a query (page * offset <= 10000)
+RESULT_WINDOW = 10_000
+# free tier API budget
+REQUESTS_PER_SECOND = 5
+# block range of the initial (pre-bisection) requests
+WINDOW_BLOCKS = 500_000
+
 
 class TransactionScraper(Account):
     def __init__(self, address=Client.dao_address, api_key="YourApiKey"):
@@ -83,26 +101,238 @@ class TransactionScraper(Account):
                 return trans_list
 
 
+class EtherscanError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Spaces out calls from any number of threads to at most `rate` per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        time.sleep(max(slot - now, 0))
+
+
+class EtherscanTxFetcher:
+    """Fetches an address' transaction lists (txlist, txlistinternal, tokentx, ...)
+    from Etherscan without paging.
+
+    Each request asks for a whole block range; ranges that fill Etherscan's 10,000
+    result window are bisected and refetched, so busy addresses are never truncated.
+    Ranges are requested concurrently by a thread pool sharing one rate limit, and
+    ranges older than `finality_depth` blocks are cached on disk, so a rerun only
+    fetches the blocks added since.
+
+    Args:
+        api_key (str): Etherscan API key, defaults to $ETHERSCAN_TOKEN
+        requests_per_second (float): API budget shared by all workers
+        max_workers (int): concurrent requests
+        path (str): cache directory
+        finality_depth (int): blocks behind the head before a range is cached
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        requests_per_second: float = REQUESTS_PER_SECOND,
+        max_workers: int = 5,
+        max_retries: int = 5,
+        path: str = ETHERSCAN_CACHE_DIR,
+        finality_depth: int = DEFAULT_FINALITY_DEPTH,
+        window_blocks: int = WINDOW_BLOCKS,
+    ):
+        self.api_key = api_key or os.environ["ETHERSCAN_TOKEN"]
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.path = path
+        self.finality_depth = finality_depth
+        self.window_blocks = window_blocks
+        self.requests_sent = 0
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _get(self, params: Dict):
+        error = None
+        for attempt in range(self.max_retries):
+            self.rate_limiter.wait()
+            try:
+                self.requests_sent += 1
+                r = self.session.get(ETHERSCAN_API, params={**params, "apikey": self.api_key})
+                r.raise_for_status()
+                payload = r.json()
+            except (requests.RequestException, ValueError) as e:
+                error = e
+            else:
+                result = payload.get("result")
+                if payload.get("status") == "1" or "jsonrpc" in payload:
+                    return result
+                if "No transactions found" in payload.get("message", "") or result == []:
+                    return []
+                # "Max rate limit reached" and friends come back as status 0
+                error = result or payload.get("message")
+            time.sleep(min(2 ** attempt, 30))
+
+        raise EtherscanError(f"{params} failed after {self.max_retries} attempts: {error}")
+
+    def latest_block(self) -> int:
+        return int(self._get({"module": "proxy", "action": "eth_blockNumber"}), 16)
+
+    # ------- cache --------- #
+
+    def _cache_dir(self, action: str, address: str) -> str:
+        return os.path.join(self.path, action, address.lower())
+
+    def _cached_ranges(self, action: str, address: str) -> List[Tuple[int, int, str]]:
+        ranges = []
+        for filename in glob.glob(os.path.join(self._cache_dir(action, address), "*.json")):
+            lo, hi = map(int, os.path.basename(filename)[:-5].split("_"))
+            ranges.append((lo, hi, filename))
+        return sorted(ranges)
+
+    def _store(self, action: str, address: str, lo: int, hi: int, txes: List[Dict]) -> None:
+        directory = self._cache_dir(action, address)
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(directory, f"{lo:010d}_{hi:010d}.json")
+        with open(filename + ".tmp", "w") as f:
+            json.dump(txes, f)
+        os.replace(filename + ".tmp", filename)
+
+    def _plan(
+        self, action: str, address: str, start: int, end: int
+    ) -> List[Tuple[int, int, Optional[str]]]:
+        """Splits [start, end] into cached ranges (with their file) and gaps to fetch
+        (file None), in block order."""
+        plan = []
+        position = start
+        for lo, hi, filename in self._cached_ranges(action, address):
+            if hi < position or lo > end:
+                continue
+            if lo > position:
+                plan.extend(self._windows(position, lo - 1))
+            plan.append((max(lo, position), min(hi, end), filename))
+            position = hi + 1
+            if position > end:
+                break
+        if position <= end:
+            plan.extend(self._windows(position, end))
+        return plan
+
+    def _windows(self, lo: int, hi: int) -> List[Tuple[int, int, None]]:
+        return [
+            (w, min(w + self.window_blocks - 1, hi), None)
+            for w in range(lo, hi + 1, self.window_blocks)
+        ]
+
+    # ------- fetching --------- #
+
+    def _fetch(self, action: str, address: str, lo: int, hi: int) -> List[Dict]:
+        return self._get(
+            {
+                "module": "account",
+                "action": action,
+                "address": address,
+                "startblock": lo,
+                "endblock": hi,
+                "page": 1,
+                "offset": RESULT_WINDOW,
+                "sort": "asc",
+            }
+        )
+
+    def iter_txes(
+        self,
+        address: str,
+        start_block: int = 0,
+        end_block: int = None,
+        action: str = "txlist",
+    ) -> Iterator[Dict]:
+        """Yields the transactions of `address` in [start_block, end_block] in block
+        order as soon as every range before them has arrived.
+
+        Args:
+            address (str): account or contract address
+            start_block (int): first block (inclusive)
+            end_block (int): last block (inclusive), defaults to the chain head
+            action (str): Etherscan account action: txlist, txlistinternal, tokentx, ...
+        """
+        head = self.latest_block()
+        end_block = head if end_block is None or end_block < 0 else end_block
+        final_block = head - self.finality_depth
+
+        pending = deque(self._plan(action, address, start_block, end_block))
+        futures = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            def submit_ahead():
+                # keep the next few uncached ranges in flight, in block order
+                for lo, hi, filename in list(pending)[: self.max_workers * 2]:
+                    if filename is None and (lo, hi) not in futures:
+                        futures[(lo, hi)] = executor.submit(self._fetch, action, address, lo, hi)
+
+            while pending:
+                submit_ahead()
+                lo, hi, filename = pending.popleft()
+
+                if filename is not None:
+                    with open(filename) as f:
+                        txes = json.load(f)
+                    yield from (tx for tx in txes if lo <= int(tx["blockNumber"]) <= hi)
+                    continue
+
+                txes = futures.pop((lo, hi)).result()
+                if len(txes) >= RESULT_WINDOW:
+                    if lo == hi:
+                        raise EtherscanError(
+                            f"block {lo} has more than {RESULT_WINDOW} {action} results"
+                        )
+                    mid = (lo + hi) // 2
+                    pending.appendleft((mid + 1, hi, None))
+                    pending.appendleft((lo, mid, None))
+                    continue
+
+                if hi <= final_block:
+                    self._store(action, address, lo, hi, txes)
+                elif lo <= final_block:
+                    # cache the final part so reruns only refetch the recent blocks
+                    final = [tx for tx in txes if int(tx["blockNumber"]) <= final_block]
+                    self._store(action, address, lo, final_block, final)
+                yield from txes
+
+    def get_txes(
+        self,
+        address: str,
+        start_block: int = 0,
+        end_block: int = None,
+        action: str = "txlist",
+    ) -> List[Dict]:
+        return list(self.iter_txes(address, start_block, end_block, action))
+
+
 def get_all_txes(
     address: str,
 ) -> List:
 
-    tx_scraper = TransactionScraper(
-        address=address, api_key=os.environ["ETHERSCAN_TOKEN"]
-    )
-    txes = tx_scraper.get_tx()
-
-    return txes
+    return EtherscanTxFetcher().get_txes(address)
 
 
 def get_txes_between_blocks(address: str, from_block: int, to_block: int):
 
-    tx_scraper = TransactionScraper(
-        address=address, api_key=os.environ["ETHERSCAN_TOKEN"]
-    )
-    txes = tx_scraper.get_tx(start_block=from_block, end_block=to_block)
-
-    return txes
+    return EtherscanTxFetcher().get_txes(address, from_block, to_block)
 
 
 def get_txes_with_addr_between_blocks(
@@ -112,20 +342,12 @@ def get_txes_with_addr_between_blocks(
         to_block: int
 ):
 
+    # etherscan returns lowercase addresses; compare once, case-insensitively
+    address_with = address_with.lower()
     txes = get_txes_between_blocks(address, from_block, to_block)
     relevant_txes = []
     for tx in txes:
-        if tx["from"] in [
-            address_with,
-            address_with.lower(),
-            Web3.toChecksumAddress(address_with),
-        ]:
-            relevant_txes.append(tx)
-        if tx["to"] in [
-            address_with,
-            address_with.lower(),
-            Web3.toChecksumAddress(address_with),
-        ]:
+        if tx["from"].lower() == address_with or (tx["to"] or "").lower() == address_with:
             relevant_txes.append(tx)
 
     return relevant_txes
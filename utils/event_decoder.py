@@ -0,0 +1,286 @@
+import json
+import re
+
+import numpy as np
+import pandas as pd
+from eth_abi import decode_abi
+from web3 import Web3
+
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+WORD = 32
+STATIC_ARRAY = re.compile(r"^(.*)\[(\d+)\]$")
+
+# {"tokens_sold": 18} scales a column by a fixed number of decimals,
+# {"tokens_sold": ("sold_id", [18, 6, 6])} picks the decimals by coin index
+DecimalsSpec = Dict[str, Union[int, Sequence[int], Tuple[str, Sequence[int]]]]
+
+
+def event_signature(event_abi: Dict) -> str:
+    types = ",".join(_canonical_type(i) for i in event_abi["inputs"])
+    return f"{event_abi['name']}({types})"
+
+
+def _canonical_type(abi_input: Dict) -> str:
+    if abi_input["type"].startswith("tuple"):
+        inner = ",".join(_canonical_type(c) for c in abi_input["components"])
+        return f"({inner}){abi_input['type'][5:]}"
+    return abi_input["type"]
+
+
+def event_topic(event_abi: Dict) -> str:
+    return Web3.toHex(Web3.keccak(text=event_signature(event_abi)))
+
+
+def load_event_abis(abi: Union[str, List[Dict]], names: List[str] = None) -> List[Dict]:
+    """Event entries of a contract ABI (a list or a path to an ABI json file, like
+    the ones stored next to the notebooks), optionally filtered by name."""
+    if isinstance(abi, str):
+        with open(abi) as f:
+            abi = json.load(f)
+    events = [item for item in abi if item.get("type") == "event"]
+    if names is not None:
+        events = [item for item in events if item["name"] in names]
+    return events
+
+
+def _static_layout(abi_type: str) -> Optional[Tuple[str, int]]:
+    """(elementary type, number of words) for static types we can decode by slicing
+    words, or None for dynamic / tuple types."""
+    match = STATIC_ARRAY.match(abi_type)
+    if match:
+        inner = _static_layout(match.group(1))
+        if inner is None:
+            return None
+        return inner[0], inner[1] * int(match.group(2))
+    if abi_type in ("string", "bytes") or abi_type.endswith("[]") or abi_type.startswith("("):
+        return None
+    return abi_type, 1
+
+
+def _head_size(abi_input: Dict) -> Optional[int]:
+    """Number of words a static argument (tuples and static arrays of them included)
+    takes in the ABI head, or None if it is dynamic and the head only holds its
+    offset."""
+    abi_type = abi_input["type"]
+    match = STATIC_ARRAY.match(abi_type)
+    if match:
+        inner = _head_size({**abi_input, "type": match.group(1)})
+        return None if inner is None else inner * int(match.group(2))
+    if abi_type == "tuple":
+        sizes = [_head_size(component) for component in abi_input["components"]]
+        return None if None in sizes else sum(sizes)
+    if abi_type in ("string", "bytes") or abi_type.endswith("[]"):
+        return None
+    return 1
+
+
+def _word_matrix(hex_strings: Sequence[str], n_words: int) -> np.ndarray:
+    """Packs the first `n_words` 32-byte words of each hex string into an
+    (n, n_words, 32) uint8 array."""
+    chars = n_words * WORD * 2
+    buffer = bytes.fromhex("".join(h[2 : 2 + chars] for h in hex_strings))
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(len(hex_strings), n_words, WORD)
+
+
+def _limbs(words: np.ndarray) -> np.ndarray:
+    """(n, 32) uint8 words -> (n, 4) native uint64 limbs, most significant first."""
+    return np.ascontiguousarray(words).view(">u8").astype(np.uint64)
+
+
+def _limbs_to_float(limbs: np.ndarray) -> np.ndarray:
+    value = limbs[:, 0].astype(np.float64)
+    for i in range(1, 4):
+        value = value * 2.0 ** 64 + limbs[:, i].astype(np.float64)
+    return value
+
+
+def decode_uint_words(words: np.ndarray, bits: int = 256, exact: bool = False) -> np.ndarray:
+    """Decodes uintN words. Values up to 64 bits (or columns where every value happens
+    to fit) come back as uint64; wider values as float64, or python ints in an object
+    array if `exact`."""
+    limbs = _limbs(words)
+    if bits <= 64 or not limbs[:, :3].any():
+        return limbs[:, 3]
+    if exact:
+        return np.array([int.from_bytes(w.tobytes(), "big") for w in words], dtype=object)
+    return _limbs_to_float(limbs)
+
+
+def decode_int_words(words: np.ndarray, bits: int = 256, exact: bool = False) -> np.ndarray:
+    """Decodes two's complement intN words, see `decode_uint_words`."""
+    limbs = _limbs(words)
+    negative = words[:, 0] >= 0x80
+    high = limbs[:, :3]
+    fits_int64 = np.where(
+        negative,
+        (high == np.uint64(2 ** 64 - 1)).all(axis=1) & (limbs[:, 3] >= np.uint64(2 ** 63)),
+        (high == 0).all(axis=1) & (limbs[:, 3] < np.uint64(2 ** 63)),
+    )
+    if bits <= 64 or fits_int64.all():
+        return limbs[:, 3].view(np.int64)
+    if exact:
+        return np.array(
+            [int.from_bytes(w.tobytes(), "big", signed=True) for w in words], dtype=object
+        )
+    magnitude = _limbs_to_float(np.where(negative[:, None], ~limbs, limbs))
+    return np.where(negative, -(magnitude + 1), magnitude)
+
+
+def decode_words(words: np.ndarray, abi_type: str, exact: bool = False) -> np.ndarray:
+    """Decodes an (n, 32) array of words of one elementary ABI type."""
+    if abi_type == "address":
+        # S dtypes strip trailing null bytes, so pad them back
+        raw = np.ascontiguousarray(words[:, 12:]).view("S20").ravel()
+        return np.array(["0x" + value.ljust(20, b"\0").hex() for value in raw], dtype=object)
+    if abi_type == "bool":
+        return words[:, -1] != 0
+    if abi_type.startswith("uint"):
+        return decode_uint_words(words, int(abi_type[4:] or 256), exact)
+    if abi_type.startswith("int"):
+        return decode_int_words(words, int(abi_type[3:] or 256), exact)
+    if abi_type.startswith("bytes"):
+        size = int(abi_type[5:])
+        raw = np.ascontiguousarray(words[:, :size]).view(f"S{size}").ravel()
+        return np.array(["0x" + value.ljust(size, b"\0").hex() for value in raw], dtype=object)
+    raise ValueError(f"Cannot vectorise ABI type: {abi_type}")
+
+
+def _scale(values: np.ndarray, decimals: np.ndarray) -> np.ndarray:
+    if values.dtype == object:
+        return np.array([int(v) / 10 ** int(d) for v, d in zip(values, decimals)])
+    return values.astype(np.float64) / 10.0 ** decimals
+
+
+def apply_decimals(df: pd.DataFrame, decimals: DecimalsSpec) -> None:
+    """Converts raw integer columns of `df` to token units in place, see `DecimalsSpec`.
+    A column name also matches its static array elements (`fees` -> `fees_0`, ...)."""
+    for column, spec in decimals.items():
+        targets = [c for c in df.columns if c == column or re.fullmatch(f"{column}_\\d+", c)]
+        for target in targets:
+            if isinstance(spec, tuple) and isinstance(spec[0], str):
+                # decimals picked per row by a coin index column
+                index_column, coin_decimals = spec
+                per_row = np.asarray(coin_decimals)[df[index_column].values.astype(np.int64)]
+            elif isinstance(spec, (list, tuple, np.ndarray)):
+                # one decimals value per element of a static array, e.g. token_amounts_0..2
+                per_row = np.full(len(df), spec[int(target.rsplit("_", 1)[1])])
+            else:
+                per_row = np.full(len(df), spec)
+            df[target] = _scale(df[target].values, per_row)
+
+
+def integer_columns(event_abi: Dict) -> Dict[str, str]:
+    """ABI type of every integer column `decode_events` produces for an event, e.g.
+    {"sold_id": "int128", "tokens_sold": "uint256", "fees_0": "uint256", ...}."""
+    columns = {}
+    for abi_input in event_abi["inputs"]:
+        name = abi_input["name"]
+        if abi_input.get("indexed"):
+            layout = _static_layout(abi_input["type"])
+            # dynamic and array values are only stored as their hash
+            if layout is None or layout[1] > 1:
+                continue
+        else:
+            layout = _static_layout(_canonical_type(abi_input))
+            if layout is None:
+                continue
+        elementary, n_words = layout
+        if not re.fullmatch(r"u?int\d*", elementary):
+            continue
+        names = [name] if n_words == 1 else [f"{name}_{k}" for k in range(n_words)]
+        columns.update((column, elementary) for column in names)
+    return columns
+
+
+def decode_events(
+    logs: Union[List[Dict], pd.DataFrame],
+    event_abi: Dict,
+    decimals: DecimalsSpec = None,
+    exact: bool = False,
+) -> pd.DataFrame:
+    """Decodes every log of one event type into columns in a single vectorised pass.
+
+    Static topics and data words are sliced out of one packed byte array instead of
+    being decoded log by log; only dynamic fields (strings, bytes, dynamic arrays)
+    and tuples fall back to eth_abi. Static arrays such as `uint256[3] token_amounts` are
+    expanded into `token_amounts_0`, `token_amounts_1`, ...
+
+    Args:
+        logs: raw logs as returned by eth_getLogs (list of dicts or a DataFrame with
+            `topics` and `data` columns). Logs of other events are ignored.
+        event_abi (dict): the event's ABI entry, e.g. from `load_event_abis`
+        decimals (dict): columns to convert to token units, see `DecimalsSpec`
+        exact (bool): decode integers wider than 64 bits as python ints instead of
+            float64 (only where values do not fit in 64 bits anyway)
+
+    Returns:
+        pd.DataFrame: block_number, log_index, transaction_hash, address and one
+            column per event arg, sorted by (block_number, log_index).
+    """
+    if isinstance(logs, pd.DataFrame):
+        logs = logs.to_dict("records")
+    topic = event_topic(event_abi)
+    logs = [log for log in logs if log["topics"] and log["topics"][0] == topic]
+    if not logs:
+        names = [i["name"] for i in event_abi["inputs"]]
+        return pd.DataFrame(
+            columns=["block_number", "log_index", "transaction_hash", "address"] + names
+        )
+
+    columns = {
+        "block_number": np.array([int(log["blockNumber"], 16) for log in logs]),
+        "log_index": np.array([int(log["logIndex"], 16) for log in logs]),
+        "transaction_hash": [log["transactionHash"] for log in logs],
+        "address": [log["address"].lower() for log in logs],
+    }
+
+    indexed = [i for i in event_abi["inputs"] if i.get("indexed")]
+    non_indexed = [i for i in event_abi["inputs"] if not i.get("indexed")]
+
+    if indexed:
+        topic_words = _word_matrix(
+            ["0x" + "".join(t[2:] for t in log["topics"][1:]) for log in logs], len(indexed)
+        )
+        for i, abi_input in enumerate(indexed):
+            layout = _static_layout(abi_input["type"])
+            if layout is None:
+                # dynamic indexed values are only stored as their hash
+                columns[abi_input["name"]] = decode_words(topic_words[:, i], "bytes32")
+            else:
+                columns[abi_input["name"]] = decode_words(topic_words[:, i], layout[0], exact)
+
+    layouts = [_static_layout(_canonical_type(i)) for i in non_indexed]
+    sizes = [_head_size(i) for i in non_indexed]
+    head_words = sum(1 if size is None else size for size in sizes)
+    if head_words:
+        data_words = _word_matrix([log["data"] for log in logs], head_words)
+    position = 0
+    for abi_input, layout, size in zip(non_indexed, layouts, sizes):
+        name = abi_input["name"]
+        if layout is None:
+            # decoded by eth_abi below; static tuples fill their whole size in the head
+            position += 1 if size is None else size
+            continue
+        elementary, n_words = layout
+        if n_words == 1:
+            columns[name] = decode_words(data_words[:, position], elementary, exact)
+        else:
+            for k in range(n_words):
+                columns[f"{name}_{k}"] = decode_words(
+                    data_words[:, position + k], elementary, exact
+                )
+        position += n_words
+
+    dynamic = [i for i, layout in zip(non_indexed, layouts) if layout is None]
+    if dynamic:
+        types = [_canonical_type(i) for i in non_indexed]
+        decoded = [decode_abi(types, bytes.fromhex(log["data"][2:])) for log in logs]
+        for abi_input in dynamic:
+            idx = non_indexed.index(abi_input)
+            columns[abi_input["name"]] = [values[idx] for values in decoded]
+
+    df = pd.DataFrame(columns)
+    if decimals:
+        apply_decimals(df, decimals)
+    return df.sort_values(["block_number", "log_index"]).reset_index(drop=True)
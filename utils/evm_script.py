@@ -0,0 +1,361 @@
+import glob
+import json
+import os
+import re
+
+import pandas as pd
+from eth_abi import decode_abi, encode_abi
+from web3 import Web3
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# Aragon call script spec id: scripts are 0x00000001 followed by
+# (20 byte target, 4 byte calldata length, calldata) entries
+CALLSCRIPT_ID = bytes.fromhex("00000001")
+
+AGENT_EXECUTE = "execute(address,uint256,bytes)"
+VOTING_NEW_VOTE = "newVote(bytes,string,bool,bool)"
+FORWARD = "forward(bytes)"
+GET_VOTE = "getVote(uint256)"
+VOTES_LENGTH = "votesLength()"
+# open, executed, startDate, snapshotBlock, supportRequired, minAcceptQuorum, yea, nay,
+# votingPower, script
+GET_VOTE_OUTPUTS = [
+    "bool", "bool", "uint64", "uint64", "uint64", "uint64", "uint256", "uint256", "uint256", "bytes"
+]
+
+SIGNATURE = re.compile(r"^(\w+)\((.*)\)$")
+
+# script of a proposal, as decoded by `decode_vote_script` (one row per call)
+ScriptRow = Dict[str, object]
+
+
+class EVMScriptError(Exception):
+    pass
+
+
+# ------- SIGNATURES --------- #
+
+
+def _split_types(types: str) -> List[str]:
+    """Splits a comma separated type list at the top level, keeping tuples intact."""
+    parts, depth, current = [], 0, ""
+    for char in types:
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        depth += char == "("
+        depth -= char == ")"
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def parse_signature(signature: str) -> Tuple[str, List[str]]:
+    """'set_killed(address,bool)' -> ('set_killed', ['address', 'bool'])"""
+    match = SIGNATURE.match(signature.replace(" ", ""))
+    if match is None:
+        raise EVMScriptError(f"not a function signature: {signature}")
+    return match.group(1), _split_types(match.group(2))
+
+
+def function_signature(fn_abi: Dict) -> str:
+    from utils.event_decoder import _canonical_type
+
+    types = ",".join(_canonical_type(i) for i in fn_abi["inputs"])
+    return f"{fn_abi['name']}({types})"
+
+
+def function_selector(signature: str) -> bytes:
+    return bytes(Web3.keccak(text=signature.replace(" ", "")))[:4]
+
+
+class SelectorRegistry:
+    """Maps 4 byte selectors to function signatures, so calldata can be decoded
+    without knowing (or fetching) the ABI of the contract it was sent to.
+
+    Seeded with the Aragon functions used by the DAO; add ABIs (lists or paths to
+    ABI json files), whole ABI directories or bare signatures as needed.
+    """
+
+    def __init__(self, signatures: Iterable[str] = ()):
+        self.signatures: Dict[bytes, str] = {}
+        for signature in (AGENT_EXECUTE, VOTING_NEW_VOTE, FORWARD, *signatures):
+            self.add_signature(signature)
+
+    def add_signature(self, signature: str) -> bytes:
+        name, types = parse_signature(signature)
+        signature = f"{name}({','.join(types)})"
+        selector = function_selector(signature)
+        self.signatures[selector] = signature
+        return selector
+
+    def add_abi(self, abi: Union[str, List[Dict]]) -> None:
+        if isinstance(abi, str):
+            with open(abi) as f:
+                abi = json.load(f)
+        if isinstance(abi, dict):
+            # ABI store entries wrap the ABI with the contract name
+            abi = abi["abi"]
+        for item in abi:
+            if item.get("type", "function") == "function" and "name" in item:
+                self.add_signature(function_signature(item))
+
+    def add_abi_dir(self, path: str) -> None:
+        """Adds every *.json ABI below `path` (the repo ABIs, the ABI store, ...)."""
+        for filename in glob.glob(os.path.join(path, "**", "*.json"), recursive=True):
+            try:
+                self.add_abi(filename)
+            except (ValueError, KeyError, TypeError, AttributeError):
+                # not an ABI file
+                continue
+
+    def lookup(self, selector: bytes) -> Optional[str]:
+        return self.signatures.get(bytes(selector))
+
+
+_registry = None
+
+
+def get_selector_registry() -> SelectorRegistry:
+    """Process-wide registry seeded with the repo's ABIs and the local ABI store."""
+    global _registry
+    if _registry is None:
+        from utils.abi_store import ABI_STORE_DIR, REPO_ABI_DIR
+
+        _registry = SelectorRegistry()
+        _registry.add_abi_dir(REPO_ABI_DIR)
+        _registry.add_abi_dir(ABI_STORE_DIR)
+    return _registry
+
+
+# ------- ENCODING --------- #
+
+
+def encode_call(signature: str, args: Sequence) -> bytes:
+    """Calldata for `signature` (e.g. 'set_killed(address,bool)') called with `args`."""
+    _, types = parse_signature(signature)
+    if len(types) != len(args):
+        raise EVMScriptError(f"{signature} takes {len(types)} arguments, got {len(args)}")
+    return function_selector(signature) + encode_abi(types, list(args))
+
+
+def resolve_signature(address: str, fn_name: str, n_args: int, abi: List[Dict] = None) -> str:
+    """Signature of `fn_name` on `address` from `abi` or the local ABI store, without
+    touching the network. A full signature ('fn(address,bool)') is returned as is."""
+    if "(" in fn_name:
+        return fn_name
+
+    if abi is None:
+        from utils.abi_store import get_abi_store
+
+        entry = get_abi_store().get(1, address)
+        if entry is None:
+            raise EVMScriptError(
+                f"no stored ABI for {address}: pass a full signature such as "
+                f"'{fn_name}(address,bool)' or add the ABI to the ABI store"
+            )
+        abi = entry["abi"]
+
+    candidates = [
+        item for item in abi
+        if item.get("type", "function") == "function"
+        and item.get("name") == fn_name
+        and len(item["inputs"]) == n_args
+    ]
+    if len(candidates) != 1:
+        raise EVMScriptError(
+            f"{len(candidates)} functions {fn_name} with {n_args} inputs on {address}"
+        )
+    return function_signature(candidates[0])
+
+
+def encode_call_script(calls: Iterable[Tuple[str, bytes]]) -> str:
+    """Aragon call script running each (target, calldata) in order."""
+    parts = [CALLSCRIPT_ID]
+    for target, calldata in calls:
+        parts.append(bytes.fromhex(target[2:]))
+        parts.append(len(calldata).to_bytes(4, "big"))
+        parts.append(calldata)
+    return "0x" + b"".join(parts).hex()
+
+
+def encode_agent_script(
+    agent: str, actions: List[Tuple], abis: Dict[str, List[Dict]] = None
+) -> str:
+    """Call script executing every (target, fn_name, *args) action through the DAO's
+    agent (agent.execute(target, 0, calldata)).
+
+    `fn_name` is either a name looked up in `abis` ({address: abi}) or the ABI
+    store, or a full signature such as 'set_killed(address,bool)'.
+    """
+    abis = {k.lower(): v for k, v in (abis or {}).items()}
+    calls = []
+    for target, fn_name, *args in actions:
+        signature = resolve_signature(target, fn_name, len(args), abis.get(target.lower()))
+        calldata = encode_call(signature, args)
+        calls.append((agent, encode_call(AGENT_EXECUTE, [target, 0, calldata])))
+    return encode_call_script(calls)
+
+
+def encode_forwarded_vote(voting: str, evm_script: str, metadata: str) -> str:
+    """Wraps `evm_script` in a call script creating a vote with it, as required by
+    DAOs (the emergency DAO) whose votes can only be created through a forwarder."""
+    script = bytes.fromhex(evm_script[2:])
+    calldata = encode_call(VOTING_NEW_VOTE, [script, metadata, False, False])
+    return encode_call_script([(voting, calldata)])
+
+
+def prepare_evm_script(
+    target: Dict, actions: List[Tuple], abis: Dict[str, List[Dict]] = None
+) -> str:
+    """Offline version of curve_dao_utils.prepare_evm_script: the call script for
+    `actions` run by the agent of `target` (CURVE_DAO_OWNERSHIP, ...)."""
+    return encode_agent_script(Web3.toChecksumAddress(target["agent"]), actions, abis)
+
+
+# ------- DECODING --------- #
+
+
+def decode_call_script(evm_script: Union[str, bytes]) -> List[Tuple[str, bytes]]:
+    """(target, calldata) of every call in an Aragon call script."""
+    if isinstance(evm_script, str):
+        evm_script = bytes.fromhex(evm_script[2:] if evm_script.startswith("0x") else evm_script)
+    if evm_script[:4] != CALLSCRIPT_ID:
+        raise EVMScriptError(f"unknown script spec id 0x{evm_script[:4].hex()}")
+
+    calls = []
+    position = 4
+    while position < len(evm_script):
+        if position + 24 > len(evm_script):
+            raise EVMScriptError(f"truncated call script at byte {position}")
+        target = Web3.toChecksumAddress("0x" + evm_script[position : position + 20].hex())
+        length = int.from_bytes(evm_script[position + 20 : position + 24], "big")
+        position += 24
+        calldata = evm_script[position : position + length]
+        if len(calldata) != length:
+            raise EVMScriptError(f"truncated calldata for {target} at byte {position}")
+        calls.append((target, calldata))
+        position += length
+    return calls
+
+
+def decode_calldata(
+    calldata: bytes, registry: SelectorRegistry = None
+) -> Tuple[Optional[str], Optional[list]]:
+    """(signature, args) of calldata, or (None, None) when the selector is unknown or
+    the arguments don't decode."""
+    registry = registry or get_selector_registry()
+    signature = registry.lookup(calldata[:4])
+    if signature is None:
+        return None, None
+    _, types = parse_signature(signature)
+    try:
+        return signature, list(decode_abi(types, calldata[4:]))
+    except Exception:
+        return None, None
+
+
+def decode_vote_script(
+    evm_script: Union[str, bytes],
+    registry: SelectorRegistry = None,
+    _depth: int = 0,
+    _via: str = None,
+) -> List[ScriptRow]:
+    """Flattens a vote script into one row per call: agent.execute calls are unwrapped
+    into the call the agent makes, and forwarded newVote / forward scripts are decoded
+    recursively (depth counts the wrapping levels)."""
+    registry = registry or get_selector_registry()
+    rows = []
+    for position, (target, calldata) in enumerate(decode_call_script(evm_script)):
+        signature, args = decode_calldata(calldata, registry)
+
+        if signature in (VOTING_NEW_VOTE, FORWARD):
+            rows.extend(decode_vote_script(args[0], registry, _depth + 1, target))
+            continue
+
+        via, value = _via, 0
+        if signature == AGENT_EXECUTE:
+            via, (target, value, calldata) = target, args
+            target = Web3.toChecksumAddress(target)
+            signature, args = decode_calldata(calldata, registry)
+
+        rows.append(
+            {
+                "depth": _depth,
+                "position": position,
+                "via": via,
+                "target": target,
+                "value": value,
+                "selector": "0x" + calldata[:4].hex(),
+                "signature": signature,
+                "function": signature.split("(")[0] if signature else None,
+                "args": args,
+                "calldata": "0x" + calldata.hex(),
+            }
+        )
+    return rows
+
+
+def decode_vote_scripts(
+    scripts: Dict[int, Union[str, bytes]], registry: SelectorRegistry = None
+) -> pd.DataFrame:
+    """One row per call of every proposal in `scripts` ({vote_id: script}). Scripts
+    that fail to decode get a single row carrying the error."""
+    registry = registry or get_selector_registry()
+    rows = []
+    for vote_id, evm_script in scripts.items():
+        try:
+            decoded = decode_vote_script(evm_script, registry)
+        except (EVMScriptError, ValueError, IndexError) as e:
+            rows.append({"vote_id": vote_id, "error": str(e)})
+            continue
+        rows.extend({"vote_id": vote_id, "error": None, **row} for row in decoded)
+
+    columns = [
+        "vote_id", "depth", "position", "via", "target", "value",
+        "selector", "signature", "function", "args", "calldata", "error",
+    ]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def fetch_vote_scripts(
+    voting: str,
+    vote_ids: Iterable[int] = None,
+    rpc_url: str = None,
+    block: Union[int, str] = "latest",
+    batch_size: int = 50,
+) -> Dict[int, bytes]:
+    """Scripts of many votes (all of them by default) of an Aragon voting app, read
+    with batched getVote eth_calls (a vote's script never changes once it is created)."""
+    from utils.async_utils import AsyncRPCClient, run_coroutine
+    from utils.network_utils import get_alchemy_rpc
+
+    selector = "0x" + function_selector(GET_VOTE).hex()
+    block = block if isinstance(block, str) else hex(block)
+
+    async def fetch():
+        scripts = {}
+        async with AsyncRPCClient(rpc_url or get_alchemy_rpc()) as client:
+            ids = vote_ids
+            if ids is None:
+                data = "0x" + function_selector(VOTES_LENGTH).hex()
+                response = await client.request("eth_call", [{"to": voting, "data": data}, block])
+                ids = range(int(response["result"], 16))
+            params = (
+                [{"to": voting, "data": f"{selector}{vote_id:064x}"}, block]
+                for vote_id in ids
+            )
+            requests = client.iter_requests("eth_call", params, batch_size)
+            async for _, (call, _), response in requests:
+                if "error" in response:
+                    raise EVMScriptError(f"getVote failed: {response['error']}")
+                vote_id = int(call["data"][10:], 16)
+                output = bytes.fromhex(response["result"][2:])
+                scripts[vote_id] = decode_abi(GET_VOTE_OUTPUTS, output)[-1]
+        return scripts
+
+    scripts = run_coroutine(fetch())
+    return dict(sorted(scripts.items()))
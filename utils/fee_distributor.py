@@ -0,0 +1,43 @@
+import pandas as pd
+
+from utils.materialized import MATERIALIZED_DIR, MaterializedDataset
+
+# veCRV fee distributor, pays out 3CRV
+FEE_DISTRIBUTOR = "0xA464e6DCda8AC41e03616F95f4BC98a13b8922Dc"
+
+WEEK = 7 * 86400
+
+
+def weekly_fees_dataset(distributor, path: str = MATERIALIZED_DIR) -> MaterializedDataset:
+    """3CRV distributed per week (`tokens_per_week`, in token units), keyed by the
+    week's start timestamp.
+
+    The distributor spreads the tokens it received since its last checkpoint over the
+    time since `last_token_time`, so a week can still grow until a checkpoint after
+    its end. Only weeks ending at or before `last_token_time()` are stored; the later
+    ones are refetched on every refresh.
+
+    Args:
+        distributor: FeeDistributor contract (brownie)
+        path (str): root directory for materialized datasets
+    """
+
+    def compute(first: int, last: int) -> pd.DataFrame:
+        weeks = range((first + WEEK - 1) // WEEK * WEEK, last + 1, WEEK)
+        return pd.DataFrame(
+            {
+                "timestamp": list(weeks),
+                "fees": [distributor.tokens_per_week(t) / 1e18 for t in weeks],
+            }
+        )
+
+    # the week starting at t is final once t + WEEK <= last_token_time
+    return MaterializedDataset(
+        "fee_distributor_weekly_fees",
+        compute,
+        start=distributor.start_time() // WEEK * WEEK,
+        axis="timestamp",
+        settle=WEEK,
+        head=lambda: int(distributor.last_token_time()),
+        path=path,
+    )
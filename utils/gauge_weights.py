@@ -0,0 +1,349 @@
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List
+
+from utils.voting_escrow import WEEK, VotingEscrowHistory
+
+GAUGE_CONTROLLER = "0x2F50D538606Fa9EDD2B11E2446BEb18C9D5846bB"
+GAUGE_CONTROLLER_START_BLOCK = 10647875
+
+# vote weights are given in basis points of the user's voting power
+MAX_VOTE_WEIGHT = 10_000
+
+
+def _event(name: str, inputs: List[tuple]) -> Dict:
+    return {
+        "name": name,
+        "type": "event",
+        "anonymous": False,
+        "inputs": [{"name": n, "type": t, "indexed": False} for n, t in inputs],
+    }
+
+
+NEW_GAUGE_EVENT = _event(
+    "NewGauge", [("addr", "address"), ("gauge_type", "int128"), ("weight", "uint256")]
+)
+VOTE_FOR_GAUGE_EVENT = _event(
+    "VoteForGauge",
+    [("time", "uint256"), ("user", "address"), ("gauge_addr", "address"), ("weight", "uint256")],
+)
+NEW_TYPE_WEIGHT_EVENT = _event(
+    "NewTypeWeight",
+    [
+        ("type_id", "int128"),
+        ("time", "uint256"),
+        ("weight", "uint256"),
+        ("total_weight", "uint256"),
+    ],
+)
+NEW_GAUGE_WEIGHT_EVENT = _event(
+    "NewGaugeWeight",
+    [
+        ("gauge_address", "address"),
+        ("time", "uint256"),
+        ("weight", "uint256"),
+        ("total_weight", "uint256"),
+    ],
+)
+GAUGE_CONTROLLER_EVENTS = [
+    NEW_GAUGE_EVENT,
+    VOTE_FOR_GAUGE_EVENT,
+    NEW_TYPE_WEIGHT_EVENT,
+    NEW_GAUGE_WEIGHT_EVENT,
+]
+
+
+def next_epoch(timestamp):
+    """Start of the week a change made at `timestamp` takes effect in, as the contract
+    computes it: `(timestamp + WEEK) / WEEK * WEEK`."""
+    return (np.asarray(timestamp, dtype=np.int64) + WEEK) // WEEK * WEEK
+
+
+def _ceil_week(timestamp):
+    return -(-np.asarray(timestamp, dtype=np.int64) // WEEK) * WEEK
+
+
+def _python_ints(values: pd.Series) -> np.ndarray:
+    """Object array of python ints (missing as 0), so slope * time cannot overflow."""
+    return np.array([0 if pd.isna(v) else int(v) for v in values], dtype=object)
+
+
+class GaugeWeightHistory:
+    """Gauge weights of the GaugeController rebuilt from its logs and veCRV locks.
+
+    A VoteForGauge by a user with lock slope `s` and lock end `e` adds a bias of
+    `s * weight / 10000 * (e - t)` to the gauge at every epoch `t` from the vote's
+    next epoch until the user votes for that gauge again or the lock ends. The slope
+    behind a vote is not logged, so it is taken from the user's veCRV lock at the
+    time of the vote (`VotingEscrow.get_last_user_slope`), see `VotingEscrowHistory`.
+    Summing those decaying biases per gauge gives `points_weight` for gauges x epochs
+    in one pass; relative weights follow from the type weights.
+
+    Admin weight changes are modelled as a constant bias on top of the votes: the
+    weight of NewGauge, and for NewGaugeWeight the difference between the new weight
+    and the votes at that epoch. Weights are float64 (wei of veCRV).
+
+    Args:
+        events (pd.DataFrame): decoded GaugeController logs (`GAUGE_CONTROLLER_EVENTS`)
+            with block_number, log_index and event columns, as written by `LogIndexer`
+        escrow (VotingEscrowHistory): veCRV locks covering the same blocks
+    """
+
+    def __init__(self, events: pd.DataFrame, escrow: VotingEscrowHistory):
+        events = events.sort_values(["block_number", "log_index"]).reset_index(drop=True)
+        self.escrow = escrow
+
+        gauges = events[events.event == "NewGauge"]
+        self.gauges = pd.Series(
+            gauges.gauge_type.values.astype(np.int64),
+            index=[addr.lower() for addr in gauges.addr],
+            name="type",
+        )
+        self._gauge_index = {gauge: i for i, gauge in enumerate(self.gauges.index)}
+
+        type_weights = events[events.event == "NewTypeWeight"]
+        self.type_weights = pd.DataFrame(
+            {
+                "type_id": type_weights.type_id.values.astype(np.int64),
+                # logged as the epoch the new weight applies from
+                "time": _ceil_week(type_weights.time.values.astype(np.int64)),
+                "weight": type_weights.weight.map(float).values,
+            }
+        )
+        self.votes = self._vote_slopes(events[events.event == "VoteForGauge"])
+        self.admin_weights = self._admin_weights(events)
+
+    def _vote_slopes(self, votes: pd.DataFrame) -> pd.DataFrame:
+        votes = pd.DataFrame(
+            {
+                "time": votes.time.values.astype(np.int64),
+                "user": [user.lower() for user in votes.user],
+                "gauge": [gauge.lower() for gauge in votes.gauge_addr],
+                "power": votes.weight.values.astype(np.int64),
+                "order": np.arange(len(votes)),
+            }
+        )
+        unknown = set(votes.gauge) - set(self._gauge_index)
+        if unknown:
+            raise ValueError(f"votes for gauges without a NewGauge log: {sorted(unknown)[:5]}")
+
+        # the user's lock at the time of the vote
+        locks = self.escrow.checkpoints[["user", "timestamp", "end", "slope"]]
+        votes = pd.merge_asof(
+            votes.sort_values("time"),
+            locks.sort_values("timestamp"),
+            left_on="time",
+            right_on="timestamp",
+            by="user",
+            direction="backward",
+        ).sort_values("order")
+        votes["end"] = votes.end.fillna(0).astype(np.int64)
+        votes["slope"] = [
+            0 if pd.isna(slope) else slope * int(power) // MAX_VOTE_WEIGHT
+            for slope, power in zip(votes.slope, votes.power)
+        ]
+        votes["start"] = next_epoch(votes.time.values)
+        # a vote is replaced by the user's next vote for the same gauge
+        replaced = votes.groupby(["user", "gauge"]).start.shift(-1).values
+        stop = votes.end.values.copy()
+        superseded = ~np.isnan(replaced)
+        stop[superseded] = np.minimum(replaced[superseded].astype(np.int64), stop[superseded])
+        votes["stop"] = stop
+        return votes.drop(columns=["order", "timestamp"]).reset_index(drop=True)
+
+    # ------- epochs --------- #
+
+    def epochs(self, first: int = None, last: int = None) -> np.ndarray:
+        """Week starts from the first gauge vote (or `first`) to `last` (default: the
+        epoch after the last vote)."""
+        if first is None:
+            first = int(self.votes.start.min()) if len(self.votes) else 0
+        if last is None:
+            last = int(self.votes.start.max()) if len(self.votes) else first
+        return np.arange(_ceil_week(first), last + 1, WEEK, dtype=np.int64)
+
+    def _vote_weights(self, epochs: np.ndarray) -> np.ndarray:
+        """(gauges x epochs) sum of the decaying vote biases."""
+        n_gauges, n_epochs = len(self.gauges), len(epochs)
+        live = (self.votes.stop.values > self.votes.start.values) & (
+            self.votes.slope.values > 0
+        ).astype(bool)
+        votes = self.votes[live]
+        gauge = np.array([self._gauge_index[g] for g in votes.gauge], dtype=np.int64)
+        slope = votes.slope.map(float).values
+        end = votes.end.values.astype(np.float64)
+
+        # sum(slope * end) - sum(slope) * t over the votes in force at each epoch,
+        # accumulated from +/- changes at the epochs votes start and stop
+        start = np.searchsorted(epochs, votes.start.values)
+        stop = np.searchsorted(epochs, votes.stop.values)
+        bias_sum = np.zeros((n_gauges, n_epochs + 1))
+        slope_sum = np.zeros((n_gauges, n_epochs + 1))
+        np.add.at(bias_sum, (gauge, start), slope * end)
+        np.add.at(bias_sum, (gauge, stop), -slope * end)
+        np.add.at(slope_sum, (gauge, start), slope)
+        np.add.at(slope_sum, (gauge, stop), -slope)
+        bias_sum = np.cumsum(bias_sum, axis=1)[:, :n_epochs]
+        slope_sum = np.cumsum(slope_sum, axis=1)[:, :n_epochs]
+        return np.maximum(bias_sum - slope_sum * epochs, 0)
+
+    def _admin_weights(self, events: pd.DataFrame) -> pd.DataFrame:
+        """Weights set by the admin: NewGauge with a non-zero weight (which logs no
+        time, so its block's timestamp is looked up) and NewGaugeWeight."""
+        added = events[(events.event == "NewGauge") & (events.weight.map(float) > 0)]
+        if len(added) and "timestamp" not in added:
+            from utils.eth_blocks_utils import get_timestamps_for_blocks
+
+            added = added.assign(timestamp=get_timestamps_for_blocks(added.block_number.values))
+
+        changed = events[events.event == "NewGaugeWeight"]
+        rows = [
+            (row["addr"], int(next_epoch(int(row["timestamp"]))), row["weight"])
+            for row in added.to_dict("records")
+        ] + [
+            (row["gauge_address"], int(next_epoch(int(row["time"]))), row["weight"])
+            for row in changed.to_dict("records")
+        ]
+        admin = pd.DataFrame(rows, columns=["gauge", "epoch", "weight"])
+        admin["gauge"] = admin.gauge.str.lower()
+        admin["weight"] = admin.weight.map(float)
+        # a gauge's later changes override its earlier ones
+        return admin.sort_values("epoch", kind="stable").reset_index(drop=True)
+
+    def _admin_bias(self, epochs: np.ndarray, vote_weights: np.ndarray) -> np.ndarray:
+        bias = np.zeros_like(vote_weights)
+        if not len(self.admin_weights):
+            return bias
+        changed_at = np.unique(self.admin_weights.epoch.values)
+        votes_then = self._vote_weights(changed_at)
+        for gauge, epoch, weight in self.admin_weights.itertuples(index=False):
+            at = np.searchsorted(epochs, epoch)
+            if at >= len(epochs):
+                continue
+            g = self._gauge_index[gauge]
+            # the weight replaces the gauge's bias at `epoch`; later votes add to it
+            bias[g, at:] = weight - votes_then[g, np.searchsorted(changed_at, epoch)]
+        return bias
+
+    def _type_weights(self, epochs: np.ndarray) -> np.ndarray:
+        """(gauges x epochs) weight of each gauge's type."""
+        types = np.unique(self.gauges.values)
+        by_type = np.zeros((len(types), len(epochs)))
+        for k, type_id in enumerate(types):
+            changes = self.type_weights[self.type_weights.type_id == type_id]
+            idx = np.searchsorted(changes.time.values, epochs, side="right") - 1
+            by_type[k] = np.where(idx >= 0, changes.weight.values[np.maximum(idx, 0)], 0.0)
+        return by_type[np.searchsorted(types, self.gauges.values)]
+
+    # ------- queries --------- #
+
+    def weights(self, epochs: np.ndarray = None) -> pd.DataFrame:
+        """`points_weight` of every gauge at each epoch (epochs x gauges)."""
+        epochs = self.epochs() if epochs is None else _ceil_week(epochs)
+        vote_weights = self._vote_weights(epochs)
+        weights = np.maximum(vote_weights + self._admin_bias(epochs, vote_weights), 0)
+        return pd.DataFrame(weights.T, index=epochs, columns=self.gauges.index)
+
+    def relative_weights(self, epochs: np.ndarray = None) -> pd.DataFrame:
+        """`gauge_relative_weight` (as a fraction, not 1e18) at each epoch."""
+        weights = self.weights(epochs)
+        typed = weights.values.T * self._type_weights(weights.index.values)
+        total = typed.sum(axis=0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            relative = np.where(total > 0, typed / total, 0.0)
+        return pd.DataFrame(relative.T, index=weights.index, columns=weights.columns)
+
+    def votes_at(self, timestamp: int) -> pd.DataFrame:
+        """Each user's latest vote per gauge cast at or before `timestamp`
+        (`vote_user_slopes`), including expired ones and zero-weight removals."""
+        cast = self.votes[self.votes.time <= timestamp]
+        return cast.groupby(["user", "gauge"]).tail(1).set_index(["user", "gauge"])
+
+    def simulate(
+        self, scenarios: pd.DataFrame, timestamp: int, rate: float = None
+    ) -> pd.DataFrame:
+        """Next-epoch relative weights (or emissions) after hypothetical votes.
+
+        Every scenario is a set of votes cast at `timestamp` on top of the recorded
+        history. All scenarios are evaluated at once as (scenarios x gauges) changes
+        to the next epoch's weights. Scenarios the contract would reject, because a
+        user votes with more than 100% of their power or with a lock ending before
+        the next epoch, come back as NaN rows. The 10 day delay between votes for the
+        same gauge is not checked.
+
+        Args:
+            scenarios (pd.DataFrame): scenario, user, gauge and weight (basis points)
+                columns; one row per vote, at most one per (scenario, user, gauge)
+            timestamp (int): when the votes are cast (e.g. the latest block's)
+            rate (float): CRV emission rate in wei per second (`CRV.rate()`); when
+                given, the result is CRV emitted to each gauge over the epoch
+
+        Returns:
+            pd.DataFrame: indexed by scenario, one column per gauge.
+        """
+        epoch = int(next_epoch(timestamp))
+        base = self.weights(np.array([epoch])).values[0]
+        type_weights = self._type_weights(np.array([epoch]))[:, 0]
+
+        scenarios = scenarios.assign(
+            user=scenarios.user.str.lower(), gauge=scenarios.gauge.str.lower()
+        )
+        scenario_ids, scenario_idx = np.unique(scenarios.scenario.values, return_inverse=True)
+        gauge_idx = np.array([self._gauge_index[g] for g in scenarios.gauge], dtype=np.int64)
+
+        # the votes being replaced
+        previous = self.votes_at(timestamp)
+        old = previous.reindex(pd.MultiIndex.from_arrays([scenarios.user, scenarios.gauge]))
+        old_slope = _python_ints(old.slope)
+        old_end = old.end.fillna(0).values.astype(np.int64)
+        old_bias = old_slope * np.maximum(old_end - epoch, 0)
+        old_power = old.power.fillna(0).values.astype(np.int64)
+
+        # the new votes, from the users' locks at `timestamp`
+        locks = self.escrow.locks(timestamp).reindex(scenarios.user)
+        lock_end = locks.end.fillna(0).values.astype(np.int64)
+        lock_slope = _python_ints(locks.slope)
+        power = scenarios.weight.values.astype(np.int64)
+        new_bias = lock_slope * power // MAX_VOTE_WEIGHT * np.maximum(lock_end - epoch, 0)
+
+        delta = np.zeros((len(scenario_ids), len(self.gauges)))
+        np.add.at(delta, (scenario_idx, gauge_idx), (new_bias - old_bias).astype(np.float64))
+        weights = np.maximum(base + delta, 0)
+
+        # vote_user_power after the votes, and locks that cannot vote for the epoch
+        used = previous.power.groupby(level="user").sum()
+        changed = pd.DataFrame(
+            {"scenario": scenario_idx, "user": scenarios.user.values, "d": power - old_power}
+        )
+        after = changed.groupby(["scenario", "user"]).d.sum()
+        after += used.reindex(after.index.get_level_values("user")).fillna(0).values
+        invalid = np.zeros(len(scenario_ids), dtype=bool)
+        invalid[after[after > MAX_VOTE_WEIGHT].index.get_level_values("scenario")] = True
+        invalid[scenario_idx[(power > 0) & (lock_end <= epoch)]] = True
+
+        typed = weights * type_weights
+        total = typed.sum(axis=1, keepdims=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = np.where(total > 0, typed / total, 0.0)
+        if rate is not None:
+            result = result * rate * WEEK
+        result[invalid] = np.nan
+        return pd.DataFrame(result, index=scenario_ids, columns=self.gauges.index)
+
+
+def load_gauge_weight_history(
+    to_block: int = None, rpc_url: str = None, escrow: VotingEscrowHistory = None
+) -> GaugeWeightHistory:
+    """Indexes the GaugeController's logs (and the veCRV locks, unless `escrow` is
+    given) up to `to_block` and rebuilds the gauge weights."""
+    from utils.log_indexer import LogIndexer
+    from utils.voting_escrow import load_voting_escrow_history
+
+    if escrow is None:
+        escrow = load_voting_escrow_history(to_block=to_block, rpc_url=rpc_url)
+    indexer = LogIndexer(
+        "gauge_controller", GAUGE_CONTROLLER, GAUGE_CONTROLLER_EVENTS, rpc_url=rpc_url
+    )
+    indexer.update(from_block=GAUGE_CONTROLLER_START_BLOCK, to_block=to_block)
+    return GaugeWeightHistory(indexer.load(GAUGE_CONTROLLER_START_BLOCK, to_block), escrow)
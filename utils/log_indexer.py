@@ -0,0 +1,303 @@
+import asyncio
+import glob
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+from web3 import Web3
+
+from typing import Dict, List, Optional, Union
+
+from utils.event_decoder import decode_events, event_topic, integer_columns
+from utils.rpc_cache import CACHE_DIR, DEFAULT_FINALITY_DEPTH
+
+LOGS_DIR = os.path.join(CACHE_DIR, "logs")
+
+# providers word "your range returned too much data" in many different ways
+TOO_MANY_RESULTS = re.compile(
+    r"more than \d+ results|too many results|response size exceeded|"
+    r"block range is too wide|query timeout|limit exceeded|range too large",
+    re.IGNORECASE,
+)
+
+# blocks per partition file, and the initial / maximum eth_getLogs range per request
+PARTITION_SIZE = 100_000
+CHUNK_SIZE = 2_000
+MAX_CHUNK_SIZE = 100_000
+
+
+# storage of integer columns, picked from the ABI type so that a column is stored the
+# same way in every partition: wider than 64 bits as decimal strings (parquet has no
+# wider integer type), the others as nullable 64-bit integers
+DECIMAL_STRING = "decimal_string"
+
+
+def _storage_type(abi_type: str) -> str:
+    bits = int(re.sub(r"^u?int", "", abi_type) or 256)
+    if bits > 64:
+        return DECIMAL_STRING
+    return "UInt64" if abi_type == "uint64" else "Int64"
+
+
+def _column_types(event_abis: List[Dict]) -> Dict[str, str]:
+    """Storage type of the integer columns of all events; a name shared by events
+    with different types is stored as decimal strings."""
+    types = {}
+    for event_abi in event_abis:
+        for column, abi_type in integer_columns(event_abi).items():
+            storage = _storage_type(abi_type)
+            types[column] = storage if types.get(column, storage) == storage else DECIMAL_STRING
+    return types
+
+
+def _conform(df: pd.DataFrame, types: Dict[str, str]) -> pd.DataFrame:
+    """Casts (or adds, as missing values) the integer columns to their storage type."""
+    for column, storage in types.items():
+        if column not in df:
+            if storage == DECIMAL_STRING:
+                df[column] = pd.Series(None, index=df.index, dtype=object)
+            else:
+                df[column] = pd.Series(pd.NA, index=df.index, dtype=storage)
+            continue
+        values = df[column].astype(object)
+        notna = values.notna().values
+        converted = np.empty(len(values), dtype=object)
+        converted[notna] = [int(v) for v in values.values[notna]]
+        if storage == DECIMAL_STRING:
+            converted[notna] = [str(v) for v in converted[notna]]
+            converted[~notna] = None
+            df[column] = pd.Series(converted, index=df.index, dtype=object)
+        else:
+            converted[~notna] = pd.NA
+            df[column] = pd.array(converted, dtype=storage)
+    return df
+
+
+def _to_columnar(df: pd.DataFrame) -> pd.DataFrame:
+    """bytes and array values do not map to parquet types; keep them as hex strings
+    and json."""
+    for column in df.columns:
+        notna = df[column].notna()
+        if df[column].dtype != object or not notna.any():
+            continue
+        values = df.loc[notna, column]
+        sample = values.iloc[0]
+        if isinstance(sample, bytes):
+            df.loc[notna, column] = values.map(lambda v: "0x" + v.hex())
+        elif isinstance(sample, (list, tuple)):
+            df.loc[notna, column] = values.map(lambda v: json.dumps(v, default=str))
+    return df
+
+
+class LogIndexer:
+    """Indexes the logs of a set of contracts/events into block-range partitioned
+    parquet files, resuming from the last indexed block.
+
+    Each partition of `PARTITION_SIZE` blocks is fetched as `eth_getLogs` chunks that
+    run concurrently through an AsyncRPCClient. When a provider rejects a chunk for
+    returning too many results it is bisected and retried, and the chunk size used
+    for later partitions adapts to the density of the logs.
+
+    Only blocks at least `finality_depth` behind the chain head are indexed by
+    default: partitions are never rewritten, so logs of a block that is later
+    re-orged out would otherwise stay in the dataset.
+
+    Args:
+        name (str): dataset name, i.e. the directory the partitions are written to
+        addresses (str | list): contract address(es) to index
+        event_abis (list(dict)): event ABI entries to fetch and decode
+        rpc_url (str): JSON-RPC endpoint, defaults to Alchemy
+        path (str): root directory for indexed datasets
+        finality_depth (int): blocks behind the head that `update` stops at by default
+    """
+
+    def __init__(
+        self,
+        name: str,
+        addresses: Union[str, List[str]],
+        event_abis: List[Dict],
+        rpc_url: str = None,
+        path: str = LOGS_DIR,
+        partition_size: int = PARTITION_SIZE,
+        chunk_size: int = CHUNK_SIZE,
+        finality_depth: int = DEFAULT_FINALITY_DEPTH,
+    ):
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        self.name = name
+        self.addresses = [Web3.toChecksumAddress(address) for address in addresses]
+        self.events = {event_topic(abi): abi for abi in event_abis}
+        self.column_types = _column_types(event_abis)
+        self.rpc_url = rpc_url
+        self.path = os.path.join(path, name)
+        self.partition_size = partition_size
+        self.chunk_size = chunk_size
+        self.finality_depth = finality_depth
+        os.makedirs(self.path, exist_ok=True)
+
+    # ------- state --------- #
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.path, "state.json")
+
+    @property
+    def last_indexed_block(self) -> Optional[int]:
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path) as f:
+            return json.load(f)["last_block"]
+
+    def _save_state(self, last_block: int) -> None:
+        with open(self.state_path, "w") as f:
+            json.dump(
+                {
+                    "last_block": last_block,
+                    "addresses": self.addresses,
+                    "topics": list(self.events),
+                },
+                f,
+            )
+
+    def partitions(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, "*.parquet")))
+
+    # ------- fetching --------- #
+
+    def update(self, from_block: int = 0, to_block: int = None) -> int:
+        """Indexes logs from the last indexed block (or `from_block` on the first run)
+        up to `to_block` (default: `finality_depth` blocks behind the chain head).
+
+        Returns:
+            int: the last indexed block.
+        """
+        from utils.async_utils import ALCHEMY_RPC, run_coroutine
+
+        return run_coroutine(
+            self._update(self.rpc_url or ALCHEMY_RPC, from_block, to_block)
+        )
+
+    async def _update(self, rpc_url: str, from_block: int, to_block: Optional[int]) -> int:
+        from utils.async_utils import AsyncRPCClient
+
+        async with AsyncRPCClient(rpc_url) as client:
+            if to_block is None:
+                head = int((await client.request("eth_blockNumber", []))["result"], 16)
+                to_block = head - self.finality_depth
+
+            last = self.last_indexed_block
+            start = from_block if last is None else last + 1
+            while start <= to_block:
+                # partitions are aligned to multiples of partition_size
+                partition_end = (start // self.partition_size + 1) * self.partition_size - 1
+                end = min(partition_end, to_block)
+                logs = await self._fetch_range(client, start, end)
+                self._write_partition(start, end, logs)
+                self._save_state(end)
+                start = end + 1
+
+        return self.last_indexed_block
+
+    async def _fetch_range(self, client, start: int, end: int) -> List[Dict]:
+        chunk_size = self.chunk_size
+        chunks = [
+            (lo, min(lo + chunk_size - 1, end)) for lo in range(start, end + 1, chunk_size)
+        ]
+        # (blocks, number of logs) of every request, None logs if it was rejected
+        requests = []
+        results = await asyncio.gather(
+            *[self._get_logs(client, lo, hi, requests) for lo, hi in chunks]
+        )
+        self.chunk_size = self._next_chunk_size(chunk_size, requests)
+        return [log for result in results for log in result]
+
+    @staticmethod
+    def _next_chunk_size(chunk_size: int, requests: List[tuple]) -> int:
+        """Half the smallest range the provider rejected, or a larger chunk if every
+        full-sized one came back well under the providers' result limits."""
+        rejected = [blocks for blocks, logs in requests if logs is None]
+        if rejected:
+            return max(min(rejected) // 2, 1)
+        full = [logs for blocks, logs in requests if blocks == chunk_size]
+        if full and max(full) < 1000:
+            return min(int(chunk_size * 1.25) + 1, MAX_CHUNK_SIZE)
+        return chunk_size
+
+    async def _get_logs(self, client, lo: int, hi: int, requests: List[tuple]) -> List[Dict]:
+        params = [
+            {
+                "address": self.addresses,
+                "topics": [list(self.events)],
+                "fromBlock": hex(lo),
+                "toBlock": hex(hi),
+            }
+        ]
+        response = await client.request("eth_getLogs", params)
+        if "error" not in response:
+            requests.append((hi - lo + 1, len(response["result"])))
+            return response["result"]
+
+        message = str(response["error"])
+        if not TOO_MANY_RESULTS.search(message) or lo == hi:
+            raise RuntimeError(f"eth_getLogs {lo}-{hi} failed: {message}")
+
+        requests.append((hi - lo + 1, None))
+        mid = (lo + hi) // 2
+        left, right = await asyncio.gather(
+            self._get_logs(client, lo, mid, requests),
+            self._get_logs(client, mid + 1, hi, requests),
+        )
+        return left + right
+
+    # ------- storage --------- #
+
+    def decode(self, logs: List[Dict]) -> pd.DataFrame:
+        logs = [log for log in logs if not log.get("removed")]
+        frames = []
+        for event_abi in self.events.values():
+            df = decode_events(logs, event_abi, exact=True)
+            if len(df):
+                df.insert(4, "event", event_abi["name"])
+                # every integer column of every event, so frames concatenate without
+                # falling back to float or object columns
+                frames.append(_conform(df, self.column_types))
+        if not frames:
+            return pd.DataFrame(
+                columns=["block_number", "log_index", "transaction_hash", "address", "event"]
+            )
+        df = pd.concat(frames, ignore_index=True)
+        df = df.sort_values(["block_number", "log_index"]).reset_index(drop=True)
+        return _to_columnar(df)
+
+    def _write_partition(self, start: int, end: int, logs: List[Dict]) -> None:
+        if not logs:
+            return
+        df = self.decode(logs)
+        df.to_parquet(
+            os.path.join(self.path, f"{start:010d}_{end:010d}.parquet"), index=False
+        )
+
+    def load(
+        self, from_block: int = 0, to_block: int = None, event: str = None
+    ) -> pd.DataFrame:
+        """Reads indexed logs overlapping [from_block, to_block] back into one frame."""
+        frames = []
+        for partition in self.partitions():
+            start, end = map(int, os.path.basename(partition)[:-8].split("_"))
+            if end < from_block or (to_block is not None and start > to_block):
+                continue
+            # partitions written before the storage types came from the ABI stored
+            # uint256 columns as int64 where all their values fitted
+            frames.append(_conform(pd.read_parquet(partition), self.column_types))
+        if not frames:
+            return pd.DataFrame()
+
+        df = pd.concat(frames, ignore_index=True)
+        mask = df.block_number >= from_block
+        if to_block is not None:
+            mask &= df.block_number <= to_block
+        if event is not None:
+            mask &= df.event == event
+        return df[mask].reset_index(drop=True)
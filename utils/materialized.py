@@ -0,0 +1,210 @@
+import glob
+import json
+import os
+import time
+
+import pandas as pd
+
+from typing import Callable, Optional
+
+from utils.rpc_cache import CACHE_DIR, DEFAULT_FINALITY_DEPTH
+
+MATERIALIZED_DIR = os.path.join(CACHE_DIR, "materialized")
+# part files written by refreshes are merged into one once there are this many
+MAX_PARTS = 32
+
+# (first, last) of a range along the dataset's axis, inclusive -> rows in that range
+ComputeFn = Callable[[int, int], pd.DataFrame]
+
+
+def _latest_block() -> int:
+    from brownie import web3
+
+    return web3.eth.block_number
+
+
+def _now() -> int:
+    return int(time.time())
+
+
+class MaterializedDataset:
+    """A dataset defined as a function of a block or timestamp range, persisted with
+    the range it covers so a refresh only computes the missing tail.
+
+    `compute(first, last)` returns the rows for [first, last] (inclusive) with the
+    range axis in column `axis`. Rows of the last `settle` units before the head
+    can still change (the current week's fees, blocks that can be re-orged) and are
+    recomputed on every refresh instead of being stored.
+
+    Data lives in `{path}/{name}/` as parquet parts named by their range plus a
+    state.json holding the covered range, like the LogIndexer partitions.
+
+    Args:
+        name (str): dataset name, i.e. its directory
+        compute (callable): (first, last) -> DataFrame
+        start (int): first block / timestamp of the dataset
+        axis (str): "block" or "timestamp" (also the column holding it)
+        settle (int): blocks / seconds before the head that are not persisted;
+            defaults to DEFAULT_FINALITY_DEPTH blocks or one hour
+        head (callable): returns the current head along the axis
+        path (str): root directory for materialized datasets
+    """
+
+    def __init__(
+        self,
+        name: str,
+        compute: ComputeFn,
+        start: int,
+        axis: str = "block",
+        settle: int = None,
+        head: Callable[[], int] = None,
+        path: str = MATERIALIZED_DIR,
+    ):
+        if axis not in ("block", "timestamp"):
+            raise ValueError(f"axis must be 'block' or 'timestamp', not {axis!r}")
+        self.name = name
+        self.compute = compute
+        self.start = int(start)
+        self.axis = axis
+        if settle is None:
+            settle = DEFAULT_FINALITY_DEPTH if axis == "block" else 3600
+        self.settle = settle
+        self.head = head or (_latest_block if axis == "block" else _now)
+        self.path = os.path.join(path, name)
+        self.rows_computed = 0
+        os.makedirs(self.path, exist_ok=True)
+
+    # ------- state --------- #
+
+    @property
+    def state_path(self) -> str:
+        return os.path.join(self.path, "state.json")
+
+    @property
+    def covered_to(self) -> Optional[int]:
+        """Last block / timestamp stored, or None if nothing is stored yet."""
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path) as f:
+            return json.load(f)["covered_to"]
+
+    def _save_state(self, covered_to: Optional[int]) -> None:
+        state = {"axis": self.axis, "start": self.start, "covered_to": covered_to}
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def parts(self):
+        return sorted(glob.glob(os.path.join(self.path, "*.parquet")))
+
+    def _write_part(self, first: int, last: int, df: pd.DataFrame) -> None:
+        filename = os.path.join(self.path, f"{first:012d}_{last:012d}.parquet")
+        df.to_parquet(filename + ".tmp", index=False)
+        os.replace(filename + ".tmp", filename)
+
+    # ------- refresh --------- #
+
+    def _compute(self, first: int, last: int) -> pd.DataFrame:
+        df = self.compute(first, last)
+        if df is None or df.empty:
+            return pd.DataFrame()
+        if self.axis not in df.columns:
+            raise ValueError(f"{self.name}: computed rows have no {self.axis!r} column")
+        outside = (df[self.axis] < first) | (df[self.axis] > last)
+        if outside.any():
+            raise ValueError(f"{self.name}: computed rows outside [{first}, {last}]")
+        self.rows_computed += len(df)
+        return df.reset_index(drop=True)
+
+    def refresh(self, to: int = None) -> pd.DataFrame:
+        """Computes and stores the rows after the covered range, up to `to` (default:
+        the current head) minus the settle window, and returns the full dataset
+        including the unsettled tail."""
+        head = self.head() if to is None else int(to)
+        final = head - self.settle
+        covered_to = self.covered_to
+        first = self.start if covered_to is None else covered_to + 1
+
+        if first <= final:
+            df = self._compute(first, final)
+            if not df.empty:
+                self._write_part(first, final, df)
+            self._save_state(final)
+            covered_to = final
+            if len(self.parts()) > MAX_PARTS:
+                self.compact()
+
+        tail_first = self.start if covered_to is None else covered_to + 1
+        tail = self._compute(tail_first, head) if tail_first <= head else pd.DataFrame()
+        stored = self.load(last=head)
+        if tail.empty:
+            return stored
+        if stored.empty:
+            return tail
+        return pd.concat([stored, tail], ignore_index=True)
+
+    def load(self, first: int = None, last: int = None) -> pd.DataFrame:
+        """Stored rows (optionally only those in [first, last]) in axis order."""
+        frames = []
+        for part in self.parts():
+            lo, hi = map(int, os.path.basename(part)[:-8].split("_"))
+            if (first is not None and hi < first) or (last is not None and lo > last):
+                continue
+            frames.append(pd.read_parquet(part))
+        if not frames:
+            return pd.DataFrame()
+
+        df = pd.concat(frames, ignore_index=True)
+        mask = pd.Series(True, index=df.index)
+        if first is not None:
+            mask &= df[self.axis] >= first
+        if last is not None:
+            mask &= df[self.axis] <= last
+        return df[mask].sort_values(self.axis, kind="stable").reset_index(drop=True)
+
+    def compact(self) -> None:
+        """Merges all parts into one file."""
+        parts = self.parts()
+        if len(parts) < 2:
+            return
+        df = self.load()
+        lo = int(os.path.basename(parts[0])[:12])
+        hi = int(os.path.basename(parts[-1])[13:25])
+        self._write_part(lo, hi, df)
+        for part in parts:
+            if os.path.basename(part) != f"{lo:012d}_{hi:012d}.parquet":
+                os.remove(part)
+
+    def invalidate(self, since: int = None) -> None:
+        """Forgets stored rows from `since` onwards (everything by default), so the
+        next refresh recomputes them."""
+        if since is None or since <= self.start:
+            for part in self.parts():
+                os.remove(part)
+            if os.path.exists(self.state_path):
+                os.remove(self.state_path)
+            return
+
+        kept = self.load(last=since - 1)
+        for part in self.parts():
+            os.remove(part)
+        if not kept.empty:
+            self._write_part(self.start, since - 1, kept)
+        covered_to = self.covered_to
+        self._save_state(min(since - 1, covered_to) if covered_to is not None else None)
+
+
+def materialized(name: str, start: int, axis: str = "block", **kwargs):
+    """Decorator turning a `compute(first, last)` function into a MaterializedDataset:
+
+        @materialized("weekly_fees", start=START, axis="timestamp", settle=WEEK)
+        def weekly_fees(first, last):
+            ...
+
+        df = weekly_fees.refresh()
+    """
+
+    def wrap(compute: ComputeFn) -> MaterializedDataset:
+        return MaterializedDataset(name, compute, start, axis=axis, **kwargs)
+
+    return wrap
@@ -0,0 +1,230 @@
+import re
+import time
+
+import pandas as pd
+import requests
+from eth_abi import decode_abi, encode_abi
+
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.rpc_cache import RPCCache
+
+# Multicall3 is deployed at the same address on every chain we look at
+MULTICALL3 = "0xcA11bde05977b3631167028862bE2a173976CA11"
+AGGREGATE3_SELECTOR = "0x82ad56cb"  # aggregate3((address,bool,bytes)[])
+
+# max sub-calls packed into one aggregate3 call, and eth_calls per JSON-RPC batch
+CALLS_PER_MULTICALL = 500
+RPC_BATCH_SIZE = 50
+RETRIES = 5
+
+# JSON-RPC errors that are the outcome of the call itself (code 3 is geth's
+# "execution reverted"); any other error means the node failed to serve it
+REVERT_ERROR = re.compile(r"revert|invalid opcode|invalid jump|out of gas", re.IGNORECASE)
+
+
+class RPCBatchError(Exception):
+    pass
+
+
+def is_revert(error) -> bool:
+    if isinstance(error, dict):
+        if error.get("code") == 3:
+            return True
+        error = error.get("message", "")
+    return bool(REVERT_ERROR.search(str(error)))
+
+
+def _rpc_url() -> str:
+    from brownie import web3
+
+    return web3.provider.endpoint_uri
+
+
+def _column_name(fn_name: str, args: tuple) -> str:
+    if not args:
+        return fn_name
+    return f"{fn_name}({', '.join(str(arg) for arg in args)})"
+
+
+def prepare_calls(calls: Iterable[Tuple]) -> List[Dict]:
+    """Encodes (contract, fn_name, args[, label]) tuples once, so they can be reused
+    for every block of a sweep. `contract` may be an address or a brownie Contract."""
+    prepared = []
+    names = set()
+    for contract, fn_name, args, *label in calls:
+        if isinstance(contract, str):
+            from utils import init_contract
+
+            contract = init_contract(contract)
+        args = tuple(args)
+        fn = getattr(contract, fn_name)
+        name = label[0] if label else _column_name(fn_name, args)
+        if name in names:
+            name = f"{contract.address[:8]}.{name}"
+        names.add(name)
+        prepared.append(
+            {
+                "name": name,
+                "target": contract.address,
+                "calldata": bytes.fromhex(fn.encode_input(*args)[2:]),
+                "decode": fn.decode_output,
+            }
+        )
+    return prepared
+
+
+def encode_aggregate3(prepared: List[Dict]) -> str:
+    data = encode_abi(
+        ["(address,bool,bytes)[]"],
+        [[(call["target"], True, call["calldata"]) for call in prepared]],
+    )
+    return AGGREGATE3_SELECTOR + data.hex()
+
+
+def decode_aggregate3(prepared: List[Dict], result: Optional[str]) -> Dict:
+    """Decodes aggregate3 return data. Sub-calls that reverted are returned as None,
+    as is every call if the multicall itself errored or was not deployed yet."""
+    if not result or result == "0x":
+        return {call["name"]: None for call in prepared}
+
+    (returned,) = decode_abi(["(bool,bytes)[]"], bytes.fromhex(result[2:]))
+    row = {}
+    for call, (success, data) in zip(prepared, returned):
+        value = None
+        if success and data:
+            try:
+                value = call["decode"]("0x" + data.hex())
+            except Exception:
+                value = None
+        row[call["name"]] = value
+    return row
+
+
+def post_rpc_batch(
+    url: str, payload: List[Dict], retries: int = RETRIES, session: requests.Session = None
+) -> Dict[int, Dict]:
+    """Posts a JSON-RPC batch array, retrying on rate limits, server errors and on a
+    single error object answering the whole batch (how some providers reject batches
+    that are too large or come too fast, with HTTP 200).
+
+    Returns:
+        dict: responses keyed by request id.
+    """
+    session = session or requests
+    for attempt in range(retries):
+        response = session.post(url, json=payload)
+        body = response.status_code
+        if response.status_code != 429 and response.status_code < 500:
+            response.raise_for_status()
+            body = response.json()
+            if isinstance(body, list):
+                return {item.get("id"): item for item in body}
+        if attempt < retries - 1:
+            time.sleep(2 ** attempt)
+    raise RPCBatchError(f"batch of {len(payload)} requests failed {retries} times: {body}")
+
+
+def multicall_sweep(
+    calls: Iterable[Tuple],
+    blocks: Iterable[int],
+    rpc_url: str = None,
+    calls_per_multicall: int = CALLS_PER_MULTICALL,
+    batch_size: int = RPC_BATCH_SIZE,
+    cache: RPCCache = None,
+) -> pd.DataFrame:
+    """Samples many view functions across many blocks with Multicall3.
+
+    Every block gets one aggregate3 eth_call per `calls_per_multicall` sub-calls, and
+    the eth_calls are sent `batch_size` at a time as JSON-RPC batch arrays, so a
+    sweep of N functions over M blocks costs about M / batch_size requests instead
+    of N * M. Reverting sub-calls, and blocks before Multicall3 was deployed, come
+    back as None instead of failing the sweep. eth_calls that error for any other
+    reason (rate limits, timeouts, "header not found", ...) are re-sent, and raise
+    RPCBatchError if they keep failing.
+
+    Args:
+        calls (list(tuple)): (contract, "fn_name", args) or (contract, "fn_name", args, label)
+        blocks (list(int)): blocks to sample at
+        rpc_url (str): JSON-RPC endpoint, defaults to brownie's active network
+        calls_per_multicall (int): max sub-calls per aggregate3 call
+        batch_size (int): eth_calls per JSON-RPC batch request
+        cache (RPCCache): optional cache for finalised blocks
+
+    Returns:
+        pd.DataFrame: one column per call, indexed by block.
+    """
+    rpc_url = rpc_url or _rpc_url()
+    prepared = prepare_calls(calls)
+    chunks = [
+        prepared[i : i + calls_per_multicall]
+        for i in range(0, len(prepared), calls_per_multicall)
+    ]
+    chunk_calldata = [encode_aggregate3(chunk) for chunk in chunks]
+    blocks = [int(block) for block in blocks]
+
+    session = requests.Session()
+    if cache is not None:
+        responses = post_rpc_batch(
+            rpc_url,
+            [
+                {"jsonrpc": "2.0", "id": 0, "method": "eth_chainId", "params": []},
+                {"jsonrpc": "2.0", "id": 1, "method": "eth_blockNumber", "params": []},
+            ],
+            session=session,
+        )
+        cache.set_chain_id(rpc_url, responses[0]["result"])
+        cache.set_head(rpc_url, responses[1]["result"])
+
+    # (block, chunk index) -> aggregate3 return data
+    results = {}
+    pending = []
+    for block in blocks:
+        for chunk_idx, calldata in enumerate(chunk_calldata):
+            params = [{"to": MULTICALL3, "data": calldata}, hex(block)]
+            key = None
+            if cache is not None:
+                key, result = cache.lookup(rpc_url, params)
+                if result is not None:
+                    results[(block, chunk_idx)] = result
+                    continue
+            pending.append((block, chunk_idx, params, key))
+
+    for i in range(0, len(pending), batch_size):
+        batch = pending[i : i + batch_size]
+        for attempt in range(RETRIES):
+            payload = [
+                {"jsonrpc": "2.0", "id": request_id, "method": "eth_call", "params": params}
+                for request_id, (_, _, params, _) in enumerate(batch)
+            ]
+            responses = post_rpc_batch(rpc_url, payload, session=session)
+            failed = []
+            for request_id, (block, chunk_idx, params, key) in enumerate(batch):
+                response = responses.get(request_id, {"error": "missing response"})
+                error = response.get("error")
+                if error and not is_revert(error):
+                    failed.append(((block, chunk_idx, params, key), error))
+                    continue
+                results[(block, chunk_idx)] = response.get("result")
+                if cache is not None:
+                    cache.store(key, response)
+
+            batch = [item for item, _ in failed]
+            if not batch:
+                break
+            if attempt < RETRIES - 1:
+                time.sleep(2 ** attempt)
+        else:
+            (block, _, _, _), error = failed[0]
+            raise RPCBatchError(
+                f"{len(failed)} eth_calls failed {RETRIES} times, e.g. at block {block}: {error}"
+            )
+
+    rows = []
+    for block in blocks:
+        row = {"block": block}
+        for chunk_idx, chunk in enumerate(chunks):
+            row.update(decode_aggregate3(chunk, results.get((block, chunk_idx))))
+        rows.append(row)
+
+    return pd.DataFrame(rows).set_index("block")
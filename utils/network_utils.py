@@ -1,12 +1,27 @@
 import os
 
-import brownie
-from brownie._config import CONFIG
+ALCHEMY_MAINNET_RPC = "https://eth-mainnet.alchemyapi.io/v2/{}"
 
-ALCHEMY_API_KEY = os.environ['ALCHEMY_API_KEY']
+
+def get_alchemy_api_key() -> str:
+    # read on use rather than at import, so modules can be imported without keys
+    return os.environ['ALCHEMY_API_KEY']
+
+
+def get_alchemy_rpc() -> str:
+    return ALCHEMY_MAINNET_RPC.format(get_alchemy_api_key())
+
+
+def __getattr__(name):
+    # `from utils.network_utils import ALCHEMY_API_KEY` keeps working
+    if name == "ALCHEMY_API_KEY":
+        return get_alchemy_api_key()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def configure_network(node_provider_https: str, network_name: str = "mainnet") -> None:
+    from brownie._config import CONFIG
+
     # change network provider to user specified
     CONFIG.networks[network_name]["host"] = node_provider_https
     CONFIG.networks[network_name]["name"] = "Ethereum mainnet"
@@ -15,16 +30,17 @@ def configure_network(node_provider_https: str, network_name: str = "mainnet") -
 def configure_network_and_connect(
     node_provider_https: str, network_name: str = "mainnet"
 ) -> None:
-    # change network provider to user specified
-    CONFIG.networks[network_name]["host"] = node_provider_https
-    CONFIG.networks[network_name]["name"] = "Ethereum mainnet"
+    import brownie
 
+    configure_network(node_provider_https, network_name)
     brownie.network.connect(network_name)
 
 
 def connect_eth_alchemy():
+    import brownie
+
     if not brownie.network.is_connected():
         configure_network_and_connect(
-            node_provider_https=f"https://eth-mainnet.alchemyapi.io/v2/{ALCHEMY_API_KEY}",
+            node_provider_https=get_alchemy_rpc(),
             network_name='mainnet'
         )
@@ -0,0 +1,297 @@
+import os
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Optional, Tuple, Union
+
+
+CACHE_DIR = os.environ.get(
+    "ONCHAIN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "on-chain-analytics")
+)
+DEFAULT_CACHE_PATH = os.path.join(CACHE_DIR, "rpc_cache.sqlite")
+
+# blocks closer than this to the chain head can still be re-orged out, so their
+# results are never written to disk
+DEFAULT_FINALITY_DEPTH = 64
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# how long a fetched chain head is trusted before asking the node again
+HEAD_TTL = 12
+
+
+def parse_block_identifier(block: Union[int, str, dict, None]) -> Optional[int]:
+    """Returns the block number for a JSON-RPC block param, or None if it is a tag
+    ("latest", "pending", ...) or a block hash, which are never cached."""
+    if isinstance(block, dict):
+        block = block.get("blockNumber")
+    if isinstance(block, bool) or block is None:
+        return None
+    if isinstance(block, int):
+        return block
+    if isinstance(block, str) and block.startswith("0x") and len(block) <= 18:
+        return int(block, 16)
+    if isinstance(block, str) and block.isdigit():
+        return int(block)
+    return None
+
+
+class RPCCache:
+    """On-disk cache of historical `eth_call` results.
+
+    Entries are keyed by (chain id, contract, sender, calldata, block). Calls are only
+    served from / written to the cache when they target an explicit block number that
+    is at least `finality_depth` blocks behind the chain head; anything addressed by
+    a tag such as "latest" always goes to the node. Once the database grows past
+    `max_bytes`, least recently used entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        finality_depth: int = DEFAULT_FINALITY_DEPTH,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        self.path = path
+        self.finality_depth = finality_depth
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.evictions = 0
+
+        self._heads: Dict[str, Tuple[int, float]] = {}
+        self._chain_ids: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS eth_call (
+                chain_id INTEGER NOT NULL,
+                address TEXT NOT NULL,
+                sender TEXT NOT NULL,
+                calldata TEXT NOT NULL,
+                block INTEGER NOT NULL,
+                result TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (chain_id, address, sender, calldata, block)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS eth_call_last_access ON eth_call (last_access)"
+        )
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM eth_call"
+        ).fetchone()[0]
+
+    # ------- chain state --------- #
+
+    def get_chain_id(self, endpoint: str) -> Optional[int]:
+        return self._chain_ids.get(endpoint)
+
+    def set_chain_id(self, endpoint: str, chain_id: Union[int, str]) -> None:
+        if isinstance(chain_id, str):
+            chain_id = int(chain_id, 16)
+        self._chain_ids[endpoint] = chain_id
+
+    def get_head(self, endpoint: str) -> Optional[int]:
+        """Last known chain head for `endpoint`, or None if it is older than HEAD_TTL."""
+        head, fetched_at = self._heads.get(endpoint, (None, 0))
+        if time.monotonic() - fetched_at > HEAD_TTL:
+            return None
+        return head
+
+    def set_head(self, endpoint: str, head: Union[int, str]) -> None:
+        if isinstance(head, str):
+            head = int(head, 16)
+        self._heads[endpoint] = (head, time.monotonic())
+
+    def is_final(self, block: Optional[int], head: int) -> bool:
+        return block is not None and block <= head - self.finality_depth
+
+    # ------- lookups --------- #
+
+    @staticmethod
+    def call_key(tx: dict) -> Optional[Tuple[str, str, str]]:
+        """(address, sender, calldata) for an eth_call transaction object, or None if
+        the call carries fields (value, gas price, ...) that make it uncacheable."""
+        if not isinstance(tx, dict) or not tx.get("to"):
+            return None
+        if set(tx) - {"to", "from", "data", "input", "gas"}:
+            return None
+        calldata = tx.get("data") or tx.get("input") or "0x"
+        return tx["to"].lower(), (tx.get("from") or "").lower(), calldata.lower()
+
+    def get(self, chain_id: int, address: str, sender: str, calldata: str, block: int):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM eth_call WHERE chain_id=? AND address=? AND sender=? "
+                "AND calldata=? AND block=?",
+                (chain_id, address, sender, calldata, block),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE eth_call SET last_access=? WHERE chain_id=? AND address=? "
+                "AND sender=? AND calldata=? AND block=?",
+                (time.time(), chain_id, address, sender, calldata, block),
+            )
+            return row[0]
+
+    def set(
+        self, chain_id: int, address: str, sender: str, calldata: str, block: int, result: str
+    ) -> None:
+        size = len(address) + len(sender) + len(calldata) + len(result) + 32
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO eth_call VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (chain_id, address, sender, calldata, block, result, size, time.time()),
+            )
+            if cursor.rowcount:
+                self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # drop the least recently used entries until we are back under 90% of budget
+        target = int(self.max_bytes * 0.9)
+        while self._size > target:
+            rows = self._conn.execute(
+                "SELECT rowid, size FROM eth_call ORDER BY last_access ASC LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            freed = 0
+            evict = []
+            for rowid, size in rows:
+                evict.append((rowid,))
+                freed += size
+                if self._size - freed <= target:
+                    break
+            self._conn.executemany("DELETE FROM eth_call WHERE rowid=?", evict)
+            self._size -= freed
+            self.evictions += len(evict)
+
+    def lookup(self, endpoint: str, params: list) -> Tuple[Optional[tuple], Optional[str]]:
+        """Checks the cache for an eth_call with JSON-RPC `params` sent to `endpoint`.
+
+        Returns:
+            tuple: (key, result). `key` is None if the call must not be cached (unknown
+                chain or head, non-final block, tag or state override), otherwise it
+                can be passed to `store` once the node has answered. `result` is the
+                cached return data if there was a hit.
+        """
+        if len(params) != 2:
+            self.skipped += 1
+            return None, None
+        call = self.call_key(params[0])
+        block = parse_block_identifier(params[1])
+        chain_id = self.get_chain_id(endpoint)
+        head = self.get_head(endpoint)
+        if call is None or chain_id is None or head is None or not self.is_final(block, head):
+            self.skipped += 1
+            return None, None
+        key = (chain_id, *call, block)
+        return key, self.get(*key)
+
+    def store(self, key: Optional[tuple], response: dict) -> None:
+        if key is None or "result" not in response or response.get("error"):
+            return
+        self.set(*key, response["result"])
+
+    # ------- housekeeping --------- #
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM eth_call").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": self._size,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM eth_call")
+            self._size = 0
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+_default_cache: Optional[RPCCache] = None
+
+
+def get_default_cache() -> RPCCache:
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = RPCCache()
+    return _default_cache
+
+
+def construct_rpc_cache_middleware(cache: RPCCache = None, endpoint: str = None):
+    """web3 middleware that serves finalised historical eth_calls from `cache`.
+
+    Args:
+        cache (RPCCache): cache to use, defaults to the shared on-disk cache
+        endpoint (str): name the chain head / chain id are tracked under, defaults
+            to the provider's endpoint uri
+
+    Returns:
+        middleware that can be added to a web3 (or brownie.web3) middleware onion.
+    """
+    cache = cache or get_default_cache()
+
+    def rpc_cache_middleware(make_request, w3):
+        name = endpoint or getattr(w3.provider, "endpoint_uri", None) or repr(w3.provider)
+
+        def middleware(method, params):
+            if method != "eth_call":
+                return make_request(method, params)
+
+            if cache.get_chain_id(name) is None:
+                cache.set_chain_id(name, make_request("eth_chainId", [])["result"])
+            if cache.get_head(name) is None:
+                cache.set_head(name, make_request("eth_blockNumber", [])["result"])
+
+            key, result = cache.lookup(name, params)
+            if result is not None:
+                return {"jsonrpc": "2.0", "id": 0, "result": result}
+
+            response = make_request(method, params)
+            cache.store(key, response)
+            return response
+
+        return middleware
+
+    return rpc_cache_middleware
+
+
+def install_rpc_cache(w3=None, cache: RPCCache = None) -> RPCCache:
+    """Adds the eth_call cache to a web3 instance (brownie's by default).
+
+    Brownie rebuilds its middlewares on connect, so call this after
+    `brownie.network.connect`.
+    """
+    if w3 is None:
+        from brownie import web3 as w3
+
+    cache = cache or get_default_cache()
+    if "rpc_cache" in w3.middleware_onion:
+        w3.middleware_onion.remove("rpc_cache")
+    w3.middleware_onion.add(construct_rpc_cache_middleware(cache), name="rpc_cache")
+    return cache
@@ -0,0 +1,469 @@
+# offline re-implementation of Curve's StableSwap integer math (3pool / factory
+# pools and metapools), vectorised with numpy object arrays so that every element
+# is a python int and results match the contracts to the wei.
+#
+# all functions broadcast over their array arguments, e.g. get_dy over a grid of
+# A values and trade sizes:
+#
+#   pool = StableSwapPool.from_contract("0xbEbc44782C7dB0a1A60Cb6fe97d0b483032FF1C7", 3)
+#   A = np.arange(100, 5001, 100)[:, None]
+#   dx = (np.logspace(3, 9, 50) * 10 ** 18).astype(object)[None, :]
+#   dy = pool.get_dy(0, 1, dx, amp=A)   # (50, 50) grid
+
+import numpy as np
+
+from typing import Dict, List, Optional, Sequence, Tuple
+
+PRECISION = 10 ** 18
+FEE_DENOMINATOR = 10 ** 10
+MAX_ITERATIONS = 255
+# seconds a metapool uses its cached base pool virtual price
+BASE_CACHE_EXPIRES = 10 * 60
+
+
+def as_int_array(values) -> np.ndarray:
+    """Object array of python ints (floats such as 1e21 are converted exactly)."""
+    arr = np.asarray(values)
+    if arr.dtype == object or arr.dtype.kind == "f":
+        return np.array([int(v) for v in arr.ravel()], dtype=object).reshape(arr.shape)
+    return arr.astype(object)
+
+
+def _broadcast(*arrays) -> Tuple[Tuple[int, ...], List[np.ndarray]]:
+    """Broadcasts inputs against each other and flattens them to 1d object arrays."""
+    arrays = np.broadcast_arrays(*[as_int_array(a) for a in arrays])
+    shape = arrays[0].shape
+    return shape, [a.ravel().copy() for a in arrays]
+
+
+def _converged(new: np.ndarray, old: np.ndarray) -> np.ndarray:
+    diff = new - old
+    return ((diff <= 1) & (diff >= -1)).astype(bool)
+
+
+# ------- invariant --------- #
+
+
+def get_D(xp: Sequence, amp, a_precision: int = 1) -> np.ndarray:
+    """StableSwap invariant D for normalised balances `xp` (a sequence of N arrays).
+
+    `amp` is the raw A stored by the pool, i.e. including A_PRECISION for pools that
+    use it (a_precision=100), and the plain A for 3pool-era pools (a_precision=1).
+    """
+    n_coins = len(xp)
+    shape, (amp, *xp) = _broadcast(amp, *xp)
+    S = sum(xp)
+    D = S.copy()
+    Ann = amp * n_coins
+
+    # pools with zero balances have D = 0 and would divide by zero below
+    active = np.nonzero((S != 0).astype(bool))[0]
+    for _ in range(MAX_ITERATIONS):
+        if not len(active):
+            break
+        d = D[active]
+        D_P = d
+        for x in xp:
+            D_P = D_P * d // (x[active] * n_coins)
+        ann = Ann[active]
+        new = (
+            (ann * S[active] // a_precision + D_P * n_coins)
+            * d
+            // ((ann - a_precision) * d // a_precision + (n_coins + 1) * D_P)
+        )
+        D[active] = new
+        active = active[~_converged(new, d)]
+
+    return D.reshape(shape)
+
+
+def _solve_y(c: np.ndarray, b: np.ndarray, D: np.ndarray) -> np.ndarray:
+    y = D.copy()
+    active = np.arange(len(y))
+    for _ in range(MAX_ITERATIONS):
+        if not len(active):
+            break
+        y_prev = y[active]
+        new = (y_prev * y_prev + c[active]) // (2 * y_prev + b[active] - D[active])
+        y[active] = new
+        active = active[~_converged(new, y_prev)]
+    return y
+
+
+def get_y(i: int, j: int, x, xp: Sequence, amp, a_precision: int = 1, D=None) -> np.ndarray:
+    """New balance of coin j given that coin i's normalised balance becomes x."""
+    n_coins = len(xp)
+    if D is None:
+        D = get_D(xp, amp, a_precision)
+    shape, (x, amp, D, *xp) = _broadcast(x, amp, D, *xp)
+    Ann = amp * n_coins
+
+    c = D.copy()
+    S_ = 0
+    for k in range(n_coins):
+        if k == i:
+            _x = x
+        elif k != j:
+            _x = xp[k]
+        else:
+            continue
+        S_ = S_ + _x
+        c = c * D // (_x * n_coins)
+    c = c * D * a_precision // (Ann * n_coins)
+    b = S_ + D * a_precision // Ann
+
+    return _solve_y(c, b, D).reshape(shape)
+
+
+def get_y_D(amp, i: int, xp: Sequence, D, a_precision: int = 1) -> np.ndarray:
+    """Balance of coin i that keeps the other balances on invariant D."""
+    n_coins = len(xp)
+    shape, (amp, D, *xp) = _broadcast(amp, D, *xp)
+    Ann = amp * n_coins
+
+    c = D.copy()
+    S_ = 0
+    for k in range(n_coins):
+        if k == i:
+            continue
+        S_ = S_ + xp[k]
+        c = c * D // (xp[k] * n_coins)
+    c = c * D * a_precision // (Ann * n_coins)
+    b = S_ + D * a_precision // Ann
+
+    return _solve_y(c, b, D).reshape(shape)
+
+
+def ramp_A(
+    timestamp, initial_A: int, initial_A_time: int, future_A: int, future_A_time: int
+) -> np.ndarray:
+    """Pool A at `timestamp` (scalar or array) while a ramp is in progress."""
+    shape, (t,) = _broadcast(timestamp)
+    if future_A_time == initial_A_time:
+        return np.full(shape, future_A, dtype=object)
+    elapsed = np.minimum(t, future_A_time) - initial_A_time
+    duration = future_A_time - initial_A_time
+    if future_A > initial_A:
+        A = initial_A + (future_A - initial_A) * elapsed // duration
+    else:
+        A = initial_A - (initial_A - future_A) * elapsed // duration
+    A = np.where((t >= future_A_time).astype(bool), future_A, A)
+    return A.reshape(shape)
+
+
+# ------- pools --------- #
+
+
+class StableSwapPool:
+    """State of a StableSwap pool, with the contract's view functions.
+
+    Every method takes optional `amp` / `balances` overrides, which may be arrays, so
+    the same seeded state can be evaluated over whole grids at once.
+
+    Args:
+        balances (list(int)): coin balances in native units
+        rates (list(int)): 10 ** (36 - decimals) per coin (the contracts' RATES)
+        A (int): raw A as stored by the pool (A * A_PRECISION where applicable)
+        fee (int): swap fee, 1e10 = 100%
+        admin_fee (int): share of the fee kept by the DAO, 1e10 = 100%
+        total_supply (int): LP token supply
+        a_precision (int): 1 for 3pool-era pools, 100 for newer ones
+        fee_on_xp (bool): take the fee before converting dy back to native units (factory
+            pools) instead of after (3pool). The two differ in the last wei.
+        ramp (tuple): (initial_A, initial_A_time, future_A, future_A_time), if known
+    """
+
+    def __init__(
+        self,
+        balances: Sequence[int],
+        rates: Sequence[int],
+        A: int,
+        fee: int,
+        admin_fee: int = 5 * 10 ** 9,
+        total_supply: int = None,
+        a_precision: int = 1,
+        fee_on_xp: bool = False,
+        ramp: Optional[Tuple[int, int, int, int]] = None,
+    ):
+        self.n_coins = len(balances)
+        self.balances = [int(b) for b in balances]
+        self.rates = [int(r) for r in rates]
+        self.A = int(A)
+        self.fee = int(fee)
+        self.admin_fee = int(admin_fee)
+        self.total_supply = total_supply
+        self.a_precision = a_precision
+        self.fee_on_xp = fee_on_xp
+        self.ramp = ramp
+
+    @staticmethod
+    def read_state(contract, n_coins: int, block: int = None) -> Dict:
+        """The raw on-chain inputs of the pool's math at `block` (default latest), as a
+        json-serialisable dict that `from_state` turns into a pool.
+
+        Args:
+            contract: pool address or brownie Contract
+            n_coins (int): number of coins in the pool
+        """
+        from brownie import web3
+
+        from utils import init_contract
+
+        if isinstance(contract, str):
+            contract = init_contract(contract)
+        # all reads at the same block, also when following the head
+        block = web3.eth.get_block(block if block is not None else "latest")
+        kw = {"block_identifier": block.number}
+
+        if hasattr(contract, "A_precise"):
+            A, a_precision = contract.A_precise(**kw), 100
+        else:
+            A, a_precision = contract.A(**kw), 1
+        if hasattr(contract, "token"):
+            total_supply = init_contract(contract.token(**kw)).totalSupply(**kw)
+        else:
+            total_supply = contract.totalSupply(**kw)
+
+        return {
+            "block": block.number,
+            "timestamp": block.timestamp,
+            "balances": [int(contract.balances(i, **kw)) for i in range(n_coins)],
+            "decimals": [
+                int(init_contract(contract.coins(i, **kw)).decimals()) for i in range(n_coins)
+            ],
+            "A": int(A),
+            "a_precision": a_precision,
+            "ramp": [
+                int(contract.initial_A(**kw)),
+                int(contract.initial_A_time(**kw)),
+                int(contract.future_A(**kw)),
+                int(contract.future_A_time(**kw)),
+            ],
+            "fee": int(contract.fee(**kw)),
+            "admin_fee": int(contract.admin_fee(**kw)),
+            "total_supply": int(total_supply),
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict, **kwargs):
+        """Pool from a `read_state` dict (e.g. recorded in a fixture)."""
+        params = dict(
+            A=state["A"],
+            fee=state["fee"],
+            admin_fee=state["admin_fee"],
+            total_supply=state["total_supply"],
+            a_precision=state["a_precision"],
+            fee_on_xp=state["a_precision"] != 1,
+            ramp=tuple(state["ramp"]),
+        )
+        params.update(kwargs)
+        rates = [10 ** (36 - decimals) for decimals in state["decimals"]]
+        return cls(state["balances"], rates, **params)
+
+    @classmethod
+    def from_contract(cls, contract, n_coins: int, block: int = None, **kwargs):
+        """Seeds the pool from one on-chain state read (at `block`, default latest).
+
+        Args:
+            contract: pool address or brownie Contract
+            n_coins (int): number of coins in the pool
+        """
+        return cls.from_state(cls.read_state(contract, n_coins, block), **kwargs)
+
+    # ------- helpers --------- #
+
+    def A_at(self, timestamp) -> np.ndarray:
+        """Raw A at `timestamp` given the ramp read at seeding time."""
+        if self.ramp is None:
+            return np.full(np.shape(timestamp), self.A, dtype=object)
+        return ramp_A(timestamp, *self.ramp)
+
+    def _amp(self, amp):
+        return self.A if amp is None else as_int_array(amp)
+
+    def _balances(self, balances):
+        if balances is None:
+            return self.balances
+        return [as_int_array(b) for b in balances]
+
+    def xp(self, balances=None) -> List:
+        balances = self._balances(balances)
+        return [b * r // PRECISION for b, r in zip(balances, self.rates)]
+
+    # ------- views --------- #
+
+    def get_D(self, amp=None, balances=None) -> np.ndarray:
+        return get_D(self.xp(balances), self._amp(amp), self.a_precision)
+
+    def get_virtual_price(self, amp=None, balances=None) -> np.ndarray:
+        return self.get_D(amp, balances) * PRECISION // self.total_supply
+
+    def get_dy(self, i: int, j: int, dx, amp=None, balances=None) -> np.ndarray:
+        """Output amount of coin j for `dx` of coin i, after fees."""
+        amp = self._amp(amp)
+        xp = self.xp(balances)
+        rates = self.rates
+
+        x = xp[i] + as_int_array(dx) * rates[i] // PRECISION
+        y = get_y(i, j, x, xp, amp, self.a_precision)
+        dy = xp[j] - y - 1
+        if self.fee_on_xp:
+            fee = self.fee * dy // FEE_DENOMINATOR
+            return (dy - fee) * PRECISION // rates[j]
+
+        dy = dy * PRECISION // rates[j]
+        return dy - self.fee * dy // FEE_DENOMINATOR
+
+    def calc_token_amount(self, amounts: Sequence, deposit: bool, amp=None, balances=None):
+        """LP tokens minted (burned) for depositing (withdrawing) `amounts`, without
+        fees, like the contract's calc_token_amount."""
+        amp = self._amp(amp)
+        balances = self._balances(balances)
+        D0 = get_D(self.xp(balances), amp, self.a_precision)
+        sign = 1 if deposit else -1
+        new_balances = [b + sign * as_int_array(a) for b, a in zip(balances, amounts)]
+        D1 = get_D(self.xp(new_balances), amp, self.a_precision)
+        diff = D1 - D0 if deposit else D0 - D1
+        return diff * self.total_supply // D0
+
+    def calc_withdraw_one_coin(self, token_amount, i: int, amp=None, balances=None):
+        """Amount of coin i received for burning `token_amount` LP tokens."""
+        return self._calc_withdraw_one_coin(token_amount, i, amp, balances)[0]
+
+    def _calc_withdraw_one_coin(self, token_amount, i: int, amp=None, balances=None):
+        amp = self._amp(amp)
+        n_coins = self.n_coins
+        fee = self.fee * n_coins // (4 * (n_coins - 1))
+        xp = self.xp(balances)
+
+        D0 = get_D(xp, amp, self.a_precision)
+        D1 = D0 - as_int_array(token_amount) * D0 // self.total_supply
+        new_y = get_y_D(amp, i, xp, D1, self.a_precision)
+
+        xp_reduced = []
+        for k in range(n_coins):
+            if k == i:
+                dx_expected = xp[k] * D1 // D0 - new_y
+            else:
+                dx_expected = xp[k] - xp[k] * D1 // D0
+            xp_reduced.append(xp[k] - fee * dx_expected // FEE_DENOMINATOR)
+
+        dy = xp_reduced[i] - get_y_D(amp, i, xp_reduced, D1, self.a_precision)
+        dy_0 = (xp[i] - new_y) * PRECISION // self.rates[i]
+        dy = (dy - 1) * PRECISION // self.rates[i]
+        return dy, dy_0 - dy
+
+    # ------- state changes --------- #
+
+    def exchange(self, i: int, j: int, dx: int) -> int:
+        """Applies a swap to the pool state (scalar only) and returns dy.
+
+        Note that `exchange` always takes the fee before converting to native units,
+        so for 3pool-era pools it can differ from `get_dy` by a wei, as on-chain.
+        """
+        xp = self.xp()
+        x = xp[i] + int(dx) * self.rates[i] // PRECISION
+        y = int(get_y(i, j, x, xp, self.A, self.a_precision))
+        dy = xp[j] - y - 1
+        dy_fee = dy * self.fee // FEE_DENOMINATOR
+        dy = (dy - dy_fee) * PRECISION // self.rates[j]
+
+        # the admin share of the fee leaves the pool balances
+        dy_admin_fee = dy_fee * self.admin_fee // FEE_DENOMINATOR
+        dy_admin_fee = dy_admin_fee * PRECISION // self.rates[j]
+
+        self.balances[i] += int(dx)
+        self.balances[j] -= dy + dy_admin_fee
+        return dy
+
+    def set_A(self, A: int) -> None:
+        self.A = int(A)
+        self.ramp = None
+
+
+class MetaPool(StableSwapPool):
+    """StableSwap metapool: coin 1 is the LP token of `base_pool`, priced at the base
+    pool's virtual price.
+
+    Args:
+        base_pool (StableSwapPool): the base pool (e.g. 3pool)
+        base_virtual_price (int): the virtual price the metapool uses, defaults to the
+            one implied by the base pool state
+    """
+
+    def __init__(
+        self,
+        *args,
+        base_pool: StableSwapPool = None,
+        base_virtual_price: int = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.base_pool = base_pool
+        if base_virtual_price is None:
+            base_virtual_price = int(base_pool.get_virtual_price())
+        self.base_virtual_price = base_virtual_price
+        self.rates = [self.rates[0], base_virtual_price]
+
+    @staticmethod
+    def read_state(contract, n_coins: int = 2, block: int = None) -> Dict:
+        """`StableSwapPool.read_state` plus the metapool's cached base virtual price."""
+        from utils import init_contract
+
+        if isinstance(contract, str):
+            contract = init_contract(contract)
+        state = StableSwapPool.read_state(contract, n_coins, block)
+        kw = {"block_identifier": state["block"]}
+
+        state["base_virtual_price"] = int(contract.base_virtual_price(**kw))
+        if hasattr(contract, "base_cache_updated"):
+            state["base_cache_updated"] = int(contract.base_cache_updated(**kw))
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict, base_pool: StableSwapPool = None, **kwargs):
+        """Metapool from a `read_state` dict and the base pool at the same block."""
+        # mirror the metapool's _vp_rate_ro: the cached virtual price is used for
+        # BASE_CACHE_EXPIRES seconds after it was last updated
+        vp = state["base_virtual_price"]
+        cache_updated = state.get("base_cache_updated")
+        if cache_updated is not None and state["timestamp"] > cache_updated + BASE_CACHE_EXPIRES:
+            vp = int(base_pool.get_virtual_price())
+        return super().from_state(state, base_pool=base_pool, base_virtual_price=vp, **kwargs)
+
+    @classmethod
+    def from_contract(cls, contract, base_pool: StableSwapPool, block: int = None, **kwargs):
+        return cls.from_state(cls.read_state(contract, 2, block), base_pool, **kwargs)
+
+    def get_dy_underlying(self, i: int, j: int, dx, amp=None, balances=None) -> np.ndarray:
+        """Swap between the metapool coin (0) and the base pool coins (1..n)."""
+        base = self.base_pool
+        max_coin = self.n_coins - 1
+        amp = self._amp(amp)
+        rates = self.rates
+        xp = self.xp(balances)
+        dx = as_int_array(dx)
+
+        meta_i = 0 if i == 0 else 1
+        meta_j = 0 if j == 0 else 1
+        base_i = i - max_coin
+        base_j = j - max_coin
+
+        if i == 0:
+            x = xp[i] + dx * (rates[0] // PRECISION)
+        elif j == 0:
+            base_inputs = [dx if k == base_i else 0 for k in range(base.n_coins)]
+            x = base.calc_token_amount(base_inputs, True) * rates[1] // PRECISION
+            # accounting for deposit/withdraw fees approximately
+            x = x - x * base.fee // (2 * FEE_DENOMINATOR)
+            x = x + xp[max_coin]
+        else:
+            return base.get_dy(base_i, base_j, dx)
+
+        y = get_y(meta_i, meta_j, x, xp, amp, self.a_precision)
+        dy = xp[meta_j] - y - 1
+        dy = dy - self.fee * dy // FEE_DENOMINATOR
+
+        if j == 0:
+            return dy // (rates[0] // PRECISION)
+        return base.calc_withdraw_one_coin(dy * PRECISION // rates[1], base_j)
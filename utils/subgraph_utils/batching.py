@@ -0,0 +1,162 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+import pandas as pd
+
+from utils.subgraph_utils.client import PAGE_SIZE, SubgraphClient, SubgraphError, render_where
+
+# The Graph rejects documents that are too expensive to run; these keep a merged
+# document well inside the limits of the hosted service
+MAX_ALIASES = 50
+MAX_ROWS = 50_000
+
+
+class EntityQuery(NamedTuple):
+    """One small entity query, e.g. the daily snapshots of one pool on one chain.
+
+    `key` identifies the query in the results (e.g. ("Matic", pool)); `first` caps the
+    number of rows fetched (None fetches every matching entity).
+    """
+
+    key: Hashable
+    url: str
+    entity: str
+    fields: List[str]
+    where: Optional[Dict] = None
+    block: Optional[int] = None
+    first: Optional[int] = None
+
+
+class _Page(NamedTuple):
+    query: EntityQuery
+    last_id: str
+    fetched: int
+
+    @property
+    def size(self) -> int:
+        if self.query.first is None:
+            return PAGE_SIZE
+        return min(PAGE_SIZE, self.query.first - self.fetched)
+
+
+def _fields(query: EntityQuery) -> List[str]:
+    return ["id"] + [field for field in query.fields if field != "id"]
+
+
+def render_page(alias: str, page: _Page) -> str:
+    """One aliased root field: `{alias}: {entity}(...) { fields }`."""
+    query = page.query
+    where = {**(query.where or {}), "id_gt": page.last_id}
+    block_arg = f", block: {{number: {int(query.block)}}}" if query.block is not None else ""
+    return (
+        f"{alias}: {query.entity}(first: {page.size}, orderBy: id, orderDirection: asc, "
+        f"where: {render_where(where)}{block_arg}) {{ {' '.join(_fields(query))} }}"
+    )
+
+
+def plan_documents(
+    pages: List[_Page], max_aliases: int = MAX_ALIASES, max_rows: int = MAX_ROWS
+) -> List[List[_Page]]:
+    """Greedily packs pages into documents of at most `max_aliases` root fields and
+    `max_rows` requested rows, keeping pages of one endpoint together."""
+    documents = []
+    by_url: Dict[str, List[_Page]] = {}
+    for page in pages:
+        by_url.setdefault(page.query.url, []).append(page)
+
+    for url_pages in by_url.values():
+        document, rows = [], 0
+        for page in url_pages:
+            if document and (len(document) >= max_aliases or rows + page.size > max_rows):
+                documents.append(document)
+                document, rows = [], 0
+            document.append(page)
+            rows += page.size
+        if document:
+            documents.append(document)
+    return documents
+
+
+class SubgraphBatcher:
+    """Runs many small entity queries against one or more subgraphs with few requests.
+
+    Queries against the same endpoint are merged into aliased GraphQL documents (see
+    `plan_documents`), the documents of all endpoints are posted concurrently, and
+    the aliased results are split back per query. Queries that fill their page are
+    continued with `id_gt` cursors in the next round, so every query is paginated
+    like `SubgraphClient.paginate`. A document that keeps failing is split in two to
+    isolate the query causing the error.
+
+    Args:
+        max_aliases (int): root fields per document
+        max_rows (int): rows requested per document
+        max_workers (int): concurrent requests across all endpoints
+        max_retries (int): attempts per document (see `SubgraphClient.query`)
+    """
+
+    def __init__(
+        self,
+        max_aliases: int = MAX_ALIASES,
+        max_rows: int = MAX_ROWS,
+        max_workers: int = 8,
+        max_retries: int = 5,
+    ):
+        self.max_aliases = max_aliases
+        self.max_rows = max_rows
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.clients: Dict[str, SubgraphClient] = {}
+
+    @property
+    def requests_sent(self) -> int:
+        return sum(client.requests_sent for client in self.clients.values())
+
+    def _client(self, url: str) -> SubgraphClient:
+        if url not in self.clients:
+            self.clients[url] = SubgraphClient(url, max_retries=self.max_retries)
+        return self.clients[url]
+
+    def _run_document(self, document: List[_Page]) -> List[Tuple[_Page, List[Dict]]]:
+        body = "\n".join(render_page(f"q{i}", page) for i, page in enumerate(document))
+        try:
+            data = self._client(document[0].query.url).query(f"{{\n{body}\n}}")
+        except SubgraphError:
+            if len(document) == 1:
+                raise
+            mid = len(document) // 2
+            return self._run_document(document[:mid]) + self._run_document(document[mid:])
+        return [(page, data[f"q{i}"]) for i, page in enumerate(document)]
+
+    def fetch(self, queries: Iterable[EntityQuery]) -> Dict[Hashable, pd.DataFrame]:
+        """Results of every query as {query.key: DataFrame of its entities}."""
+        queries = list(queries)
+        rows: Dict[Hashable, List[Dict]] = {query.key: [] for query in queries}
+        if len(rows) != len(queries):
+            raise ValueError("query keys must be unique")
+        for query in queries:
+            # create clients up front, the workers only read the dict
+            self._client(query.url)
+
+        pending = [page for page in (_Page(query, "", 0) for query in queries) if page.size > 0]
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending:
+                documents = plan_documents(pending, self.max_aliases, self.max_rows)
+                pending = []
+                for results in executor.map(self._run_document, documents):
+                    for page, page_rows in results:
+                        rows[page.query.key].extend(page_rows)
+                        fetched = page.fetched + len(page_rows)
+                        if len(page_rows) == page.size:
+                            next_page = _Page(page.query, page_rows[-1]["id"], fetched)
+                            if next_page.size > 0:
+                                pending.append(next_page)
+
+        return {
+            query.key: pd.DataFrame(rows[query.key], columns=_fields(query))
+            for query in queries
+        }
+
+
+def fetch_batched(queries: Iterable[EntityQuery], **kwargs) -> Dict[Hashable, pd.DataFrame]:
+    """`SubgraphBatcher(**kwargs).fetch(queries)`."""
+    return SubgraphBatcher(**kwargs).fetch(queries)
@@ -0,0 +1,210 @@
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+from typing import Dict, Iterator, List, Optional
+
+PAGE_SIZE = 1000
+
+
+class SubgraphError(Exception):
+    pass
+
+
+def render_where(where: Dict) -> str:
+    """Renders a dict of filters as a GraphQL `where` object literal."""
+
+    def render(value):
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, (int, np.integer)):
+            return f'"{int(value)}"'
+        if isinstance(value, (list, tuple)):
+            return f"[{', '.join(render(v) for v in value)}]"
+        return f'"{value}"'
+
+    return "{" + ", ".join(f"{key}: {render(value)}" for key, value in where.items()) + "}"
+
+
+class SubgraphClient:
+    """Client for a Graph Protocol subgraph that pages through entities with `id_gt`
+    cursors instead of `skip`, so deep pages cost the same as the first one and are
+    not capped.
+
+    Args:
+        url (str): subgraph endpoint
+        page_size (int): entities per page (the Graph caps this at 1000)
+        max_retries (int): attempts per page on transient errors
+        max_workers (int): concurrent windows for `paginate_windows`
+    """
+
+    def __init__(
+        self,
+        url: str,
+        page_size: int = PAGE_SIZE,
+        max_retries: int = 5,
+        max_workers: int = 8,
+    ):
+        self.url = url
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.max_workers = max_workers
+        self.requests_sent = 0
+        self._local = threading.local()
+
+    @property
+    def session(self) -> requests.Session:
+        # requests sessions are not thread safe, so every window worker gets its own
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def query(self, query: str, variables: Dict = None) -> Dict:
+        """Posts a GraphQL query, retrying HTTP failures and subgraph errors with
+        exponential backoff. Returns the `data` field of the response."""
+        error = None
+        for attempt in range(self.max_retries):
+            try:
+                self.requests_sent += 1
+                r = self.session.post(
+                    self.url, json={"query": query, "variables": variables or {}}
+                )
+                r.raise_for_status()
+                payload = r.json()
+                if payload.get("data") is not None and not payload.get("errors"):
+                    return payload["data"]
+                error = payload.get("errors", payload)
+            except (requests.RequestException, ValueError) as e:
+                error = e
+            time.sleep(min(2 ** attempt, 30))
+
+        raise SubgraphError(f"{self.url} failed after {self.max_retries} attempts: {error}")
+
+    def paginate(
+        self,
+        entity: str,
+        fields: List[str],
+        where: Dict = None,
+        block: Optional[int] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """Yields every `entity` matching `where` as DataFrame chunks of one page each.
+
+        Args:
+            entity (str): plural entity name, e.g. "poolSnapshots"
+            fields (list(str)): fields to select; `id` is always included
+            where (dict): extra filters, e.g. {"pool": "0x..", "timestamp_gte": 1600000000}
+            block (int): query the subgraph as of this block
+        """
+        where = dict(where or {})
+        fields = ["id"] + [field for field in fields if field != "id"]
+        block_arg = f", block: {{number: {int(block)}}}" if block is not None else ""
+        last_id = ""
+        while True:
+            where["id_gt"] = last_id
+            query = f"""{{
+              {entity}(
+                first: {self.page_size},
+                orderBy: id,
+                orderDirection: asc,
+                where: {render_where(where)}{block_arg}
+              ) {{
+                {" ".join(fields)}
+              }}
+            }}"""
+            rows = self.query(query)[entity]
+            if not rows:
+                return
+            yield pd.DataFrame(rows)
+            if len(rows) < self.page_size:
+                return
+            last_id = rows[-1]["id"]
+
+    def paginate_windows(
+        self,
+        entity: str,
+        fields: List[str],
+        window_field: str,
+        start: int,
+        end: int,
+        n_windows: int = None,
+        where: Dict = None,
+        block: Optional[int] = None,
+    ) -> Iterator[pd.DataFrame]:
+        """Splits [start, end) of a numeric field (block, timestamp) into windows and
+        paginates them concurrently, yielding chunks as they arrive (so chunks from
+        different windows interleave). If the consumer stops early, the workers stop
+        after their current page.
+        """
+        n_windows = n_windows or self.max_workers
+        edges = np.unique(np.linspace(start, end, n_windows + 1).astype(np.int64))
+        windows = list(zip(edges[:-1], edges[1:]))
+
+        chunks = queue.Queue(maxsize=self.max_workers * 4)
+        done = object()
+        stop = threading.Event()
+        todo = queue.Queue()
+        for window in windows:
+            todo.put(window)
+
+        def put(item) -> bool:
+            # a full queue nobody reads any more must not block the worker forever
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def worker():
+            try:
+                while not stop.is_set():
+                    try:
+                        lo, hi = todo.get_nowait()
+                    except queue.Empty:
+                        return
+                    window_where = dict(where or {})
+                    window_where[f"{window_field}_gte"] = int(lo)
+                    window_where[f"{window_field}_lt"] = int(hi)
+                    for chunk in self.paginate(entity, fields, window_where, block):
+                        if not put(chunk):
+                            return
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        threads = [
+            threading.Thread(target=worker, daemon=True)
+            for _ in range(min(self.max_workers, len(windows)))
+        ]
+        for thread in threads:
+            thread.start()
+
+        try:
+            finished = 0
+            while finished < len(threads):
+                item = chunks.get()
+                if item is done:
+                    finished += 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield item
+        finally:
+            stop.set()
+
+    def fetch_all(self, entity: str, fields: List[str], **kwargs) -> pd.DataFrame:
+        """`paginate` (or `paginate_windows` if `window_field` is given) concatenated
+        into a single DataFrame."""
+        if "window_field" in kwargs:
+            chunks = list(self.paginate_windows(entity, fields, **kwargs))
+        else:
+            chunks = list(self.paginate(entity, fields, **kwargs))
+        if not chunks:
+            return pd.DataFrame(columns=["id"] + [field for field in fields if field != "id"])
+        return pd.concat(chunks, ignore_index=True)
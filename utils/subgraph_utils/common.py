@@ -1,34 +1,21 @@
 import pandas as pd
-import requests
 
+from utils.subgraph_utils.client import SubgraphClient
 from utils.subgraph_utils.constants import CRV_EMISSIONS, SUBGRAPH_API
 
 
 def get_curve_fees(pool_token_addr: str) -> pd.DataFrame:
     # needs pool token addr and not pool addr:
-    query = f'''
-    {{
-      poolSnapshots (
-        where:{{
-          pool: "{pool_token_addr.lower()}"
-        }}
-      )
-      {{
-        fees
-        block
-      }}
-    }}
-    '''
+    client = SubgraphClient(CRV_EMISSIONS)
+    data = client.fetch_all(
+        "poolSnapshots", ["fees", "block"], where={"pool": pool_token_addr.lower()}
+    )
 
-    r = requests.post(CRV_EMISSIONS, json={'query': query})
-    dict_response = dict(r.json())
+    if data.empty:
+        raise ValueError(f"No data in subgraph for: {pool_token_addr}")
 
-    try:
-        data = pd.DataFrame(dict_response['data']['poolSnapshots'])
-        data['block'] = data.block.astype(int)
-        data['fees'] = data.fees.astype(float)
-    except KeyError:
-        raise f"No data in subgraph for: {pool_token_addr}"
-
-    return data
+    data = data.drop(columns="id")
+    data['block'] = data.block.astype(int)
+    data['fees'] = data.fees.astype(float)
 
+    return data.sort_values("block").reset_index(drop=True)
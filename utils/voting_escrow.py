@@ -0,0 +1,205 @@
+import numpy as np
+import pandas as pd
+
+from typing import Dict, List, Union
+
+VOTING_ESCROW = "0x5f3b5DfEb7B28CDbD7FAba78963EE202a494e2A2"
+VOTING_ESCROW_START_BLOCK = 10647813
+
+WEEK = 7 * 86400
+MAXTIME = 4 * 365 * 86400
+
+DEPOSIT_EVENT = {
+    "name": "Deposit",
+    "type": "event",
+    "anonymous": False,
+    "inputs": [
+        {"name": "provider", "type": "address", "indexed": True},
+        {"name": "value", "type": "uint256", "indexed": False},
+        {"name": "locktime", "type": "uint256", "indexed": True},
+        {"name": "type", "type": "int128", "indexed": False},
+        {"name": "ts", "type": "uint256", "indexed": False},
+    ],
+}
+WITHDRAW_EVENT = {
+    "name": "Withdraw",
+    "type": "event",
+    "anonymous": False,
+    "inputs": [
+        {"name": "provider", "type": "address", "indexed": True},
+        {"name": "value", "type": "uint256", "indexed": False},
+        {"name": "ts", "type": "uint256", "indexed": False},
+    ],
+}
+
+Timestamps = Union[int, List[int], np.ndarray]
+
+
+def _as_array(timestamps: Timestamps) -> (np.ndarray, bool):
+    single = np.ndim(timestamps) == 0
+    return np.atleast_1d(np.asarray(timestamps, dtype=np.int64)), single
+
+
+def _output(values: np.ndarray, single: bool, exact: bool):
+    if not exact:
+        values = values.astype(np.float64)
+    return values[0] if single else values
+
+
+class VotingEscrowHistory:
+    """veCRV voting power rebuilt from the VotingEscrow's Deposit and Withdraw events.
+
+    Every event is a checkpoint of one user's lock: (amount, end) after the event, at
+    the event's timestamp. Between checkpoints a user's voting power decays linearly
+    as in the contract, `slope * (end - t)` with `slope = amount // MAXTIME`, so the
+    balance of any user and the total supply at any timestamp follow from the
+    checkpoints without calling the contract.
+
+    The results are exact integers as the contract computes them for a timestamp.
+    `balanceOfAt`/`totalSupplyAt` take a block instead, whose timestamp the contract
+    interpolates between its global checkpoints, so they can differ from the values
+    at the block's actual timestamp by a few seconds worth of decay.
+
+    Args:
+        checkpoints (pd.DataFrame): one row per lock change with user, timestamp,
+            block_number, amount and end, sorted by (block_number, log_index), see
+            `from_events`. A `slope` column (python ints) is added.
+    """
+
+    def __init__(self, checkpoints: pd.DataFrame):
+        self.checkpoints = checkpoints.reset_index(drop=True)
+
+        ts = self.checkpoints.timestamp.values.astype(np.int64)
+        end = self.checkpoints.end.values.astype(np.int64)
+        # python ints: slopes and biases overflow int64 and lose precision as floats
+        slope = np.array([amount // MAXTIME for amount in self.checkpoints.amount], dtype=object)
+        self.checkpoints["slope"] = slope
+        self._slope = slope
+
+        # a checkpoint is in force from its timestamp until the user's next checkpoint
+        # or the end of the lock, whichever comes first
+        following = self.checkpoints.groupby("user").timestamp.shift(-1).values
+        stop = end.copy()
+        superseded = ~np.isnan(following)
+        stop[superseded] = np.minimum(following[superseded].astype(np.int64), end[superseded])
+        live = (stop > ts) & (slope > 0).astype(bool)
+
+        # total supply is sum(slope * end) - sum(slope) * t over the checkpoints in
+        # force at t: accumulate both sums over the start/stop times of every checkpoint
+        times = np.concatenate([ts[live], stop[live]])
+        d_slope = np.concatenate([slope[live], -slope[live]])
+        d_bias = np.concatenate([slope[live] * end[live], -(slope[live] * end[live])])
+        order = np.argsort(times, kind="stable")
+        self._times = times[order]
+        self._slope_sum = np.cumsum(d_slope[order]) if len(order) else np.zeros(0, object)
+        self._bias_sum = np.cumsum(d_bias[order]) if len(order) else np.zeros(0, object)
+
+        self._users: Dict[str, np.ndarray] = self.checkpoints.groupby("user").indices
+
+    @classmethod
+    def from_events(cls, events: pd.DataFrame) -> "VotingEscrowHistory":
+        """Replays decoded Deposit and Withdraw logs (as written by `LogIndexer`).
+
+        Args:
+            events (pd.DataFrame): block_number, log_index, event, provider, value,
+                locktime and ts columns; uint256 values are decimal strings
+        """
+        events = events.sort_values(["block_number", "log_index"])
+        locks: Dict[str, List[int]] = {}
+        rows = []
+        for row in events.to_dict("records"):
+            user = row["provider"].lower()
+            amount, end = locks.get(user, (0, 0))
+            if row["event"] == "Deposit":
+                # deposit_for / create_lock / increase_amount add `value`,
+                # increase_unlock_time only moves the end; locktime is the new end
+                amount += int(row["value"])
+                end = int(row["locktime"])
+            elif row["event"] == "Withdraw":
+                amount, end = 0, 0
+            else:
+                continue
+            locks[user] = (amount, end)
+            rows.append((user, int(row["ts"]), int(row["block_number"]), amount, end))
+
+        columns = ["user", "timestamp", "block_number", "amount", "end"]
+        return cls(pd.DataFrame(rows, columns=columns))
+
+    @property
+    def users(self) -> List[str]:
+        return list(self._users)
+
+    # ------- queries --------- #
+
+    def total_supply(self, timestamps: Timestamps, exact: bool = False):
+        """veCRV total supply at one timestamp or an array of timestamps.
+
+        Args:
+            timestamps (int | array): unix timestamps
+            exact (bool): return python ints (as the contract computes them) instead
+                of float64
+
+        Returns:
+            float | int | np.ndarray: supply in wei (1e18 = 1 veCRV).
+        """
+        t, single = _as_array(timestamps)
+        idx = np.searchsorted(self._times, t, side="right") - 1
+        supply = np.zeros(len(t), dtype=object)
+        valid = idx >= 0
+        supply[valid] = self._bias_sum[idx[valid]] - self._slope_sum[idx[valid]] * t[valid]
+        return _output(supply, single, exact)
+
+    def balance_of(self, user: str, timestamps: Timestamps, exact: bool = False):
+        """A user's voting power at one timestamp or an array of timestamps."""
+        t, single = _as_array(timestamps)
+        balance = np.zeros(len(t), dtype=object)
+        rows = self._users.get(user.lower())
+        if rows is not None:
+            ts = self.checkpoints.timestamp.values[rows]
+            # the last checkpoint at or before each timestamp
+            idx = np.searchsorted(ts, t, side="right") - 1
+            valid = idx >= 0
+            picked = rows[idx[valid]]
+            end = self.checkpoints.end.values[picked].astype(np.int64)
+            balance[valid] = self._slope[picked] * np.maximum(end - t[valid], 0)
+        return _output(balance, single, exact)
+
+    def locks(self, timestamp: int) -> pd.DataFrame:
+        """Every user's lock (amount, end, slope) as of `timestamp`, indexed by user.
+        Expired locks that were not withdrawn yet are included."""
+        in_force = self.checkpoints[self.checkpoints.timestamp <= timestamp]
+        last = in_force.groupby("user").tail(1)
+        return last.set_index("user")[["amount", "end", "slope"]]
+
+    def balances(self, timestamp: int, exact: bool = False) -> pd.Series:
+        """Voting power of every user with a non-zero balance at `timestamp`."""
+        locks = self.locks(timestamp)
+        remaining = np.maximum(locks.end.values.astype(np.int64) - int(timestamp), 0)
+        balance = pd.Series(locks.slope.values * remaining, index=locks.index.values)
+        balance = balance[balance > 0]
+        return balance if exact else balance.astype(np.float64)
+
+    def slope_changes(self, timestamp: int) -> pd.Series:
+        """Scheduled decrease of the total slope at each future week boundary for the
+        locks in force at `timestamp` (the contract's `slope_changes`), in wei/s."""
+        locks = self.locks(timestamp)
+        ending = locks[locks.end.values > timestamp]
+        changes = pd.Series(ending.slope.values, index=ending.end.values)
+        return changes.groupby(level=0).sum().sort_index()
+
+
+def load_voting_escrow_history(to_block: int = None, rpc_url: str = None) -> VotingEscrowHistory:
+    """Indexes the VotingEscrow's Deposit and Withdraw logs (only the blocks since the
+    last run are fetched) and replays them.
+
+    Args:
+        to_block (int): last block, defaults to the last finalised block (see LogIndexer)
+        rpc_url (str): JSON-RPC endpoint, defaults to Alchemy
+    """
+    from utils.log_indexer import LogIndexer
+
+    indexer = LogIndexer(
+        "voting_escrow", VOTING_ESCROW, [DEPOSIT_EVENT, WITHDRAW_EVENT], rpc_url=rpc_url
+    )
+    indexer.update(from_block=VOTING_ESCROW_START_BLOCK, to_block=to_block)
+    return VotingEscrowHistory.from_events(indexer.load(VOTING_ESCROW_START_BLOCK, to_block))